@@ -4,29 +4,54 @@
 # * Copyright (c) 2022-2024 CAST.  All rights reserved. *
 # *******************************************************
 
+import glob
+import hashlib
 import json
 import os
 import argparse
 import subprocess
 import shutil
-import glob
+import itertools
 
 from alive_progress import alive_bar
 from argparse import Namespace
-from typing import Dict, NoReturn
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, NoReturn, Optional, Tuple
 
-from plugins.helper import run_selected_plugins, load_plugins, add_plugin
+from plugins.helper import run_selected_plugins, load_plugins, add_plugin, get_plugins_digest
+from src.asm_index import FunctionIndex, compute_fingerprint, split_function_lines
 from src.asm_parser import parse_function_asm
-from src.bbe_parser import BBEFileParser
+from src.bbe_parser import BBEFileParser, MODULE_PROFILE_FILE_NAME, split_by_modules
+from src.dot_writer import DOT_PROGRAM
+from src.file_reader import WHITESPACES, MappedFile, find_inputs, is_compressed, iter_lines, \
+    strip_compression_suffix
 from src.funcs_black_list import load_blacklist
 from src.opcodes import MAX_FUNCTION_NAME_LENGTH
 from src.graph import FlowGraph
-from src.ui.constants import ROOT_DIR, PLUGINS_JSON
-from src.xlsx_writer import XLSXWriter
+from src.inst_mix import compute_functions_mix
+from src.ir_cache import IRCache, DEFAULT_IR_CACHE_SIZE_MB, IR_SCHEMA, get_sources_digest
+from src.manifest import RunManifest
+from src.module_map import ModuleMap, get_module_name
+from src.profile_store import ProfileIndex
+from src.render_pool import LAYOUT_PROGRAM, POSITIONED_PROGRAM, RENDER_FORMATS, RENDER_REPORT_FILE_NAME, \
+    print_render_summary, render_dot_files, save_render_report
+from src.render_supervisor import DEFAULT_RENDER_TIMEOUT, RenderSupervisor, check_programs
+from src.ui.constants import ASM_GRAPH, ROOT_DIR, PLUGINS_JSON
+from src.xlsx_writer import XLSXWriter, RowsCollector
 
 CUR_DIR = os.path.dirname(os.path.abspath(__file__))
 OUT_DIR = os.path.join(CUR_DIR, "output")
 XLSX_SINGLETONS_FILE_NAME = "singletons.xlsx"
+XLSX_INST_MIX_SUFFIX = ".inst_mix.xlsx"
+# Outputs of the functions of shared libraries are named <module>.<function>, see process_asm_file
+MODULE_NAME_SEPARATOR = "."
+TEXT_SECTION_HEADER = b"Disassembly of section .text:"
+SECTION_HEADER = b"Disassembly of section"
+FUNCTION_HEADER_SUFFIX = b">:"
+
+# (singleton rows, checker rows, IR cache counters, the function is done)
+FunctionResult = Tuple[Optional[RowsCollector], Optional[RowsCollector], Tuple[int, int], bool]
 
 
 def disassemble_bin_to_asm(binary: str, objdump_path: str) -> str:
@@ -42,38 +67,202 @@ def disassemble_bin_to_asm(binary: str, objdump_path: str) -> str:
     return file_path
 
 
-def load_funcs(asm_path: str, func_name: str = None) -> Dict[str, str]:
-    with open(asm_path, "r") as asm:
-        lines = asm.readlines()
+def get_function_address(header: str) -> Optional[int]:
+    try:
+        return int(header.split()[0], 16)
+    except (ValueError, IndexError):
+        return None
+
+
+def get_end_address(asm: MappedFile, start: int, end: int) -> Optional[int]:
+    """
+    Returns the address just past the start of the last instruction in [start, end) of the listing.
+    """
+    pos = end
+    while pos > start:
+        line_start = max(asm.line_start(pos - 1), start)
+        line = asm.read(line_start, pos).strip()
+        if b":" in line and not line.endswith(b":"):
+            try:
+                return int(line.split(b":", 1)[0], 16) + 1
+            except ValueError:
+                pass
+        pos = line_start
+
+    return None
+
+
+def get_function_range(content: str) -> Optional[Tuple[int, int]]:
+    """
+    Returns the [start, end) address range of the function body, the one the scan of the listing records.
+    """
+    data = content.encode()
+    start = get_function_address(content.split("\n", 1)[0])
+    end = get_end_address(MappedFile.from_bytes(data), 0, len(data))
+    return None if start is None or end is None else (start, end)
+
+
+def iter_mapped_funcs(asm_path: str, func_name: Optional[str], take_all: bool,
+                      functions_offsets: Dict[str, Tuple[int, int]],
+                      functions_ranges: List[Tuple[int, int, str]]) -> Iterator[Tuple[str, str]]:
+    """
+    Scans the memory-mapped disassembly for the text section and function headers, see iter_funcs.
+    Returns False when the listing has no text section.
+    """
+    with MappedFile(asm_path) as asm:
+        text_start = asm.find_line(TEXT_SECTION_HEADER, whole_line=True)
+        if text_start < 0:
+            return False
+
+        body_start = asm.line_end(text_start) + 1
+        body_end = asm.find_line(SECTION_HEADER, body_start)
+        if body_end < 0:
+            body_end = len(asm)
+
+        # Lines before the first function header go to the function with the empty name
+        curr_func_name = ""
+        curr_func_offset = body_start
+        curr_func_address = None
+
+        headers = asm.iter_lines_ending_with(FUNCTION_HEADER_SUFFIX, body_start, body_end)
+        for func_offset in itertools.chain(headers, [body_end]):
+            if curr_func_name:
+                functions_offsets[curr_func_name] = (curr_func_offset, func_offset - curr_func_offset)
+
+                end_address = get_end_address(asm, curr_func_offset, func_offset)
+                if curr_func_address is not None and end_address is not None:
+                    functions_ranges.append((curr_func_address, end_address, curr_func_name))
+
+            if take_all or func_name == curr_func_name:
+                lines = split_function_lines(asm.decode(curr_func_offset, func_offset))
+                if lines:
+                    yield curr_func_name, "\n".join(lines) + "\n"
+
+            if func_offset < body_end:
+                header = asm.decode(func_offset, asm.line_end(func_offset))
+                curr_func_name = header.split()[-1].strip("<>:")
+                curr_func_offset = func_offset
+                curr_func_address = get_function_address(header)
+
+    return True
+
+
+def iter_streamed_funcs(asm_path: str, func_name: Optional[str], take_all: bool,
+                        functions_offsets: Dict[str, Tuple[int, int]],
+                        functions_ranges: List[Tuple[int, int, str]]) -> Iterator[Tuple[str, str]]:
+    """
+    iter_mapped_funcs of compressed disassemblies, which cannot be mapped: the decompressed lines
+    are scanned as they are read and only the lines of the requested function being read are kept.
+    Returns False when the listing has no text section.
+    """
+    lines = iter_lines(asm_path)
+    body_start = None
+    for offset, line in lines:
+        if line.strip(WHITESPACES + b"\n") == TEXT_SECTION_HEADER:
+            body_start = offset + len(line)
+            break
+    if body_start is None:
+        return False
 
-    lines = [line.strip() for line in lines if line.strip()]
-    asm_funcs = {}
+    # Lines before the first function header go to the function with the empty name
     curr_func_name = ""
-    curr_func_content = ""
-    text_section = False
-    black_list = load_blacklist()
-
-    for line in lines:
-        if not text_section:
-            if line == "Disassembly of section .text:":
-                text_section = True
+    curr_func_offset = body_start
+    curr_func_address = None
+    end_address = None
+    body_lines = []
+    # Past the last line read, the text section ends there when no other section follows it
+    read_end = body_start
+
+    for line_offset, line in itertools.chain(lines, [(None, None)]):
+        stripped = b"" if line is None else line.strip(WHITESPACES + b"\n")
+        is_end = line is None or stripped.startswith(SECTION_HEADER)
+        if not is_end and not stripped.endswith(FUNCTION_HEADER_SUFFIX):
+            if take_all or func_name == curr_func_name:
+                body_lines.append(line)
+            # As get_end_address does from the end of the function
+            instruction = line.strip()
+            if b":" in instruction and not instruction.endswith(b":"):
+                try:
+                    end_address = int(instruction.split(b":", 1)[0], 16) + 1
+                except ValueError:
+                    pass
+            read_end = line_offset + len(line)
             continue
 
-        if line.startswith("Disassembly of section"):
+        func_offset = read_end if line is None else line_offset
+        if curr_func_name:
+            functions_offsets[curr_func_name] = (curr_func_offset, func_offset - curr_func_offset)
+            if curr_func_address is not None and end_address is not None:
+                functions_ranges.append((curr_func_address, end_address, curr_func_name))
+
+        if take_all or func_name == curr_func_name:
+            func_lines = split_function_lines(b"".join(body_lines).decode())
+            if func_lines:
+                yield curr_func_name, "\n".join(func_lines) + "\n"
+
+        if is_end:
             break
 
-        if line.endswith(">:"):
-            if curr_func_content:
-                if (func_name == "all" and func_name not in black_list) or (func_name == curr_func_name):
-                    asm_funcs[curr_func_name] = curr_func_content
-                curr_func_content = ""
-            curr_func_name = line.split()[-1].strip("<>:")
+        header = line.decode()
+        curr_func_name = header.split()[-1].strip("<>:")
+        curr_func_offset = func_offset
+        curr_func_address = get_function_address(header)
+        end_address = None
+        body_lines = [line] if take_all or func_name == curr_func_name else []
+        read_end = line_offset + len(line)
+
+    return True
+
+
+def iter_funcs(asm_path: str, func_name: str = "all") -> Iterator[Tuple[str, str]]:
+    """
+    Yields (function name, function body) pairs from the text section of the disassembly.
+    Only the bodies of the requested functions are decoded.
+
+    A complete scan also records the offset and the address range of each function in the sidecar index
+    of the file, which is used afterwards to read a single function directly.
+    """
+    if func_name != "all":
+        index = FunctionIndex.load(asm_path)
+        if index is not None:
+            content = index.read_function(func_name)
+            if content:
+                yield func_name, content
+            return
+
+    black_list = load_blacklist()
+    take_all = func_name == "all" and func_name not in black_list
+
+    fingerprint = compute_fingerprint(asm_path)
+    functions_offsets = {}
+    functions_ranges = []
+
+    scan = iter_streamed_funcs if is_compressed(asm_path) else iter_mapped_funcs
+    if not (yield from scan(asm_path, func_name, take_all, functions_offsets, functions_ranges)):
+        return
+
+    try:
+        FunctionIndex.from_scan(asm_path, fingerprint, functions_offsets, functions_ranges).save()
+    except OSError as e:
+        print(f"Warning: Cannot save functions index of {asm_path}: {e}")
+
 
-        if (func_name == "all" and func_name not in black_list) or (func_name == curr_func_name):
-            curr_func_content += line + "\n"
+def load_function_index(asm_path: str) -> Optional[FunctionIndex]:
+    """
+    Returns the sidecar index of the listing, the listing is scanned first
+    (without decoding any function) when it has no valid index.
+    """
+    index = FunctionIndex.load(asm_path)
+    if index is None:
+        for _ in iter_funcs(asm_path, None):
+            pass
+        index = FunctionIndex.load(asm_path)
 
-    if (func_name == "all" and func_name not in black_list) or (func_name == curr_func_name):
-        asm_funcs[curr_func_name] = curr_func_content
+    return index
+
+
+def load_funcs(asm_path: str, func_name: str = None) -> Dict[str, str]:
+    asm_funcs = dict(iter_funcs(asm_path, func_name))
 
     assert asm_funcs, "Cannot load functions."
     return asm_funcs
@@ -91,9 +280,28 @@ def parse_arguments() -> Namespace:
                              "By default will produce all functions from the text segment.")
     parser.add_argument("-c", "--bbexec", type=str, help="Path to the bbexec file or " \
                                                                       "to the dir with bbexec files.")
+    parser.add_argument("--libs", type=str, nargs="+", default=[],
+                        help="Paths to the assembly files of the shared libraries of the profiled process.\n"
+                             "Their functions are processed in the same run with the BBs of their modules.")
+    parser.add_argument("--module_map", type=str,
+                        help="Module map of the profiled process (/proc/<pid>/maps or 'name start end [base]' lines).\n"
+                             "By default the load bases of the libraries are inferred from the symbol names.")
     parser.add_argument("--dot", action="store_true", help="Create dot graphs for functions.")
+    parser.add_argument("--render", choices=RENDER_FORMATS,
+                        help="Render the dot graphs of the output directory into the given format with a pool\n"
+                             "of graphviz processes, one per CPU core. Up to date outputs are not rendered again.\n"
+                             f"The render time of each file is saved into {RENDER_REPORT_FILE_NAME}.")
+    parser.add_argument("--render_timeout", type=int, default=DEFAULT_RENDER_TIMEOUT,
+                        help="Time limit of the layout of a dot graph in seconds, 0 means no limit. The layout\n"
+                             "is retried with cheaper strategies above it. (by default: %(default)s)")
+    parser.add_argument("--render_memory", type=int, default=0,
+                        help="Memory limit of the layout of a dot graph in MB, 0 means no limit.\n"
+                             "The layout is retried with cheaper strategies above it. (by default: 0)")
     parser.add_argument("--min_exec_count", type=int, default=1000000,
                         help="Minimum number of times BB must be executed to process it with plugins.")
+    parser.add_argument("--inst_mix", action="store_true",
+                        help=f"Compute the executed instructions per instruction group (like llvm-mca)\n"
+                             f"of the functions into <asm>{XLSX_INST_MIX_SUFFIX} and print the groups of the binary.")
     parser.add_argument("-s", "--singletons", action="store_true",
                         help=f"Collect singleton basic blocks into the {XLSX_SINGLETONS_FILE_NAME}.")
     parser.add_argument("-o", "--output", type=str, default=OUT_DIR,
@@ -101,6 +309,19 @@ def parse_arguments() -> Namespace:
 
     parser.add_argument("--run_plugins", dest="plugins", action="store_true",
                         help=f"Run the enabled plugins from plugins/plugins.json")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of worker processes used to process functions.\n"
+                             "0 means one per CPU core. (by default: 1)")
+    parser.add_argument("--ir_cache", type=str,
+                        help="Directory of the cache of parsed functions.\n"
+                             "Functions with the same body are not parsed again by later runs.")
+    parser.add_argument("--ir_cache_size", type=int, default=DEFAULT_IR_CACHE_SIZE_MB,
+                        help=f"Size limit of the parsed functions cache in MB, the least recently used\n"
+                             f"functions are removed above it. (by default: {DEFAULT_IR_CACHE_SIZE_MB})")
+    parser.add_argument("--full", action="store_true",
+                        help="Process all functions again. By default the functions whose body, profile\n"
+                             "and settings did not change since the previous run into the output directory\n"
+                             "are not processed, their results are taken from its manifest.")
 
     group.add_argument("--add_plugin", type=str, nargs=2, metavar=('PLUGIN_NAME', 'PLUGIN_PATH'),
                         help="Add a custom plugin. Provide plugin name and file path.\n"
@@ -111,25 +332,59 @@ def parse_arguments() -> Namespace:
     if parsed_args.bin and not parsed_args.objdump:
         parser.error('--objdump is required when --bin is set.')
 
+    if parsed_args.inst_mix and not parsed_args.bbexec:
+        parser.error('--bbexec is required when --inst_mix is set.')
+
+    if parsed_args.module_map and not parsed_args.bbexec:
+        parser.error('--bbexec is required when --module_map is set.')
+
+    if parsed_args.jobs < 0:
+        parser.error('--jobs must be a non-negative number.')
+
+    if parsed_args.ir_cache_size <= 0:
+        parser.error('--ir_cache_size must be a positive number.')
+
+    if parsed_args.render and not parsed_args.dot:
+        parser.error('--dot is required when --render is set.')
+
+    if parsed_args.render_timeout < 0 or parsed_args.render_memory < 0:
+        parser.error('--render_timeout and --render_memory must be non-negative numbers.')
+
     return parsed_args
 
 
+def build_graph(func_content: str) -> FlowGraph:
+    asm_code = parse_function_asm(func_content)
+    return FlowGraph(asm_code)
+
+
+def get_short_name(function_name: str) -> str:
+    if len(function_name) > MAX_FUNCTION_NAME_LENGTH:
+        return function_name[-MAX_FUNCTION_NAME_LENGTH:]
+    return function_name
+
+
 def process_function(args: Namespace,
                      function_name: str,
                      func_content: str,
                      bbe_parser: BBEFileParser,
                      xlsx_for_singletons: XLSXWriter,
                      xlsx_for_plugins: XLSXWriter,
-                     plugins_data=None) -> NoReturn:
-    if len(function_name) > MAX_FUNCTION_NAME_LENGTH:
-        function_name = function_name[-MAX_FUNCTION_NAME_LENGTH:]
+                     plugins_data=None,
+                     ir_cache: IRCache = None) -> bool:
+    """
+    Returns False when the function is not processed completely (its graph is not drawn or not laid out fully).
+    """
+    function_name = get_short_name(function_name)
 
     if not func_content:
         print(f"Asm content for {function_name} is empty!")
         exit(1)
 
-    asm_code = parse_function_asm(func_content)
-    graph = FlowGraph(asm_code)
+    if ir_cache:
+        graph = ir_cache.get_or_build(func_content, build_graph)
+    else:
+        graph = build_graph(func_content)
 
     if bbe_parser:
         addresses = graph.get_bb_addresses()
@@ -137,15 +392,25 @@ def process_function(args: Namespace,
 
     graph.set_nodes_usage_info()
 
+    done = True
     if args.dot:
         dot_file = os.path.join(OUT_DIR, function_name + ".dot")
         try:
-            graph.draw_graph(dot_file)
-        except TimeoutError:
-            print("Time is out for func: ", function_name)
+            result = graph.draw_graph(dot_file, RenderSupervisor(args.render_timeout, args.render_memory))
+        except FileNotFoundError:
+            # Missing graphviz fails every graph, it stops the run (see check_programs)
+            raise
         except Exception as ex:
             print(str(ex))
-            return
+            return False
+
+        if not result.is_ok():
+            print(f"Warning: Cannot draw the graph of {function_name}: {result}")
+            return False
+
+        if result.is_degraded():
+            print(f"Warning: The graph of {function_name} is drawn with {result.strategy} ({result})")
+            done = False
 
     if args.singletons:
         graph.find_singleton_bbs()
@@ -158,11 +423,266 @@ def process_function(args: Namespace,
                 continue
             run_selected_plugins(node, function_name, plugins_data, xlsx_for_plugins)
 
+    return done
+
+
+# Worker side state of the parallel mode, set once per process by init_worker
+_worker_state = {}
+
+
+def init_worker(args: Namespace, out_dir: str, bbe_parser: BBEFileParser, plugins_data) -> NoReturn:
+    global OUT_DIR
+    OUT_DIR = out_dir
+
+    _worker_state["args"] = args
+    _worker_state["bbe_parser"] = bbe_parser
+    _worker_state["plugins_data"] = plugins_data
+    _worker_state["ir_cache"] = IRCache(args.ir_cache, args.ir_cache_size) if args.ir_cache else None
+
+
+def process_collected_function(args: Namespace,
+                               function_name: str,
+                               func_content: str,
+                               bbe_parser: BBEFileParser,
+                               plugins_data,
+                               ir_cache: Optional[IRCache]) -> FunctionResult:
+    singletons = RowsCollector() if args.singletons else None
+    checkers = RowsCollector() if args.plugins else None
+
+    done = process_function(args, function_name, func_content, bbe_parser,
+                            singletons, checkers, plugins_data, ir_cache)
+
+    # Cache counters are summed up by the parent process
+    return singletons, checkers, ir_cache.take_counters() if ir_cache else (0, 0), done
+
+
+def process_function_in_worker(function_name: str, func_content: str) -> FunctionResult:
+    return process_collected_function(_worker_state["args"], function_name, func_content,
+                                      _worker_state["bbe_parser"], _worker_state["plugins_data"],
+                                      _worker_state["ir_cache"])
+
+
+def process_functions_serially(args: Namespace,
+                               functions: Iterable[Tuple[str, str]],
+                               bbe_parser: BBEFileParser,
+                               plugins_data,
+                               ir_cache: Optional[IRCache],
+                               reuse: Callable[[str, str], Optional[FunctionResult]]
+                               ) -> Iterator[Tuple[str, FunctionResult, bool]]:
+    for function_name, content in functions:
+        result = reuse(function_name, content)
+        if result is not None:
+            yield function_name, result, True
+        else:
+            yield function_name, process_collected_function(args, function_name, content, bbe_parser,
+                                                            plugins_data, ir_cache), False
+
+
+def process_functions_in_pool(args: Namespace,
+                              functions: Iterable[Tuple[str, str]],
+                              bbe_parser: BBEFileParser,
+                              plugins_data,
+                              reuse: Callable[[str, str], Optional[FunctionResult]]
+                              ) -> Iterator[Tuple[str, FunctionResult, bool]]:
+    # Results are yielded in submission order, so merging them reproduces the serial output.
+    # The number of functions in flight is bounded to keep the parent's memory usage flat.
+    # Reused results wait in the queue with the futures to keep their place.
+    jobs = args.jobs or os.cpu_count()
+    max_pending = jobs * 4
+
+    def take(item) -> Tuple[str, FunctionResult, bool]:
+        function_name, result = item
+        if isinstance(result, Future):
+            return function_name, result.result(), False
+        return function_name, result, True
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                             initargs=(args, OUT_DIR, bbe_parser, plugins_data)) as executor:
+        pending = deque()
+        in_flight = 0
+        for function_name, content in functions:
+            result = reuse(function_name, content)
+            if result is None:
+                result = executor.submit(process_function_in_worker, function_name, content)
+                in_flight += 1
+            pending.append((function_name, result))
+
+            while pending and (in_flight >= max_pending or not isinstance(pending[0][1], Future)):
+                in_flight -= isinstance(pending[0][1], Future)
+                yield take(pending.popleft())
+
+        while pending:
+            yield take(pending.popleft())
+
+
+def parse_profiles(args: Namespace, asm_paths: List[str], bbe_files: List[str]) -> Dict[str, BBEFileParser]:
+    """
+    Parses the bbexec files once and saves the profile of each disassembly, the first one is the profiled binary.
+    With shared libraries (or a module map) the BBs are split by the modules of the process (see ModuleMap),
+    otherwise they are rebased as get_bb_address does.
+    """
+    function_ranges = {}
+    for path in asm_paths:
+        # A single function needs only the counts of its BBs, the listing is not scanned
+        # for the ranges of the others: the BBs keep the functions given by QEMU without an index
+        index = load_function_index(path) if args.func == "all" else FunctionIndex.load(path)
+        function_ranges[path] = index.get_ranges() if index else None
+
+    main_parser = BBEFileParser(OUT_DIR, args.jobs)
+    if len(asm_paths) == 1 and not args.module_map:
+        main_parser.parse_and_save_data(bbe_files, function_ranges[asm_paths[0]])
+        return {asm_paths[0]: main_parser}
+
+    profile = main_parser.parse_data(bbe_files, rebase=False)
+    modules = {get_module_name(path): path for path in asm_paths}
+    if args.module_map:
+        module_map = ModuleMap.load(args.module_map)
+        module_map.keep_absolute_modules({name: function_ranges[path] for name, path in modules.items()
+                                          if function_ranges[path]})
+    else:
+        module_map = ModuleMap.infer(profile, {name: function_ranges[path] for name, path in modules.items()
+                                               if path != asm_paths[0] and function_ranges[path]})
+    module_map.report()
+
+    parsers = {}
+    for name, module_profile in split_by_modules(profile, module_map, get_module_name(asm_paths[0])).items():
+        if name not in modules:
+            continue
+
+        path = modules[name]
+        if path == asm_paths[0]:
+            parser = main_parser
+        else:
+            parser = BBEFileParser(OUT_DIR, args.jobs, MODULE_PROFILE_FILE_NAME.format(module=name))
+        parser.save_profile(module_profile, function_ranges[path])
+        parsers[path] = parser
+
+    return parsers
+
+
+def get_settings_digest(args: Namespace, plugins_data) -> str:
+    """
+    Returns the digest of the settings that change the results of every function.
+    """
+    settings = (IR_SCHEMA, args.dot, args.singletons, args.plugins, args.min_exec_count, bool(args.bbexec))
+    digest = hashlib.sha1(repr(settings).encode())
+    # The results also change with the code of the analysis, e.g. after an upgrade of ASMGraph
+    digest.update(get_sources_digest([os.path.join(ROOT_DIR, ASM_GRAPH)] +
+                                     sorted(glob.glob(os.path.join(ROOT_DIR, "src", "*.py")))).encode())
+    if args.plugins:
+        digest.update(get_plugins_digest(plugins_data).encode())
+
+    return digest.hexdigest()
+
+
+def get_inputs_digest(content: str, profile: Optional[ProfileIndex]) -> Optional[str]:
+    """
+    Returns the digest of the function body and of the BBs of the profile in its address range,
+    None when the function has no known range in a profiled run.
+    """
+    # Unlike the IR cache key the digest covers the addresses, they are part of the outputs
+    digest = hashlib.sha1(content.encode()).hexdigest()
+    if profile is None:
+        return digest
+
+    function_range = get_function_range(content)
+    if function_range is None:
+        return None
+
+    return hashlib.sha1((digest + profile.get_range_digest(*function_range)).encode()).hexdigest()
+
+
+def process_asm_file(args: Namespace, asm_path: str, bbe_parser: Optional[BBEFileParser],
+                     xlsxwriter_singletons: Optional[XLSXWriter], plugins_data, ir_cache: Optional[IRCache],
+                     manifest: RunManifest, module: Optional[str] = None) -> int:
+    """
+    Processes the functions of the disassembly, returns the number of processed functions.
+    The results of the functions whose inputs are unchanged are taken from the manifest.
+    The functions of a shared library (module) are named <module>.<function> in the outputs,
+    so they do not overwrite the functions of the binary with the same names.
+    """
+    xlsxwriter_checkers = None
+    if args.plugins:
+        checker_xlsx_name = f"{strip_compression_suffix(os.path.basename(asm_path))}.xlsx"
+        checker_xlsx_path = os.path.join(OUT_DIR, checker_xlsx_name)
+        xlsxwriter_checkers = XLSXWriter(checker_xlsx_path)
+
+    prefix = module + MODULE_NAME_SEPARATOR if module else ""
+    asm_funcs = ((prefix + function_name, content) for function_name, content in iter_funcs(asm_path, args.func))
+    processed_funcs = 0
+    funcs_index = FunctionIndex.load(asm_path) if args.func == "all" else None
+
+    asm_name = os.path.basename(asm_path)
+    profile = bbe_parser.get_profile() if bbe_parser else None
+
+    # Digests of the functions in the order of their results
+    digests = deque()
+
+    def reuse(function_name: str, content: str) -> Optional[FunctionResult]:
+        digest = get_inputs_digest(content, profile)
+        digests.append(digest)
+        entry = manifest.lookup(asm_name, function_name, digest)
+        return None if entry is None else (entry[1], entry[2], (0, 0), True)
+
+    with alive_bar(len(funcs_index) if funcs_index else None) as bar:
+        if args.jobs == 1:
+            results = process_functions_serially(args, asm_funcs, bbe_parser, plugins_data, ir_cache, reuse)
+        else:
+            results = process_functions_in_pool(args, asm_funcs, bbe_parser, plugins_data, reuse)
+
+        for function_name, (singletons, checkers, cache_counters, done), reused in results:
+            if singletons:
+                xlsxwriter_singletons.merge(singletons)
+            if checkers:
+                xlsxwriter_checkers.merge(checkers)
+            if ir_cache:
+                ir_cache.add_counters(cache_counters)
+
+            digest = digests.popleft()
+            entry = None
+            if done and digest is not None:
+                dot_file = get_short_name(function_name) + ".dot" if args.dot else None
+                entry = (digest, singletons, checkers, dot_file)
+            manifest.record(asm_name, function_name, entry, reused)
+            processed_funcs += 1
+            bar()
+
+    if args.plugins:
+        # Sort by before last column
+        xlsxwriter_checkers.dump(-2)
+
+    return processed_funcs
+
+
+def render_dot_outputs(args: Namespace) -> NoReturn:
+    dot_files = sorted(os.path.join(OUT_DIR, name) for name in os.listdir(OUT_DIR) if name.endswith(".dot"))
+    supervisor = RenderSupervisor(args.render_timeout, args.render_memory)
+
+    print(f"Rendering dot graphs to {args.render}.")
+    reports = []
+    with alive_bar(len(dot_files)) as bar:
+        for report in render_dot_files(dot_files, args.render, supervisor):
+            reports.append(report)
+            bar()
+
+    save_render_report(os.path.join(OUT_DIR, RENDER_REPORT_FILE_NAME), reports)
+    print_render_summary(reports)
+
 
 def main(args: Namespace):
     global OUT_DIR
     OUT_DIR = args.output
 
+    # Without graphviz every graph would fail, the run stops before any work
+    programs = [DOT_PROGRAM] if args.dot else []
+    if args.render:
+        programs += [POSITIONED_PROGRAM[0], LAYOUT_PROGRAM[0]]
+    try:
+        check_programs(programs)
+    except FileNotFoundError as e:
+        print(f"ERROR: {e}")
+        exit(1)
+
     if not os.path.exists(OUT_DIR):
         os.makedirs(OUT_DIR)
 
@@ -190,22 +710,22 @@ def main(args: Namespace):
         return 0
 
 
-    bbe_parser = None
+    for lib_path in args.libs:
+        assert os.path.exists(lib_path), f"Cannot find asm file: {lib_path}"
+    asm_paths = [asm_path] + args.libs
+
+    bbe_parsers = {}
     if args.bbexec:
         assert os.path.exists(args.bbexec), f"Cannot find bbexec file: {args.bbexec}. No such file or directory."
-        bbe_parser = BBEFileParser(OUT_DIR)
         if os.path.isdir(args.bbexec):
-            bbe_files = glob.glob(os.path.join(args.bbexec, "*.bbexec"))
-            bbe_parser.parse_and_save_data(bbe_files)
-            for bbe_file in bbe_files:
-                try:
-                    shutil.copy(bbe_file, os.path.join(OUT_DIR, os.path.basename(bbe_file)))
-                except Exception as e:
-                    print(f"Warning: Cannot copy bbexec file to output dir: {e}")
+            bbe_files = find_inputs(args.bbexec, ".bbexec")
         else:
-            bbe_parser.parse_and_save_data([args.bbexec])
+            bbe_files = [args.bbexec]
+
+        bbe_parsers = parse_profiles(args, asm_paths, bbe_files)
+        for bbe_file in bbe_files:
             try:
-                shutil.copy(args.bbexec, os.path.join(OUT_DIR, os.path.basename(args.bbexec)))
+                shutil.copy(bbe_file, os.path.join(OUT_DIR, os.path.basename(bbe_file)))
             except Exception as e:
                 print(f"Warning: Cannot copy bbexec file to output dir: {e}")
 
@@ -215,26 +735,42 @@ def main(args: Namespace):
         xlsxwriter_singletons = XLSXWriter(singletons_path)
         xlsxwriter_singletons.create_asm_sheet()
 
-    xlsxwriter_checkers = None
     plugins_data = None
     if args.plugins:
         plugins_data = load_plugins()
-        checker_xlsx_name = f"{os.path.basename(asm_path)}.xlsx"
-        checker_xlsx_path = os.path.join(OUT_DIR, checker_xlsx_name)
-        xlsxwriter_checkers = XLSXWriter(checker_xlsx_path)
 
-    asm_funcs = load_funcs(asm_path, args.func)
+    ir_cache = IRCache(args.ir_cache, args.ir_cache_size) if args.ir_cache else None
+    manifest = RunManifest(OUT_DIR, get_settings_digest(args, plugins_data), load=not args.full)
 
-    with alive_bar(len(asm_funcs)) as bar:
-        for function_name, content in asm_funcs.items():
-            process_function(args, function_name, content, bbe_parser,
-                             xlsxwriter_singletons, xlsxwriter_checkers,
-                             plugins_data)
-            bar()
+    processed_funcs = 0
+    for path in asm_paths:
+        module = get_module_name(path) if path != asm_path else None
+        processed_funcs += process_asm_file(args, path, bbe_parsers.get(path), xlsxwriter_singletons,
+                                            plugins_data, ir_cache, manifest, module)
 
-    if args.plugins:
-        # Sort by before last column
-        xlsxwriter_checkers.dump(-2)
+        if args.inst_mix and path in bbe_parsers:
+            inst_mix = compute_functions_mix(iter_funcs(path, args.func), bbe_parsers[path].get_profile())
+            print(f"Instruction mix of {os.path.basename(path)}:")
+            bbe_parsers[path].print_info(inst_mix)
+
+            inst_mix_name = f"{strip_compression_suffix(os.path.basename(path))}{XLSX_INST_MIX_SUFFIX}"
+            XLSXWriter(os.path.join(OUT_DIR, inst_mix_name)).write_inst_mix(inst_mix)
+
+    assert processed_funcs, "Cannot load functions."
+
+    if args.func == "all":
+        manifest.remove_stale_outputs()
+    else:
+        manifest.keep_previous()
+    manifest.save()
+    manifest.report()
+
+    if args.render:
+        render_dot_outputs(args)
+
+    if ir_cache:
+        ir_cache.evict()
+        ir_cache.report()
 
     # FIXME: US 113
     # We collect all execution info and dump in file at the end
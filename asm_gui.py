@@ -10,6 +10,7 @@ gi.require_version("Gtk", "3.0")
 gi.require_version('WebKit2', '4.0')
 
 import json
+import re
 import threading
 from typing import Dict, Union
 import shutil
@@ -23,6 +24,7 @@ from src.ui.style_manager import StyleManager
 from src.ui.error_handler import ErrorWindow
 from src.ui.view_boxes import NewProject
 from src.ui.help_window import HelpWindow
+from src.ui.name_index import NameIndex, parse_query
 from src.ui.constants import *
 
 from gi.repository import Gtk, GLib, GdkPixbuf
@@ -46,6 +48,7 @@ class ASMGWindow(MultiWindow):
         self.main_view = None
         self.search_proj_entry = None
         self.recent_projects = []
+        self.projects_index = None
         self.progressbar = None
 
         self.stack = Gtk.Stack(transition_duration=DEFAULT_TRANSITION_DURATION,
@@ -80,6 +83,7 @@ class ASMGWindow(MultiWindow):
         hbox.pack_start(logo_image, False, False, 0)
 
         self.search_proj_entry = Gtk.SearchEntry(placeholder_text="Search projects")
+        self.search_proj_entry.set_tooltip_text(SEARCH_TOOLTIP_TEXT)
         hbox.pack_start(self.search_proj_entry, True, True, 0)
 
         new_proj_button = Gtk.Button(label="New Project")
@@ -136,6 +140,8 @@ class ASMGWindow(MultiWindow):
 
             dialog.destroy()
 
+        # The project boxes are in the order of the index
+        self.projects_index = NameIndex([proj[JSONKeywords.PROJECT_NAME] for proj in self.recent_projects[::-1]])
         for proj in self.recent_projects[::-1]:
             if proj[JSONKeywords.PROJECT_TYPE] == ProjectType.SPEC:
                 label_text: str = f"{proj[JSONKeywords.PROJECT_NAME]} (SPEC)\n{proj[JSONKeywords.FOLDER_PATH]}"
@@ -185,15 +191,14 @@ class ASMGWindow(MultiWindow):
         new_proj_view.pack_end(footer, False, True, 0)
 
     def search_project(self, entry: Gtk.SearchEntry, recent_project_box: Gtk.Box) -> None:
-        search_text: str = entry.get_text().lower()
+        try:
+            matches = self.projects_index.search(*parse_query(entry.get_text()))
+        except re.error:
+            # Patterns being typed keep the previous matches
+            return
 
-        for project_box in recent_project_box.get_children():
-            # Getting project name
-            button_label: str = project_box.get_child().get_text().split("\n")[0].lower()
-            if search_text in button_label:
-                project_box.show()
-            else:
-                project_box.hide()
+        for ind, project_box in enumerate(recent_project_box.get_children()):
+            project_box.set_visible(matches is None or ind in matches)
 
     def open_new_project(self, button: Gtk.Button) -> None:
         self.stack.set_visible_child_name(self.Pages.NEW_PROJ)
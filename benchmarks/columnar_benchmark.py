@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+# *******************************************************
+# * Copyright (c) 2022-2024 CAST.  All rights reserved. *
+# *******************************************************
+
+# Compares the columnar form of the functions (InstructionColumns) with parse_function_asm + FlowGraph.
+# Both are run on the same functions, synthetic ones or those of a disassembly (--asm), and must produce
+# the same basic blocks, the same opcode, group and load counts and the same instruction pairs.
+
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+from typing import Iterable, List, NoReturn, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from src import opcodes
+from src.asm_parser import parse_function_asm, parse_function_columns
+from src.columnar import InstructionColumns
+from src.graph import FlowGraph
+from src.instruction import Instruction, Operand
+from src.registers import get_base_register
+
+REGISTERS = ["a0", "a1", "a2", "a3", "a4", "a5", "t0", "t1", "s0", "s1", "sp"]
+# (first opcodes, second opcodes) of the checked pairs
+PAIRS = [(["lui", "auipc"], ["addi", "ld", "lw", "jalr"]),
+         (["slli"], ["add"]),
+         (["ld", "lw"], ["beqz", "bnez", "beq", "bne"])]
+
+
+def generate_function(name: str, start: int, size: int, seed: int) -> str:
+    rnd = random.Random(seed)
+    end = start + 4 * size
+    lines = [f"{start:016x} <{name}>:"]
+
+    for address in range(start, end, 4):
+        rd, rs1, rs2 = rnd.choice(REGISTERS), rnd.choice(REGISTERS), rnd.choice(REGISTERS)
+        target = rnd.randrange(start, end, 4)
+        kind = rnd.random()
+        if kind < 0.3:
+            insn = f"{rnd.choice(['add', 'sub', 'and', 'or', 'xor', 'mul'])}\t{rd},{rs1},{rs2}"
+        elif kind < 0.45:
+            insn = f"{rnd.choice(['addi', 'slli'])}\t{rd},{rs1},{rnd.randint(1, 31)}"
+        elif kind < 0.55:
+            insn = f"{rnd.choice(['lui', 'auipc'])}\t{rd},0x{rnd.randint(1, 0xfff):x}"
+        elif kind < 0.7:
+            insn = f"{rnd.choice(['ld', 'lw', 'sd', 'sw'])}\t{rd},{rnd.randint(0, 64) * 8}({rs1})"
+        elif kind < 0.8:
+            insn = f"{rnd.choice(['beqz', 'bnez'])}\t{rs1},{target:x} <{name}+0x{target - start:x}>"
+        elif kind < 0.85:
+            insn = f"{rnd.choice(['beq', 'bne'])}\t{rs1},{rs2},{target:x} <{name}+0x{target - start:x}>"
+        elif kind < 0.9:
+            insn = f"j\t{target:x} <{name}+0x{target - start:x}>"
+        elif kind < 0.95:
+            insn = "jal\t1000 <callee>"
+        elif kind < 0.97:
+            insn = "ret"
+        else:
+            insn = f"mv\t{rd},{rs1}"
+
+        lines.append(f"{address:x}:\t{insn}")
+
+    return "\n".join(lines)
+
+
+def generate_functions(count: int, size: int, seed: int) -> List[Tuple[str, str]]:
+    return [(f"func_{ind}", generate_function(f"func_{ind}", 0x10000 + ind * 0x10000, size, seed + ind))
+            for ind in range(count)]
+
+
+def read_functions(asm_path: str) -> List[Tuple[str, str]]:
+    from asm_graph import iter_funcs
+    return list(iter_funcs(asm_path))
+
+
+def get_register(operand: Operand) -> str:
+    return get_base_register(operand.value) if operand is not None and operand.code == Operand.Code.REG else None
+
+
+def find_pairs(blocks: List[List[Instruction]], first: Iterable[str], second: Iterable[str],
+               dependent: bool) -> int:
+    count = 0
+    for block in blocks:
+        for instr, next_instr in zip(block, block[1:]):
+            if instr.code not in first or next_instr.code not in second:
+                continue
+
+            dest = get_register(instr.dest)
+            if not dependent or dest is not None and dest in (get_register(next_instr.src1),
+                                                              get_register(next_instr.src2)):
+                count += 1
+    return count
+
+
+def legacy_stats(functions: List[Tuple[str, str]]) -> Tuple[List[int], Counter, Counter, int, List[int]]:
+    bb_ids, opcode_counts, group_counts, loads, blocks = [], Counter(), Counter(), 0, []
+    for _, content in functions:
+        graph = FlowGraph(parse_function_asm(content))
+        for node in graph.nodes:
+            instructions = node.get_instr_list()
+            bb_ids.extend([len(blocks)] * len(instructions))
+            blocks.append(instructions)
+            for instr in instructions:
+                if instr.get_opcode_id() >= 0:
+                    opcode_counts[instr.get_opcode_id()] += 1
+                    group_counts[instr.get_group_id()] += 1
+                    loads += instr.is_load()
+
+    pairs = [find_pairs(blocks, first, second, dependent) for first, second in PAIRS for dependent in (False, True)]
+    return bb_ids, opcode_counts, group_counts, loads, pairs
+
+
+def columnar_stats(functions: List[Tuple[str, str]]) -> Tuple[List[int], Counter, Counter, int, List[int]]:
+    columns = InstructionColumns.concatenate([parse_function_columns(content) for _, content in functions])
+    opcode_counts = Counter({opcode_id: int(count) for opcode_id, count in enumerate(columns.count_opcodes())
+                             if count})
+    group_counts = Counter({group_id: int(count) for group_id, count in enumerate(columns.count_groups()) if count})
+    loads = int(columns.flag_mask(opcodes.FLAG_LOAD).sum())
+    pairs = [len(columns.find_pairs(first, second, dependent)) for first, second in PAIRS
+             for dependent in (False, True)]
+    return columns.bb.tolist(), opcode_counts, group_counts, loads, pairs
+
+
+def timed(function, functions: List[Tuple[str, str]]) -> Tuple[Tuple, float]:
+    start = time.perf_counter()
+    result = function(functions)
+    return result, time.perf_counter() - start
+
+
+def report_difference(name: str, legacy, columnar) -> NoReturn:
+    if isinstance(legacy, list) and isinstance(columnar, list) and len(legacy) == len(columnar):
+        row = int(np.flatnonzero(np.array(legacy) != np.array(columnar))[0])
+        print(f"{name} differ, first at row {row}: {legacy[row]} and {columnar[row]}")
+    else:
+        print(f"{name} differ: {legacy} and {columnar}")
+
+
+def run(functions: List[Tuple[str, str]]) -> bool:
+    legacy, legacy_time = timed(legacy_stats, functions)
+    columnar, columnar_time = timed(columnar_stats, functions)
+
+    identical = True
+    for name, legacy_value, columnar_value in zip(("BB ids", "Opcode counts", "Group counts", "Loads", "Pairs"),
+                                                  legacy, columnar):
+        if legacy_value != columnar_value:
+            report_difference(name, legacy_value, columnar_value)
+            identical = False
+
+    print(f"{'functions':>10} {'rows':>10} {'FlowGraph, s':>13} {'columnar, s':>12} {'speedup':>9}")
+    print(f"{len(functions):>10} {len(legacy[0]):>10} {legacy_time:>13.3f} {columnar_time:>12.3f} "
+          f"{legacy_time / max(columnar_time, 1e-9):>8.1f}x")
+    print(f"Pairs: {legacy[4]}")
+
+    return identical
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark of the columnar form of the parsed functions.")
+    parser.add_argument("--asm", help="Disassembly to take the functions from instead of generating them.")
+    parser.add_argument("--functions", type=int, default=200, help="Number of generated functions.")
+    parser.add_argument("--size", type=int, default=500, help="Number of instructions per generated function.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated functions.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    functions = read_functions(args.asm) if args.asm else generate_functions(args.functions, args.size, args.seed)
+    exit(0 if run(functions) else 1)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+# *******************************************************
+# * Copyright (c) 2022-2024 CAST.  All rights reserved. *
+# *******************************************************
+
+# Compares the single pass def-use construction of Node.create_dataflow_graph
+# with the previous implementation, which scanned the rest of the block for every instruction.
+# Both are run on the same synthetic basic blocks and must produce the same links.
+
+import argparse
+import os
+import random
+import sys
+import time
+from typing import List, NoReturn, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.graph import Node
+from src.instruction import Instruction
+
+REGISTERS = ["a0", "a1", "a2", "a3", "a4", "a5", "t0", "t1", "s0", "s1", "sp"]
+
+
+def legacy_create_dataflow_graph(node: Node) -> NoReturn:
+    instr_list = node.get_instr_list()
+
+    for selected_ins_ind in range(0, len(instr_list)):
+        selected_ins = instr_list[selected_ins_ind]
+        if selected_ins.is_ret() or selected_ins.get_arguments() == []:
+            continue
+
+        for next_ins in instr_list[selected_ins_ind + 1:]:
+            if not next_ins.dest:
+                continue
+
+            if next_ins.is_store():
+                if selected_ins.dest.value == next_ins.get_dest_name():
+                    selected_ins.dest.output.append(next_ins)
+                    next_ins.dest.input = selected_ins
+
+            if next_ins.src1:
+                if selected_ins.dest.value == next_ins.get_src1_name():
+                    selected_ins.dest.output.append(next_ins)
+                    next_ins.src1.input = selected_ins
+
+                    if selected_ins.dest == next_ins.dest:
+                        break
+
+            if next_ins.src2:
+                if selected_ins.dest.value == next_ins.get_src2_name():
+                    selected_ins.dest.output.append(next_ins)
+                    next_ins.src2.input = selected_ins
+
+                    if selected_ins.dest == next_ins.dest:
+                        break
+
+
+def generate_block(size: int, seed: int) -> List[str]:
+    rnd = random.Random(seed)
+    lines = []
+    address = 0x10000
+
+    for _ in range(size):
+        rd, rs1, rs2 = rnd.choice(REGISTERS), rnd.choice(REGISTERS), rnd.choice(REGISTERS)
+        kind = rnd.random()
+        if kind < 0.4:
+            insn = f"{rnd.choice(['add', 'sub', 'and', 'or', 'xor', 'mul'])}\t{rd},{rs1},{rs2}"
+        elif kind < 0.6:
+            insn = f"{rnd.choice(['addi', 'slli', 'srli'])}\t{rd},{rs1},{rnd.randint(1, 31)}"
+        elif kind < 0.75:
+            insn = f"{rnd.choice(['ld', 'lw'])}\t{rd},{rnd.randint(0, 64) * 8}({rs1})"
+        elif kind < 0.9:
+            insn = f"{rnd.choice(['sd', 'sw'])}\t{rd},{rnd.randint(0, 64) * 8}({rs1})"
+        else:
+            insn = f"{rnd.choice(['mv', 'li'])}\t{rd},{rs1 if kind < 0.95 else rnd.randint(0, 100)}"
+
+        lines.append(f"{address:x}:\t{insn}")
+        address += 4
+
+    return lines
+
+
+def build_node(lines: List[str]) -> Tuple[Node, float]:
+    instructions = [Instruction(line) for line in lines]
+    start = time.perf_counter()
+    node = Node("B0:", lines[0].split(":")[0], instructions)
+    return node, time.perf_counter() - start
+
+
+def get_links(node: Node) -> List[Tuple]:
+    index = {id(instr): ind for ind, instr in enumerate(node.get_instr_list())}
+
+    def input_index(operand):
+        return None if operand is None or operand.input is None else index[id(operand.input)]
+
+    links = []
+    for instr in node.get_instr_list():
+        if instr.dest is None:
+            links.append(None)
+            continue
+        links.append(([index[id(out)] for out in instr.dest.output],
+                      input_index(instr.dest), input_index(instr.src1), input_index(instr.src2)))
+    return links
+
+
+def run(sizes: List[int], blocks: int, seed: int) -> bool:
+    new_method = Node.create_dataflow_graph
+    identical = True
+
+    print(f"{'instructions':>12} {'legacy, s':>12} {'single pass, s':>15} {'speedup':>9}")
+    for size in sizes:
+        legacy_time, new_time = 0.0, 0.0
+        for block in range(blocks):
+            lines = generate_block(size, seed + block)
+
+            Node.create_dataflow_graph = legacy_create_dataflow_graph
+            try:
+                legacy_node, elapsed = build_node(lines)
+            finally:
+                Node.create_dataflow_graph = new_method
+            legacy_time += elapsed
+
+            node, elapsed = build_node(lines)
+            new_time += elapsed
+
+            if get_links(legacy_node) != get_links(node):
+                print(f"Links differ for the block of {size} instructions (seed {seed + block})")
+                identical = False
+
+        print(f"{size:>12} {legacy_time:>12.3f} {new_time:>15.3f} {legacy_time / max(new_time, 1e-9):>8.1f}x")
+
+    return identical
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark of the def-use chain construction of basic blocks.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 1000, 5000],
+                        help="Numbers of instructions per basic block.")
+    parser.add_argument("--blocks", type=int, default=3, help="Number of blocks of each size.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated blocks.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    exit(0 if run(args.sizes, args.blocks, args.seed) else 1)
@@ -6,12 +6,14 @@
 
 
 import os
-import glob
 import argparse
 import xlsxwriter
 from argparse import Namespace
 from typing import Dict, List, NoReturn
 
+from src.bbe_parser import get_file_profile
+from src.file_reader import find_inputs, read_tail, strip_compression_suffix
+
 FIRST = "FIRST"
 SECOND = "SECOND"
 FUNCTION_NAME = "FUNCTION NAME"
@@ -62,24 +64,15 @@ def parse_args() -> Namespace:
 def get_functions_dyn_inst_count(bbe_file: str) -> [Dict[str, Dict]]:
     func_name_and_dyn_inst_count = {}
 
-    with open(bbe_file, "r") as block_fp:
-        for line in block_fp:
-            line = line.strip()
-
-            if not line.startswith("0x"):
-                continue
-
-            block_info = line.split()
-
-            if len(block_info) == 4:
-                function_name = block_info[3]
-                if "." in function_name:
-                    function_name = function_name.split(".")[0]
+    # Counts of the symbols of the block lines come from the mapped profile sidecar of the file
+    for function_name, count in get_file_profile(bbe_file).get_counts_by_symbol().items():
+        if "." in function_name:
+            function_name = function_name.split(".")[0]
 
-                if function_name in func_name_and_dyn_inst_count:
-                    func_name_and_dyn_inst_count[function_name] += int(block_info[1])
-                else:
-                    func_name_and_dyn_inst_count[function_name] = int(block_info[1])
+        if function_name in func_name_and_dyn_inst_count:
+            func_name_and_dyn_inst_count[function_name] += count
+        else:
+            func_name_and_dyn_inst_count[function_name] = count
 
     sort_by_exec_count = sorted(func_name_and_dyn_inst_count.items(), key=lambda x: x[1], reverse=True)
     return dict(sort_by_exec_count)
@@ -197,7 +190,7 @@ def create_general_diff(workbook: xlsxwriter.Workbook,
 
 def get_files_from_dir(directory: str) -> List[str]:
     if os.path.isdir(directory):
-        bbes = sorted(glob.glob(os.path.join(directory, "*.bbexec")))
+        bbes = sorted(find_inputs(directory, ".bbexec"))
         return bbes
     else:
         assert f"Cannot find directory: {directory}"
@@ -227,23 +220,22 @@ def get_bbe_files(args: Namespace) -> (List[str], List[str]):
 
 
 def get_dyn_inst_count(file_path: str) -> int:
-    with open(file_path, 'r') as f:
-        f.seek(0, os.SEEK_END)
-        fsize = f.tell()
+    # The count is on the third line from the end,
+    # the tail of compressed files is kept in their trailer index
+    tail = read_tail(file_path).decode(errors="replace")
 
-        lines = []
-        newline_chars = '\n\r'
-        position = fsize - 1
+    lines = []
+    newline_chars = '\n\r'
+    position = len(tail) - 1
 
-        while len(lines) < 3 and position >= 0:
-            f.seek(position)
-            char = f.read(1)
-            if char in newline_chars:
-                lines.append(f.readline())
-            position -= 1
+    while len(lines) < 3 and position >= 0:
+        if tail[position] in newline_chars:
+            line_end = tail.find('\n', position + 1)
+            lines.append(tail[position + 1:] if line_end < 0 else tail[position + 1:line_end + 1])
+        position -= 1
 
-        if lines[2]:
-            return int(((lines[2]).split(':')[1]))
+    if lines[2]:
+        return int(((lines[2]).split(':')[1]))
 
 
 def compute_and_get_diff(first_bbe: str, second_bbe: str) -> Dict[str, List]:
@@ -271,7 +263,8 @@ def main():
         second_bbe = None
         try:
             for bbe in second_bbes:
-                if os.path.basename(bbe) == os.path.basename(first_bbe):
+                if strip_compression_suffix(os.path.basename(bbe)) == \
+                        strip_compression_suffix(os.path.basename(first_bbe)):
                     second_bbe = bbe
                     break
 
@@ -8,7 +8,6 @@
 import re
 from typing import List, NoReturn
 from src.graph import Node
-from src.opcodes import loads, stores, jump_instructions
 from src.instruction import Instruction, Operand
 
 
@@ -216,11 +215,11 @@ def instructions_are_far(basic_block: Node, first_ins: Instruction,
     count = 0
 
     for i in range(input_ind + 1, out_ind):
-        if basic_block[i].code in jump_instructions:
+        if basic_block[i].is_jump():
             return False
 
         if basic_block[i].src1:
-            if basic_block[i].code in loads or basic_block[i].code in stores:
+            if basic_block[i].is_load() or basic_block[i].is_store():
 
                 # extract register name from address operand. e.g 8(a2) -> a2
                 src1 = get_register_from_address(basic_block[i].src1.value)
@@ -244,7 +243,7 @@ def instructions_are_far(basic_block: Node, first_ins: Instruction,
 def is_changed_in_range(basic_block: Node, begin: int, end: int, reg: Operand) -> int:
     for i in range(begin, end):
         instr = basic_block[i]
-        if instr.code in stores:
+        if instr.is_store():
             continue
 
         if instr.dest == reg:
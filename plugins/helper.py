@@ -4,6 +4,7 @@
 
 import os
 import json
+import hashlib
 import importlib
 import inspect
 from typing import List, get_type_hints
@@ -102,6 +103,25 @@ def run_selected_plugins(basic_block, func_name, plugins_data, xlsx_writer) -> N
                 print(f"ERROR: Running plugin {plugin_name}: {e}")
 
 
+def get_plugins_digest(plugins_data) -> str:
+    """
+    Returns the digest of the enabled plugins: their configuration and the sources of their functions.
+    """
+    enabled = [plugin_info for plugin_info in plugins_data or [] if plugin_info.get("enabled", False)]
+    digest = hashlib.sha1(json.dumps(enabled, sort_keys=True).encode())
+
+    files = [os.path.join(ROOT_DIR, "plugins", BASIC_PLUGINS)]
+    files += sorted({plugin_info["file"] for plugin_info in enabled if plugin_info.get("file")})
+    for file_path in files:
+        try:
+            with open(file_path, "rb") as plugin_file:
+                digest.update(plugin_file.read())
+        except OSError:
+            digest.update(file_path.encode())
+
+    return digest.hexdigest()
+
+
 def load_plugins():
     plugins_path = os.path.join(ROOT_DIR, "plugins", PLUGINS_JSON)
     with open(plugins_path, 'r') as plugins_file:
@@ -0,0 +1,250 @@
+# *******************************************************
+# * Copyright (c) 2022-2024 CAST.  All rights reserved. *
+# *******************************************************
+
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+from typing import Dict, List, NoReturn, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.file_reader import StringTable, align, open_input
+
+INDEX_FILE_SUFFIX = ".idx"
+NO_RANGE = -1
+
+# Binary index layout, all numbers are little endian:
+#   header  (INDEX_HEADER): magic, version, size, mtime and sha1 of the listing (see compute_fingerprint),
+#           numbers of functions and ranges, offsets of the columns and size of the names
+#   uint64  offsets[functions]   byte offsets of the function bodies, in the order of the sorted names
+#   uint64  lengths[functions]
+#   uint64  string_offsets[functions + 1]
+#   bytes   utf-8 sorted function names, name i is blob[string_offsets[i]:string_offsets[i + 1]]
+#   uint64  range_starts[ranges]   address ranges sorted by their starts (padded to 8 bytes)
+#   uint64  range_ends[ranges]
+#   uint32  range_ids[ranges]      positions of the functions of the ranges in the names
+INDEX_MAGIC = b"ASMGFIDX"
+INDEX_VERSION = 3
+INDEX_HEADER = struct.Struct("<8sIIQQ20s4x9Q")
+
+# Only the head and the tail of the listing are hashed,
+# so validating the index does not depend on the size of the file.
+FINGERPRINT_BLOCK_SIZE = 64 * 1024
+
+
+def get_index_path(asm_path: str) -> str:
+    return asm_path + INDEX_FILE_SUFFIX
+
+
+def compute_fingerprint(asm_path: str) -> Dict:
+    stat = os.stat(asm_path)
+    digest = hashlib.sha1()
+
+    with open(asm_path, "rb") as asm:
+        digest.update(asm.read(FINGERPRINT_BLOCK_SIZE))
+        if stat.st_size > FINGERPRINT_BLOCK_SIZE:
+            asm.seek(max(stat.st_size - FINGERPRINT_BLOCK_SIZE, FINGERPRINT_BLOCK_SIZE))
+            digest.update(asm.read(FINGERPRINT_BLOCK_SIZE))
+
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": digest.hexdigest()}
+
+
+def split_function_lines(content: str) -> List[str]:
+    return [line.strip() for line in content.split("\n") if line.strip()]
+
+
+class FunctionRanges:
+    """
+    Sorted [start, end) address ranges of the functions of a disassembly, end is just past
+    the address of the last instruction. Addresses are attributed to the functions
+    with one searchsorted call, no matter how QEMU split or named the blocks.
+    """
+
+    def __init__(self, ranges: Sequence[Tuple[int, int, str]]):
+        ranges = sorted(ranges)
+        self.starts = np.array([start for start, _, _ in ranges], dtype=np.uint64)
+        self.ends = np.array([end for _, end, _ in ranges], dtype=np.uint64)
+        self.names = [name for _, _, name in ranges]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def attribute(self, addresses: np.ndarray) -> np.ndarray:
+        """
+        Returns the index of the range of each address or NO_RANGE.
+        """
+        addresses = np.asarray(addresses, dtype=np.uint64)
+        positions = np.searchsorted(self.starts, addresses, side="right").astype(np.int64) - 1
+        if not len(self.names):
+            return positions
+
+        inside = (positions >= 0) & (addresses < self.ends[np.maximum(positions, 0)])
+        return np.where(inside, positions, NO_RANGE)
+
+
+class FunctionIndex:
+    """
+    Sidecar index of a disassembly that maps each function name of the text section
+    to the byte offset and the length of its body, so one function can be read
+    with a seek and a bounded read instead of scanning the whole file.
+    It also keeps the address ranges of the functions, see FunctionRanges.
+
+    The names are sorted, a function is found by bisecting them. The index is stored in the binary
+    layout of INDEX_HEADER and used in place through the memory map (see MappedFunctionIndex),
+    so a lookup does not depend on the number of functions.
+    """
+
+    def __init__(self, asm_path: str, fingerprint: Dict, names: Sequence[str], offsets: np.ndarray,
+                 lengths: np.ndarray, range_starts: np.ndarray, range_ends: np.ndarray, range_ids: np.ndarray):
+        self.asm_path = asm_path
+        self.fingerprint = fingerprint
+        self.names = names
+        self.offsets = offsets
+        self.lengths = lengths
+        # Ranges sorted by their starts, with the positions of their functions in names
+        self.range_starts = range_starts
+        self.range_ends = range_ends
+        self.range_ids = range_ids
+
+    @classmethod
+    def from_scan(cls, asm_path: str, fingerprint: Dict, functions: Dict[str, Tuple[int, int]],
+                  ranges: List[Tuple[int, int, str]]) -> "FunctionIndex":
+        """
+        Builds the index from the {name: (offset, length)} functions and the (start, end, name) ranges of a scan.
+        """
+        names = sorted(functions)
+        positions = {name: ind for ind, name in enumerate(names)}
+        ranges = sorted(entry for entry in ranges if entry[2] in positions)
+
+        return cls(asm_path, fingerprint, names,
+                   np.array([functions[name][0] for name in names], dtype=np.uint64),
+                   np.array([functions[name][1] for name in names], dtype=np.uint64),
+                   np.array([start for start, _, _ in ranges], dtype=np.uint64),
+                   np.array([end for _, end, _ in ranges], dtype=np.uint64),
+                   np.array([positions[name] for _, _, name in ranges], dtype=np.uint32))
+
+    @classmethod
+    def load(cls, asm_path: str) -> Optional["FunctionIndex"]:
+        """
+        Returns the mapped index of the disassembly, None when it is missing or does not match the file.
+        """
+        index_path = get_index_path(asm_path)
+        if not os.path.isfile(index_path) or not os.path.isfile(asm_path):
+            return None
+
+        try:
+            index = MappedFunctionIndex(asm_path, index_path)
+        except (OSError, ValueError):
+            return None
+
+        if index.fingerprint != compute_fingerprint(asm_path):
+            return None
+
+        return index
+
+    def save(self) -> NoReturn:
+        names = [name.encode() for name in self.names]
+        string_offsets = np.cumsum([0] + [len(name) for name in names], dtype=np.uint64)
+        functions, ranges = len(names), len(self.range_ids)
+
+        offsets_offset = align(INDEX_HEADER.size)
+        lengths_offset = offsets_offset + 8 * functions
+        strings_offset = lengths_offset + 8 * functions
+        strings_size = int(string_offsets[-1])
+        range_starts_offset = align(strings_offset + 8 * (functions + 1) + strings_size)
+        range_ends_offset = range_starts_offset + 8 * ranges
+        range_ids_offset = range_ends_offset + 8 * ranges
+
+        header = INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0, self.fingerprint["size"],
+                                   self.fingerprint["mtime"], bytes.fromhex(self.fingerprint["hash"]),
+                                   functions, ranges, offsets_offset, lengths_offset, strings_offset, strings_size,
+                                   range_starts_offset, range_ends_offset, range_ids_offset)
+
+        # Written next to the target and renamed, readers never see a partial index
+        index_path = get_index_path(self.asm_path)
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "wb") as index_file:
+            index_file.write(header.ljust(offsets_offset, b"\0"))
+            index_file.write(np.ascontiguousarray(self.offsets, dtype="<u8").tobytes())
+            index_file.write(np.ascontiguousarray(self.lengths, dtype="<u8").tobytes())
+            index_file.write(string_offsets.astype("<u8").tobytes())
+            index_file.write(b"".join(names))
+            index_file.write(b"\0" * (range_starts_offset - strings_offset - 8 * (functions + 1) - strings_size))
+            index_file.write(np.ascontiguousarray(self.range_starts, dtype="<u8").tobytes())
+            index_file.write(np.ascontiguousarray(self.range_ends, dtype="<u8").tobytes())
+            index_file.write(np.ascontiguousarray(self.range_ids, dtype="<u4").tobytes())
+        os.replace(tmp_path, index_path)
+
+    def get_entry(self, func_name: str) -> Optional[Tuple[int, int]]:
+        """
+        Returns (offset, length) of the body of the function or None.
+        """
+        ind = bisect.bisect_left(self.names, func_name)
+        if ind == len(self.names) or self.names[ind] != func_name:
+            return None
+        return int(self.offsets[ind]), int(self.lengths[ind])
+
+    def read_function(self, func_name: str) -> Optional[str]:
+        entry = self.get_entry(func_name)
+        if entry is None:
+            return None
+
+        # Offsets of compressed listings are those of the decompressed text, seeking decompresses
+        # (as a stream, in constant memory) the whole part before the function: a full scan
+        offset, length = entry
+        with open_input(self.asm_path) as asm:
+            asm.seek(offset)
+            content = asm.read(length).decode()
+
+        return "\n".join(split_function_lines(content)) + "\n"
+
+    def get_ranges(self) -> FunctionRanges:
+        return FunctionRanges(list(zip(self.range_starts.tolist(), self.range_ends.tolist(),
+                                       [self.names[ind] for ind in self.range_ids.tolist()])))
+
+    def __contains__(self, func_name: str) -> bool:
+        return self.get_entry(func_name) is not None
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+class MappedFunctionIndex(FunctionIndex):
+    """
+    FunctionIndex whose columns are views of the memory-mapped index file.
+    """
+
+    def __init__(self, asm_path: str, index_path: str):
+        with open(index_path, "rb") as index_file:
+            try:
+                self.__data = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError(f"Empty functions index {index_path}")
+
+        if len(self.__data) < INDEX_HEADER.size:
+            raise ValueError(f"Truncated functions index {index_path}")
+
+        (magic, version, _, size, mtime_ns, digest, functions, ranges, offsets_offset, lengths_offset,
+         strings_offset, strings_size, range_starts_offset, range_ends_offset, range_ids_offset) = \
+            INDEX_HEADER.unpack_from(self.__data)
+
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"Unsupported functions index {index_path}")
+        if range_ids_offset + 4 * ranges > len(self.__data) or \
+                strings_offset + 8 * (functions + 1) + strings_size > len(self.__data):
+            raise ValueError(f"Truncated functions index {index_path}")
+
+        string_offsets = np.frombuffer(self.__data, dtype="<u8", count=functions + 1, offset=strings_offset)
+        blob_offset = strings_offset + 8 * (functions + 1)
+        blob = memoryview(self.__data)[blob_offset:blob_offset + strings_size]
+
+        super().__init__(asm_path, {"size": size, "mtime": mtime_ns, "hash": digest.hex()},
+                         StringTable(string_offsets, blob),
+                         np.frombuffer(self.__data, dtype="<u8", count=functions, offset=offsets_offset),
+                         np.frombuffer(self.__data, dtype="<u8", count=functions, offset=lengths_offset),
+                         np.frombuffer(self.__data, dtype="<u8", count=ranges, offset=range_starts_offset),
+                         np.frombuffer(self.__data, dtype="<u8", count=ranges, offset=range_ends_offset),
+                         np.frombuffer(self.__data, dtype="<u4", count=ranges, offset=range_ids_offset))
@@ -2,6 +2,7 @@
 # * Copyright (c) 2022-2024 CAST.  All rights reserved. *
 # *******************************************************
 
+from src.columnar import InstructionColumns
 from src.instruction import Instruction
 from typing import Dict
 
@@ -63,3 +64,11 @@ def parse_function_asm(lines: str) -> Dict[str, Instruction]:
     asm_code = normalize(asm_code)
 
     return asm_code
+
+
+def parse_function_columns(lines: str) -> InstructionColumns:
+    """
+    Parses the function straight into the columnar form (see InstructionColumns),
+    the rows and the basic blocks are the same as of parse_function_asm + FlowGraph.
+    """
+    return InstructionColumns.from_text(lines)
@@ -2,15 +2,49 @@
 # * Copyright (c) 2022-2024 CAST.  All rights reserved. *
 # *******************************************************
 
+import gc
+import itertools
 import json
 import os.path
-from collections import defaultdict
+import re
+from concurrent.futures import ProcessPoolExecutor
 
-from typing import List, Dict, NoReturn
+import numpy as np
+from typing import Iterator, List, Dict, NoReturn, Optional, Sequence, Tuple, Union
+
+from .asm_index import FunctionRanges
+from .file_reader import MappedFile, is_compressed, iter_blocks
+from .inst_mix import InstructionMix
+from .module_map import NO_MODULE, ModuleMap
+from .profile_store import NO_FUNCTION, TOTAL_DYN_INST, ProfileIndex, open_profile, write_profile
 
 BLOCKS_SEGMENT_START = "### Hot Blocks"
 BLOCKS_SEGMENT_END = "### Overall Statistics"
-TOTAL_DYN_INST = 'total_dyn_inst_count'
+PROFILE_FILE_NAME = "bbe_info.bin"
+# Written by the previous versions, still read when a project has no binary profile
+JSON_PROFILE_FILE_NAME = "bbe_info.json"
+PROFILE_SIDECAR_SUFFIX = ".prof"
+# Profiles of the shared libraries are stored next to the profile of the binary, see split_by_modules
+MODULE_PROFILE_FILE_NAME = "bbe_info.{module}.bin"
+
+# Hot blocks segments are parsed in newline aligned chunks of at least this size,
+# by a pool of processes when a file has several chunks
+MIN_CHUNK_SIZE = 16 * 1024 * 1024
+DEFAULT_JOBS = 1
+
+# Base addresses the BBs are rebased from, see get_bb_address
+PIE_LOAD_BASE = 0x555555556000
+QEMU_LOAD_BASE = 0x4000000000
+
+# Fields of a block line as split() gives them: address, count, percents and the function
+# (the last two may be missing). \\S and the whitespaces are those of bytes.split().
+BLOCK_LINE_PATTERN = re.compile(rb"^[ \t\r\x0b\x0c]*(0x\S*)[ \t\r\x0b\x0c]+(\S+)"
+                                rb"(?:[ \t\r\x0b\x0c]+\S+(?:[ \t\r\x0b\x0c]+(\S+))?)?", re.M)
+
+HEX_DIGITS = np.full(256, 255, dtype=np.uint8)
+HEX_DIGITS[np.frombuffer(b"0123456789", dtype=np.uint8)] = np.arange(10)
+HEX_DIGITS[np.frombuffer(b"abcdef", dtype=np.uint8)] = np.arange(10, 16)
+HEX_DIGITS[np.frombuffer(b"ABCDEF", dtype=np.uint8)] = np.arange(10, 16)
 
 class ValueDict(dict):
     def __init__(self):
@@ -24,7 +58,259 @@ class ValueDict(dict):
             self[key] = value
 
 
-def get_bb_address(addr: str) -> str:
+def get_hot_blocks_segment(bbe: MappedFile) -> Tuple[int, int]:
+    segment_start = bbe.find_line(BLOCKS_SEGMENT_START.encode())
+    segment_start = 0 if segment_start < 0 else segment_start
+    segment_end = bbe.find_line(BLOCKS_SEGMENT_END.encode(), segment_start)
+
+    return segment_start, len(bbe) if segment_end < 0 else segment_end
+
+
+def iter_hot_blocks(bbe: MappedFile) -> Iterator[bytes]:
+    """
+    Yields the stripped lines of the hot blocks segment that describe blocks,
+    e.g. b"0x00007fb3790f78f2 25208 25.7495% _dl_relocate_object".
+    """
+    for _, line in bbe.iter_lines(*get_hot_blocks_segment(bbe)):
+        line = line.strip()
+        if line.startswith(b"0x"):
+            yield line
+
+
+def split_into_chunks(bbe: MappedFile, start: int, end: int, count: int) -> List[Tuple[int, int]]:
+    """
+    Splits [start, end) into at most count ranges, each one ends at a line end.
+    """
+    bounds = [start]
+    for ind in range(1, count):
+        bound = min(bbe.line_end(start + (end - start) * ind // count) + 1, end)
+        if bound > bounds[-1]:
+            bounds.append(bound)
+    if end > bounds[-1]:
+        bounds.append(end)
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def decode_hex(tokens: Sequence[bytes]) -> np.ndarray:
+    """
+    Decodes b"0x..." numbers, numbers of the same width are decoded column by column for all of them at once.
+    """
+    if tokens and len(set(map(len, tokens))) == 1 and 2 < len(tokens[0]) <= 18:
+        digits = HEX_DIGITS[np.frombuffer(b"".join(tokens), dtype=np.uint8).reshape(len(tokens), -1)[:, 2:]]
+        if not (digits == 255).any():
+            values = np.zeros(len(tokens), dtype=np.uint64)
+            for column in digits.T:
+                values = (values << np.uint64(4)) | column
+            return values
+
+    return np.array([int(token, 16) for token in tokens], dtype=np.uint64)
+
+
+def rebase_addresses(addresses: np.ndarray) -> np.ndarray:
+    # Vectorized get_bb_address
+    return np.where(addresses >= np.uint64(PIE_LOAD_BASE), addresses - np.uint64(PIE_LOAD_BASE),
+                    np.where(addresses >= np.uint64(QEMU_LOAD_BASE), addresses - np.uint64(QEMU_LOAD_BASE),
+                             addresses))
+
+
+def parse_hot_blocks_data(data: bytes,
+                          rebase: bool = True) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[str]]:
+    """
+    Parses the block lines of data.
+    Returns the addresses (rebased as get_bb_address does, runtime addresses without rebase),
+    the counts and the function ids of the lines in file order and the table of the function names.
+    """
+    # Millions of small objects are created here and none of them can be in a cycle
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        fields = BLOCK_LINE_PATTERN.findall(data)
+        if not fields:
+            return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint32), []
+
+        address_tokens, count_tokens, function_tokens = zip(*fields)
+        del fields
+
+        # A missing function (b"") and "-" are both NO_FUNCTION, merge_hot_blocks maps them to one id
+        functions = {name: ind for ind, name in enumerate(dict.fromkeys(function_tokens))}
+        function_ids = np.fromiter(map(functions.__getitem__, function_tokens), dtype=np.uint32,
+                                   count=len(function_tokens))
+        addresses = decode_hex(address_tokens)
+        if rebase:
+            addresses = rebase_addresses(addresses)
+        counts = np.array(count_tokens, dtype=bytes).astype(np.uint64)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return addresses, counts, function_ids, [name.decode() or NO_FUNCTION for name in functions]
+
+
+def parse_hot_blocks_chunk(file_name: str, start: int, end: int,
+                           rebase: bool = True) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[str]]:
+    with MappedFile(file_name) as bbe:
+        data = bbe.read(start, end)
+
+    return parse_hot_blocks_data(data, rebase)
+
+
+def parse_compressed_hot_blocks(file_name: str,
+                                rebase: bool = True) -> Tuple[List[Tuple[np.ndarray, np.ndarray, np.ndarray, List[str]]],
+                                                              int]:
+    """
+    Compressed files cannot be split in place: they are decompressed as a stream
+    and the hot blocks segment is parsed block by block while it is read.
+    Returns the parsed chunks and the total dynamic instructions count of the file,
+    the segment bounds are those of get_hot_blocks_segment and get_total_dyn_inst_count.
+    """
+    start_marker = BLOCKS_SEGMENT_START.encode()
+    end_marker = BLOCKS_SEGMENT_END.encode()
+
+    # Until the start marker is found the segment is assumed to start at the beginning of the file
+    chunks, fallback_chunks = [], []
+    started = ended = fallback_ended = False
+    total, total_after_end, end_found = 0, 0, False
+
+    for data in iter_blocks(file_name, MIN_CHUNK_SIZE):
+        block = MappedFile.from_bytes(data, file_name)
+
+        total += count_total_dyn_inst(block, 0)
+        if end_found:
+            total_after_end += count_total_dyn_inst(block, 0)
+        else:
+            end_pos = block.find_line(end_marker)
+            if end_pos >= 0:
+                end_found = True
+                total_after_end = count_total_dyn_inst(block, end_pos)
+
+        if started:
+            start_pos = 0
+        else:
+            start_pos = block.find_line(start_marker)
+            started = start_pos >= 0
+            if not started:
+                if not fallback_ended:
+                    end_pos = block.find_line(end_marker)
+                    fallback_ended = end_pos >= 0
+                    fallback_chunks.append(parse_hot_blocks_data(block.read(0, end_pos if fallback_ended
+                                                                            else len(block)), rebase))
+                continue
+
+        if not ended:
+            end_pos = block.find_line(end_marker, start_pos)
+            ended = end_pos >= 0
+            chunks.append(parse_hot_blocks_data(block.read(start_pos, end_pos if ended else len(block)), rebase))
+
+    return chunks if started else fallback_chunks, total_after_end if end_found else total
+
+
+def merge_hot_blocks(chunks: List[Tuple[np.ndarray, np.ndarray, np.ndarray, List[str]]],
+                     total_dyn_inst_count: int) -> ProfileIndex:
+    """
+    Merges the parsed chunks (in file order) the same way the lines were merged one by one:
+    counts of an address are summed, its function is the first known one ("-" is unknown),
+    and functions are numbered in the order of the first lines of their addresses.
+    """
+    names = {NO_FUNCTION: 0}
+    addresses, counts, function_ids = [], [], []
+    for chunk_addresses, chunk_counts, chunk_function_ids, chunk_functions in chunks:
+        remap = np.array([names.setdefault(name, len(names)) for name in chunk_functions] or [0], dtype=np.uint32)
+        addresses.append(chunk_addresses)
+        counts.append(chunk_counts)
+        function_ids.append(remap[chunk_function_ids])
+
+    if not chunks or not sum(len(chunk) for chunk in addresses):
+        return ProfileIndex.from_content({TOTAL_DYN_INST: total_dyn_inst_count})
+
+    addresses = np.concatenate(addresses)
+    counts = np.concatenate(counts)
+    function_ids = np.concatenate(function_ids)
+
+    unique_addresses, first_rows, inverse = np.unique(addresses, return_index=True, return_inverse=True)
+
+    unique_counts = np.zeros(len(unique_addresses), dtype=np.uint64)
+    np.add.at(unique_counts, inverse, counts)
+
+    named_rows = np.flatnonzero(function_ids != names[NO_FUNCTION])
+    first_named_rows = np.full(len(unique_addresses), len(addresses), dtype=np.int64)
+    np.minimum.at(first_named_rows, inverse[named_rows], named_rows)
+    has_name = first_named_rows < len(addresses)
+    unique_function_ids = np.where(has_name, function_ids[np.minimum(first_named_rows, len(addresses) - 1)],
+                                   names[NO_FUNCTION])
+
+    # Number the functions by the first appearance of their addresses
+    functions_in_order = unique_function_ids[np.argsort(first_rows, kind="stable")]
+    used_ids, first_use = np.unique(functions_in_order, return_index=True)
+    table = used_ids[np.argsort(first_use, kind="stable")]
+    new_ids = np.zeros(len(names), dtype=np.uint32)
+    new_ids[table] = np.arange(len(table), dtype=np.uint32)
+
+    names_list = list(names)
+    return ProfileIndex(unique_addresses, unique_counts, new_ids[unique_function_ids],
+                        [names_list[ind] for ind in table], total_dyn_inst_count)
+
+
+def count_by_symbol(chunks: List[Tuple[np.ndarray, np.ndarray, np.ndarray, List[str]]]) -> Tuple[List[str], np.ndarray]:
+    """
+    Sums the counts of the parsed block lines by their own symbols, as the lines are in the files:
+    the BBs are not merged by address and the lines without a symbol ("-") are not counted.
+    """
+    totals = {}
+    for _, chunk_counts, chunk_function_ids, chunk_functions in chunks:
+        chunk_totals = np.zeros(len(chunk_functions), dtype=np.uint64)
+        np.add.at(chunk_totals, chunk_function_ids, chunk_counts)
+        for name, total in zip(chunk_functions, chunk_totals.tolist()):
+            if name != NO_FUNCTION:
+                totals[name] = totals.get(name, 0) + total
+
+    return list(totals), np.array(list(totals.values()), dtype=np.uint64)
+
+
+def count_total_dyn_inst(bbe: MappedFile, start: int) -> int:
+    total = 0
+    pos = bbe.find(b"Total Dynamic Instructions", start)
+    while pos >= 0:
+        line_end = bbe.line_end(pos)
+        total += int(bbe.read(pos, line_end).split(b':')[-1])
+        pos = bbe.find(b"Total Dynamic Instructions", line_end)
+
+    return total
+
+
+def split_by_modules(profile: ProfileIndex, module_map: ModuleMap, main_module: str) -> Dict[str, ProfileIndex]:
+    """
+    Splits the profile of runtime addresses (see BBEFileParser.parse_data without rebase) into the profiles
+    of the modules, their addresses are relative to the load bases of the modules.
+    BBs out of the mapped modules go to main_module, rebased as get_bb_address does,
+    unless the map has main_module itself.
+    """
+    module_ids = module_map.lookup(profile.addresses)
+    functions = list(profile.functions)
+
+    profiles = {}
+    for module_id, name in itertools.chain(enumerate(module_map.names), [(NO_MODULE, main_module)]):
+        if module_id == NO_MODULE and main_module in module_map:
+            continue
+
+        rows = module_ids == module_id
+        addresses = profile.addresses[rows]
+        if module_id == NO_MODULE:
+            addresses = rebase_addresses(addresses)
+        else:
+            addresses = addresses - module_map.bases[module_id]
+
+        chunk = (addresses, profile.counts[rows], profile.function_ids[rows], functions)
+        profiles[name] = merge_hot_blocks([chunk], profile.total_dyn_inst_count)
+
+    return profiles
+
+
+def get_total_dyn_inst_count(bbe: MappedFile) -> int:
+    return count_total_dyn_inst(bbe, max(bbe.find_line(BLOCKS_SEGMENT_END.encode()), 0))
+
+
+def get_bb_address(addr: Union[str, bytes]) -> str:
     tmp_addr = int(addr, 16)
     if tmp_addr >= int("0x555555556000", 16):
         return hex(tmp_addr - 0x555555556000).lstrip("0x")
@@ -35,98 +321,159 @@ def get_bb_address(addr: str) -> str:
 
 
 class BBEFileParser:
-    def __init__(self, project_dir: str):
+    def __init__(self, project_dir: str, jobs: int = DEFAULT_JOBS, profile_file_name: str = PROFILE_FILE_NAME):
         self.__files_names = []
-        self.bbe_info_file = os.path.join(project_dir, "bbe_info.json")
+        # Number of processes parsing the chunks of big files, 0 means one per CPU core
+        self.jobs = jobs
+        self.bbe_info_file = os.path.join(project_dir, profile_file_name)
+        self.bbe_info_json_file = os.path.join(project_dir, JSON_PROFILE_FILE_NAME)
         self.__total_exec_count = 0
         self.__total_dyn_inst_count = 0
-
-    def __process_blocks_segment(self, file_name, process_func) -> None:
-        with open(file_name, "r") as bbe:
-            for line in bbe:
-                line = line.strip()
-                if not line:
-                    continue
-
-                if line.startswith("0x"):
-                    process_func(line)
-                    continue
-
-                if "Total Dynamic Instructions" in line:
-                    self.__total_dyn_inst_count += int(line.split(':')[-1])
-
-
-
-    def parse_and_save_data(self, files: List[str]):
+        # Built once, by parse_and_save_data or on the first lookup
+        self.__profile = None
+
+    def __split_hot_blocks(self, file_name: str, max_chunks: int) -> List[Tuple[str, int, int]]:
+        with MappedFile(file_name) as bbe:
+            start, end = get_hot_blocks_segment(bbe)
+            self.__total_dyn_inst_count += get_total_dyn_inst_count(bbe)
+
+            count = max(1, min(max_chunks, (end - start) // MIN_CHUNK_SIZE))
+            return [(file_name, chunk_start, chunk_end)
+                    for chunk_start, chunk_end in split_into_chunks(bbe, start, end, count)]
+
+    def parse_data(self, files: List[str], rebase: bool = True) -> ProfileIndex:
+        """
+        Without rebase the profile keeps the runtime addresses of the BBs, see split_by_modules.
+        """
         self.__files_names = files
-        content = {}
-
-        def extract_data(line):
-            line_s = line.split()
-            bb_address = get_bb_address(line_s[0]) + ":"
-            exec_count = int(line_s[1])
-            func_name = line_s[3] if 3 < len(line_s) else "-"
-
-            if bb_address in content:
-                content[bb_address]["execution_count"] += exec_count
-                if func_name != "-" and content[bb_address]["function"] == "-":
-                    content[bb_address]["function"] = func_name
-            else:
-                content[bb_address] = {"execution_count": exec_count, "function": func_name}
-
-            self.__total_exec_count += exec_count
+        jobs = self.jobs or os.cpu_count()
 
+        # Plain files are split into (file name, start, end) ranges parsed below, compressed files are
+        # parsed while they are decompressed. Each file has either ranges or parsed chunks, the other list is empty.
+        files_ranges = []
+        files_parsed = []
         for file_name in self.__files_names:
             if not os.path.isfile(file_name):
                 print(f"Cannot find such .bbexec file {file_name}")
                 continue
 
-            self.__process_blocks_segment(file_name, extract_data)
+            if is_compressed(file_name):
+                file_parsed, total_dyn_inst_count = parse_compressed_hot_blocks(file_name, rebase)
+                self.__total_dyn_inst_count += total_dyn_inst_count
+                files_ranges.append([])
+                files_parsed.append(file_parsed)
+            else:
+                files_ranges.append(self.__split_hot_blocks(file_name, jobs * 4))
+                files_parsed.append([])
 
-        content[TOTAL_DYN_INST] = self.__total_dyn_inst_count
+        ranges = [file_range + (rebase,) for file_ranges in files_ranges for file_range in file_ranges]
+        if jobs > 1 and len(ranges) > 1:
+            with ProcessPoolExecutor(max_workers=min(jobs, len(ranges))) as executor:
+                parsed_ranges = list(executor.map(parse_hot_blocks_chunk, *zip(*ranges)))
+        else:
+            parsed_ranges = [parse_hot_blocks_chunk(*file_range) for file_range in ranges]
+
+        # Chunks in the order of the files
+        parsed = []
+        position = 0
+        for file_ranges, file_parsed in zip(files_ranges, files_parsed):
+            parsed.extend(parsed_ranges[position:position + len(file_ranges)])
+            position += len(file_ranges)
+            parsed.extend(file_parsed)
+
+        for _, counts, _, _ in parsed:
+            self.__total_exec_count += int(counts.sum())
+
+        profile = merge_hot_blocks(parsed, self.__total_dyn_inst_count)
+        profile.symbol_totals = count_by_symbol(parsed)
+        return profile
+
+    def parse_and_save_data(self, files: List[str], function_ranges: Optional[FunctionRanges] = None):
+        """
+        With function_ranges of the disassembly the BBs are attributed to the functions by their addresses,
+        see ProfileIndex.attribute_functions.
+        """
+        self.save_profile(self.parse_data(files), function_ranges)
+
+    def save_profile(self, profile: ProfileIndex, function_ranges: Optional[FunctionRanges] = None):
+        if function_ranges is not None and len(function_ranges):
+            profile = profile.attribute_functions(function_ranges)
+
+        write_profile(self.bbe_info_file, profile)
+        # Workers of the parallel mode get the mapped profile by path
+        self.__profile = open_profile(self.bbe_info_file)
+
+    def get_profile(self) -> Optional[ProfileIndex]:
+        if self.__profile is None:
+            if os.path.isfile(self.bbe_info_file):
+                try:
+                    self.__profile = open_profile(self.bbe_info_file)
+                except ValueError as e:
+                    print(f"Warning: {e}")
+                    return None
+            elif os.path.isfile(self.bbe_info_json_file):
+                with open(self.bbe_info_json_file, "r") as bbe_info:
+                    self.__profile = ProfileIndex.from_content(json.load(bbe_info))
+            else:
+                return None
 
-        with open(self.bbe_info_file, "w") as bbe_info:
-            json.dump(content, bbe_info, indent=4)
+        return self.__profile
 
     def extract_usage_info(self, addresses: List) -> Dict[str, int]:
-        if not os.path.isfile(self.bbe_info_file):
+        profile = self.get_profile()
+        if profile is None:
             return {}
 
-        usage_info = {}
-
-        with open(self.bbe_info_file, "r") as bbe_info:
-            data = json.load(bbe_info)
-
-            for address in addresses:
-                info = data.get(address)
-                if info:
-                    usage_info[address] = info.get("execution_count", 0)
-
-        return usage_info
+        return profile.lookup(addresses)
 
     def extract_total_exec_info_for_each_func(self):
-        if not os.path.isfile(self.bbe_info_file):
+        profile = self.get_profile()
+        if profile is None:
             return None
 
-        total_exec_by_func = defaultdict(int)
-
-        with open(self.bbe_info_file, "r") as bbe_info:
-            data = json.load(bbe_info)
-            for addr, info in data.items():
-                if addr == TOTAL_DYN_INST:
-                    total_exec_by_func[TOTAL_DYN_INST] = info
-                    continue
+        return profile.get_total_exec_by_func()
 
-                if info.get("function") == "-":
-                    continue
-
-                total_exec_by_func[info["function"]] += info.get("execution_count", 0)
-
-        return total_exec_by_func
+    def extract_function_stats(self):
+        profile = self.get_profile()
+        if profile is None:
+            return None
 
-    def print_info(self) -> NoReturn:
+        return profile.get_function_stats()
 
-        print(f"Total Instructions: {self.__total_exec_count:,}")
+    def print_info(self, inst_mix: InstructionMix) -> NoReturn:
+        print(f"Total Instructions: {inst_mix.get_total() + inst_mix.unattributed:,}")
         print('Instruction Groups:')
-        for k, v in sorted(self.__inst_group_dict.items(), key=lambda item: item[1], reverse=True):
-            print(k.rjust(18), f"{v:,}")
+        for k, v in sorted(inst_mix.get_group_counts().items(), key=lambda item: item[1], reverse=True):
+            if v:
+                print(k.rjust(18), f"{v:,}")
+        if inst_mix.unattributed:
+            print("not in asm".rjust(18), f"{inst_mix.unattributed:,}")
+
+
+def get_file_profile(bbe_file: str) -> ProfileIndex:
+    """
+    Returns the profile of a single .bbexec file. It is stored in the <file>.prof sidecar
+    and parsed again only when the size or the mtime of the file changes.
+    """
+    sidecar = bbe_file + PROFILE_SIDECAR_SUFFIX
+    stat = os.stat(bbe_file)
+
+    if os.path.isfile(sidecar):
+        try:
+            profile = open_profile(sidecar)
+            # Sidecars written before the symbol totals are parsed again
+            if (profile.source_size, profile.source_mtime_ns) == (stat.st_size, stat.st_mtime_ns) \
+                    and profile.symbol_totals is not None:
+                return profile
+        except (OSError, ValueError) as e:
+            print(f"Warning: Cannot read profile {sidecar}: {e}")
+
+    profile = BBEFileParser(os.path.dirname(bbe_file)).parse_data([bbe_file])
+    profile.source_size = stat.st_size
+    profile.source_mtime_ns = stat.st_mtime_ns
+    try:
+        write_profile(sidecar, profile)
+    except OSError as e:
+        print(f"Warning: Cannot save profile {sidecar}: {e}")
+
+    return profile
@@ -0,0 +1,232 @@
+# *******************************************************
+# * Copyright (c) 2022-2024 CAST.  All rights reserved. *
+# *******************************************************
+
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from src import opcodes
+from src.instruction import Operand, OperandInfo, classify_operands
+from src.registers import NO_REGISTER, get_base_register, get_register_id
+
+# Label lines are kept as rows (as FlowGraph keeps them in its nodes) with this opcode id
+LABEL_OPCODE = -1
+NO_TARGET = -1
+
+OPCODE_FLAGS = np.array(opcodes.OPCODE_FLAGS, dtype=np.int64)
+GROUP_IDS = OPCODE_FLAGS >> opcodes.GROUP_SHIFT
+JAL_OPCODE = opcodes.OPCODE_IDS["jal"]
+
+
+def parse_int(value: str) -> int:
+    # Same bases as Operand.as_int: decimal first, then hex
+    try:
+        return int(value, 10)
+    except ValueError:
+        return int(value, 16)
+
+
+def get_register(operand: OperandInfo) -> int:
+    if operand is None or operand[0] != Operand.Code.REG:
+        return NO_REGISTER
+    return get_register_id(get_base_register(operand[1]))
+
+
+def get_immediate(*operands: OperandInfo) -> int:
+    # A constant operand wins over the offset of a memory operand,
+    # symbolic offsets (%lo(sym)) are not resolved and give 0.
+    try:
+        for operand in operands:
+            if operand and operand[0] == Operand.Code.CONSTANT:
+                return parse_int(operand[1])
+
+        for operand in operands:
+            if operand and operand[0] == Operand.Code.REG and operand[1].endswith(")"):
+                offset = operand[1][:operand[1].index("(")]
+                return parse_int(offset) if offset else 0
+    except ValueError:
+        pass
+
+    return 0
+
+
+class InstructionColumns:
+    """
+    Columnar form of parsed code: one NumPy array per field, a row per objdump line.
+    The rows are those of parse_function_asm and the basic block ids are those of the FlowGraph nodes,
+    so counting, filtering and matching opcodes can run over whole functions
+    (or a whole binary, see concatenate) without creating Instruction objects.
+
+    Register operands keep the id of the register (the base register for memory operands),
+    see src.registers, other operands are NO_REGISTER.
+    """
+
+    FIELDS = ("address", "opcode", "dest", "src1", "src2", "imm", "target", "bb")
+
+    def __init__(self, address: np.ndarray, opcode: np.ndarray, dest: np.ndarray, src1: np.ndarray,
+                 src2: np.ndarray, imm: np.ndarray, target: np.ndarray, bb: np.ndarray):
+        self.address = address
+        self.opcode = opcode
+        self.dest = dest
+        self.src1 = src1
+        self.src2 = src2
+        self.imm = imm
+        self.target = target
+        self.bb = bb
+
+    @classmethod
+    def from_text(cls, lines: str) -> "InstructionColumns":
+        address, opcode, dest, src1, src2, imm, target = [], [], [], [], [], [], []
+
+        for line in lines.splitlines():
+            tmp_list = line.replace(", ", ",").split()
+            if len(tmp_list) < 2:
+                continue
+
+            try:
+                row_address = int(tmp_list[0].rstrip(":"), 16)
+            except ValueError:
+                continue
+
+            row = [LABEL_OPCODE, NO_REGISTER, NO_REGISTER, NO_REGISTER, 0, NO_TARGET]
+            if line[-1] != ":":
+                opcode_id = opcodes.OPCODE_IDS.get(tmp_list[1])
+                if opcode_id is None:
+                    continue
+
+                flags = opcodes.OPCODE_FLAGS[opcode_id]
+                row[0] = opcode_id
+                if not flags & opcodes.FLAG_TERMINATOR:
+                    if len(tmp_list) < 3:
+                        continue
+
+                    arguments = tmp_list[2].split(',')
+                    try:
+                        operands = classify_operands(flags, arguments)
+                    except IndexError:
+                        continue
+
+                    row[4] = get_immediate(*operands)
+                    if flags & (opcodes.FLAG_JUMP | opcodes.FLAG_BRANCH) and len(arguments) == 1:
+                        # The only argument is the target, not a register
+                        operands = (None,) + operands[1:]
+                    row[1:4] = [get_register(operand) for operand in operands]
+
+                    if flags & (opcodes.FLAG_JUMP | opcodes.FLAG_BRANCH):
+                        try:
+                            row[5] = int(arguments[-1].rstrip(":"), 16)
+                        except ValueError:
+                            # Indirect jumps (jr ra)
+                            pass
+
+            address.append(row_address)
+            opcode.append(row[0])
+            dest.append(row[1])
+            src1.append(row[2])
+            src2.append(row[3])
+            imm.append(row[4])
+            target.append(row[5])
+
+        opcode = np.array(opcode, dtype=np.int16)
+        address = np.array(address, dtype=np.int64)
+        target = np.array(target, dtype=np.int64)
+
+        return cls(address, opcode,
+                   np.array(dest, dtype=np.int32), np.array(src1, dtype=np.int32), np.array(src2, dtype=np.int32),
+                   np.array(imm, dtype=np.int64), target, cls.__compute_blocks(address, opcode, target))
+
+    @staticmethod
+    def __compute_blocks(address: np.ndarray, opcode: np.ndarray, target: np.ndarray) -> np.ndarray:
+        # Vectorized form of asm_parser.add_labels + FlowGraph node splitting:
+        # a block starts at a label line, at a jump target inside the function and
+        # after a jal, a ret or a jump/branch whose target is inside the function.
+        size = len(opcode)
+        if not size:
+            return np.zeros(0, dtype=np.int32)
+
+        is_instr = opcode != LABEL_OPCODE
+        flags = np.where(is_instr, OPCODE_FLAGS[opcode], 0)
+
+        instr_rows = np.flatnonzero(is_instr)
+        order = np.argsort(address[instr_rows], kind="stable")
+        sorted_addresses = address[instr_rows][order]
+
+        pos = np.searchsorted(sorted_addresses, target)
+        pos_clipped = np.minimum(pos, max(len(sorted_addresses) - 1, 0))
+        in_function = (target != NO_TARGET) & (pos < len(sorted_addresses))
+        if len(sorted_addresses):
+            in_function &= sorted_addresses[pos_clipped] == target
+
+        leader = ~is_instr
+        leader[0] = True
+        leader[instr_rows[order[pos_clipped[in_function]]]] = True
+
+        split_after = in_function | (opcode == JAL_OPCODE) | (flags & opcodes.FLAG_TERMINATOR != 0)
+        leader[1:] |= split_after[:-1]
+
+        return (np.cumsum(leader) - 1).astype(np.int32)
+
+    @classmethod
+    def concatenate(cls, parts: Sequence["InstructionColumns"]) -> "InstructionColumns":
+        """
+        Joins the columns of several functions, block ids are shifted to stay unique.
+        """
+        if not parts:
+            return cls.from_text("")
+
+        offsets = np.cumsum([0] + [part.num_blocks() for part in parts[:-1]])
+        columns = [np.concatenate([getattr(part, field) for part in parts]) for field in cls.FIELDS[:-1]]
+        bb = np.concatenate([part.bb + offset for part, offset in zip(parts, offsets)]).astype(np.int32)
+        return cls(*columns, bb)
+
+    def __len__(self) -> int:
+        return len(self.opcode)
+
+    def num_blocks(self) -> int:
+        return int(self.bb[-1]) + 1 if len(self.bb) else 0
+
+    def flags(self) -> np.ndarray:
+        return np.where(self.opcode != LABEL_OPCODE, OPCODE_FLAGS[self.opcode], 0)
+
+    def select(self, mask: np.ndarray) -> "InstructionColumns":
+        return InstructionColumns(*[getattr(self, field)[mask] for field in self.FIELDS])
+
+    def opcode_mask(self, names: Iterable[str]) -> np.ndarray:
+        ids = [opcodes.OPCODE_IDS[name] for name in names if name in opcodes.OPCODE_IDS]
+        return np.isin(self.opcode, ids)
+
+    def flag_mask(self, flag: int) -> np.ndarray:
+        return self.flags() & flag != 0
+
+    def count_opcodes(self, weights: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Returns the number of instructions per opcode id, optionally weighted per row
+        (e.g. by the execution count of the block).
+        """
+        valid = self.opcode != LABEL_OPCODE
+        return np.bincount(self.opcode[valid], weights=None if weights is None else weights[valid],
+                           minlength=len(opcodes.OPCODE_NAMES))
+
+    def count_groups(self, weights: Optional[np.ndarray] = None) -> np.ndarray:
+        per_opcode = self.count_opcodes(weights)
+        return np.bincount(GROUP_IDS, weights=per_opcode, minlength=len(opcodes.GROUP_NAMES))
+
+    def find_pairs(self, first: Iterable[str], second: Iterable[str], dependent: bool = False) -> np.ndarray:
+        """
+        Returns the rows of the instructions of first that are immediately followed
+        by an instruction of second in the same basic block.
+        With dependent the second one must also read the destination register of the first.
+        """
+        if len(self) < 2:
+            return np.zeros(0, dtype=np.int64)
+
+        mask = self.opcode_mask(first)[:-1] & self.opcode_mask(second)[1:] & (self.bb[:-1] == self.bb[1:])
+        if dependent:
+            dest = self.dest[:-1]
+            mask &= (dest != NO_REGISTER) & ((dest == self.src1[1:]) | (dest == self.src2[1:]))
+
+        return np.flatnonzero(mask)
+
+    def get_opcode_names(self, rows: np.ndarray) -> List[Optional[str]]:
+        return [opcodes.OPCODE_NAMES[opcode_id] if opcode_id >= 0 else None for opcode_id in self.opcode[rows]]
@@ -0,0 +1,121 @@
+# *******************************************************
+# * Copyright (c) 2022-2024 CAST.  All rights reserved. *
+# *******************************************************
+
+import io
+import re
+from typing import Dict, NoReturn, Optional
+
+DOT_PROGRAM = "dot"
+WRITE_BUFFER_SIZE = 1 << 20
+EMPTY_VALUE = '""'
+
+# IDs of the DOT language as pydot (1.4.2) checks them, the output of DotWriter is the same as pydot's
+DOT_KEYWORDS = {"graph", "subgraph", "digraph", "node", "edge", "strict"}
+ID_RE_ALPHA_NUMS = re.compile(r"^[_a-zA-Z][a-zA-Z0-9_,]*$", re.UNICODE)
+ID_RE_ALPHA_NUMS_WITH_PORTS = re.compile(r'^[_a-zA-Z][a-zA-Z0-9_,:"]*[a-zA-Z0-9_,"]+$', re.UNICODE)
+ID_RE_NUM = re.compile(r"^[0-9,]+$", re.UNICODE)
+ID_RE_WITH_PORT = re.compile(r"^([^:]*):([^:]*)$", re.UNICODE)
+ID_RE_DBL_QUOTED = re.compile(r'^".*"$', re.S | re.UNICODE)
+ID_RE_HTML = re.compile(r"^<.*>$", re.S | re.UNICODE)
+
+
+def needs_quotes(value: str) -> bool:
+    if value in DOT_KEYWORDS:
+        return False
+
+    if any(ord(char) > 0x7f or char == "\0" for char in value) \
+            and not ID_RE_DBL_QUOTED.match(value) and not ID_RE_HTML.match(value):
+        return True
+
+    for regex in (ID_RE_ALPHA_NUMS, ID_RE_NUM, ID_RE_DBL_QUOTED, ID_RE_HTML, ID_RE_ALPHA_NUMS_WITH_PORTS):
+        if regex.match(value):
+            return False
+
+    match = ID_RE_WITH_PORT.match(value)
+    if match:
+        return needs_quotes(match.group(1)) or needs_quotes(match.group(2))
+
+    return True
+
+
+def quote(value: str) -> str:
+    if not value or not needs_quotes(value):
+        return value
+
+    return '"' + value.replace('"', r'\"').replace("\n", r"\n").replace("\r", r"\r") + '"'
+
+
+def format_node_id(name: str) -> str:
+    # The compass point of a node name is dropped from its statement
+    if not name.startswith('"'):
+        ind = name.find(":")
+        if 0 < ind < len(name) - 1:
+            name = name[:ind]
+
+    return quote(quote(name))
+
+
+def format_edge_end(name: str) -> str:
+    name = quote(name)
+    if name.startswith('"') and name.endswith('"'):
+        return name
+
+    ind = name.rfind(":")
+    if ind > 0 and name[0] == '"' and name[ind - 1] == '"':
+        return name
+    if ind > 0:
+        return quote(name[:ind]) + ":" + quote(name[ind + 1:])
+
+    return name
+
+
+def format_attributes(attributes: Dict[str, Optional[str]]) -> str:
+    items = []
+    for name in sorted(attributes):
+        value = attributes[name]
+        if value is None:
+            items.append(name)
+        else:
+            items.append(f"{name}={quote(value) if value else EMPTY_VALUE}")
+
+    return f" [{', '.join(items)}]" if items else ""
+
+
+class DotWriter:
+    """
+    Writes the statements of a graph in the DOT language straight to a buffered file,
+    in the order they are added, without building an object model of the graph.
+    """
+
+    def __init__(self, path: str, name: str = "_graph", graph_type: str = "digraph"):
+        self.__file = io.open(path, "w", buffering=WRITE_BUFFER_SIZE)
+        self.__edge_op = " -> " if graph_type == "digraph" else " -- "
+        self.__file.write(f"{graph_type} {name} {{\n")
+
+    def add_node(self, name: str, attributes: Dict[str, Optional[str]]) -> NoReturn:
+        node_id = format_node_id(name)
+        attributes = format_attributes(attributes)
+        # Defaults statements without attributes are left empty
+        if node_id in ("graph", "node", "edge") and not attributes:
+            self.__file.write("\n")
+        else:
+            self.__file.write(f"{node_id}{attributes};\n")
+
+    def add_edge(self, src: str, dst: str, attributes: Dict[str, Optional[str]] = None) -> NoReturn:
+        self.__file.write(f"{format_edge_end(src)}{self.__edge_op}{format_edge_end(dst)}"
+                          f"{format_attributes(attributes or {})};\n")
+
+    def close(self) -> NoReturn:
+        self.__file.write("}\n")
+        self.__file.close()
+
+    def __enter__(self) -> "DotWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> NoReturn:
+        if exc_type is None:
+            self.close()
+        else:
+            self.__file.close()
+
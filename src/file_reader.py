@@ -0,0 +1,312 @@
+# *******************************************************
+# * Copyright (c) 2022-2024 CAST.  All rights reserved. *
+# *******************************************************
+
+import bz2
+import glob
+import gzip
+import lzma
+import mmap
+import os
+import struct
+from typing import BinaryIO, Iterator, List, NoReturn, Sequence, Tuple
+
+import numpy as np
+
+WHITESPACES = b" \t\r\x0b\x0c"
+
+# Inputs with these suffixes are decompressed while they are read
+COMPRESSION_CODECS = {".gz": gzip, ".bz2": bz2, ".xz": lzma}
+READ_BLOCK_SIZE = 16 * 1024 * 1024
+
+# Compressed files cannot be read from the end, the decompressed tail is kept in the
+# uncompressed <file>.tail sidecar written by the first complete read of the file:
+#   header  (TRAILER_HEADER): magic, version, size and mtime of the compressed file,
+#           decompressed size, size of the tail
+#   bytes   the last TRAILER_SIZE bytes of the decompressed data
+TRAILER_SUFFIX = ".tail"
+TRAILER_SIZE = 64 * 1024
+TRAILER_MAGIC = b"ASMGTAIL"
+TRAILER_VERSION = 1
+TRAILER_HEADER = struct.Struct("<8sIIQQQQ")
+
+
+def get_codec(path: str):
+    return COMPRESSION_CODECS.get(os.path.splitext(path)[1].lower())
+
+
+def is_compressed(path: str) -> bool:
+    return get_codec(path) is not None
+
+
+def strip_compression_suffix(path: str) -> str:
+    return os.path.splitext(path)[0] if is_compressed(path) else path
+
+
+def align(offset: int) -> int:
+    # Columns of the binary sidecars start at 8 byte boundaries
+    return (offset + 7) & ~7
+
+
+def find_inputs(directory: str, suffix: str) -> List[str]:
+    """
+    Returns the files of the directory with the suffix, plain or compressed (e.g. *.bbexec and *.bbexec.gz).
+    """
+    paths = []
+    for codec_suffix in ("",) + tuple(COMPRESSION_CODECS):
+        paths += glob.glob(os.path.join(directory, "*" + suffix + codec_suffix))
+    return paths
+
+
+def open_input(path: str) -> BinaryIO:
+    """
+    Opens the file for binary reading, compressed files are decompressed on the fly.
+    """
+    codec = get_codec(path)
+    return open(path, "rb") if codec is None else codec.open(path, "rb")
+
+
+def get_trailer_path(path: str) -> str:
+    return path + TRAILER_SUFFIX
+
+
+def load_trailer(path: str) -> Tuple[int, bytes]:
+    """
+    Returns the decompressed size and the tail of the compressed file from its sidecar,
+    raises ValueError when the sidecar is missing or does not match the file.
+    """
+    stat = os.stat(path)
+    try:
+        with open(get_trailer_path(path), "rb") as trailer:
+            data = trailer.read()
+    except OSError:
+        raise ValueError(f"No trailer index of {path}")
+
+    if len(data) < TRAILER_HEADER.size:
+        raise ValueError(f"Truncated trailer index of {path}")
+
+    magic, version, _, size, mtime_ns, decompressed_size, tail_size = TRAILER_HEADER.unpack_from(data)
+    if magic != TRAILER_MAGIC or version != TRAILER_VERSION or \
+            (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns) or \
+            len(data) != TRAILER_HEADER.size + tail_size:
+        raise ValueError(f"Outdated trailer index of {path}")
+
+    return decompressed_size, data[TRAILER_HEADER.size:]
+
+
+def save_trailer(path: str, decompressed_size: int, tail: bytes) -> NoReturn:
+    stat = os.stat(path)
+    header = TRAILER_HEADER.pack(TRAILER_MAGIC, TRAILER_VERSION, 0, stat.st_size, stat.st_mtime_ns,
+                                 decompressed_size, len(tail))
+
+    tmp_path = get_trailer_path(path) + ".tmp"
+    try:
+        with open(tmp_path, "wb") as trailer:
+            trailer.write(header + tail)
+        os.replace(tmp_path, get_trailer_path(path))
+    except OSError as e:
+        print(f"Warning: Cannot save trailer index of {path}: {e}")
+
+
+def iter_blocks(path: str, block_size: int = READ_BLOCK_SIZE) -> Iterator[bytes]:
+    """
+    Yields the (decompressed) content of the file in blocks of about block_size that end
+    at line ends, so no line is split between blocks.
+    A complete read of a compressed file also saves its trailer index.
+    """
+    decompressed_size = 0
+    tail = b""
+    rest = b""
+    with open_input(path) as stream:
+        while True:
+            data = stream.read(block_size)
+            if not data:
+                break
+
+            decompressed_size += len(data)
+            tail = (tail + data)[-TRAILER_SIZE:]
+
+            data = rest + data
+            line_end = data.rfind(b"\n") + 1
+            rest = data[line_end:]
+            if line_end:
+                yield data[:line_end]
+
+    if rest:
+        yield rest
+
+    if is_compressed(path):
+        save_trailer(path, decompressed_size, tail)
+
+
+def iter_lines(path: str) -> Iterator[Tuple[int, bytes]]:
+    """
+    Yields (offset, line) pairs of the (decompressed) content of the file, lines keep their line break.
+    Only one block of the file is in memory at a time.
+    """
+    offset = 0
+    for block in iter_blocks(path):
+        pos = 0
+        while pos < len(block):
+            line_end = block.find(b"\n", pos) + 1 or len(block)
+            yield offset + pos, block[pos:line_end]
+            pos = line_end
+        offset += len(block)
+
+
+def read_tail(path: str, size: int = TRAILER_SIZE) -> bytes:
+    """
+    Returns the last size bytes (at most TRAILER_SIZE) of the decompressed content of the file.
+    Compressed files are read completely only when their trailer index is missing or outdated.
+    """
+    size = min(size, TRAILER_SIZE)
+    if not is_compressed(path):
+        with open(path, "rb") as stream:
+            stream.seek(max(os.path.getsize(path) - size, 0))
+            return stream.read()
+
+    try:
+        _, tail = load_trailer(path)
+    except ValueError:
+        for _ in iter_blocks(path):
+            pass
+        _, tail = load_trailer(path)
+
+    return tail[-size:] if size else b""
+
+
+class MappedFile:
+    """
+    Read-only memory-mapped view of a text file.
+    Markers are searched in bytes and only the slices that are actually used are copied or decoded,
+    so big disassemblies and bbexec files never need to be fully loaded.
+    Compressed files (see COMPRESSION_CODECS) cannot be mapped, they are read as streams
+    with iter_blocks or iter_lines.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.__file = None
+        if is_compressed(path):
+            raise ValueError(f"Compressed file {path} cannot be mapped")
+
+        self.__file = open(path, "rb")
+        try:
+            self.__data = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            self.__data = b""
+
+    @classmethod
+    def from_bytes(cls, data: bytes, path: str = "") -> "MappedFile":
+        """
+        View of data that is already in memory, e.g. a block of iter_blocks.
+        """
+        view = cls.__new__(cls)
+        view.path = path
+        view.__file = None
+        view.__data = data
+        return view
+
+    def close(self) -> NoReturn:
+        if isinstance(self.__data, mmap.mmap):
+            self.__data.close()
+        if self.__file is not None:
+            self.__file.close()
+
+    def __enter__(self) -> "MappedFile":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> NoReturn:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.__data)
+
+    def find(self, sub: bytes, start: int = 0, end: int = None) -> int:
+        return self.__data.find(sub, start, len(self.__data) if end is None else end)
+
+    def read(self, start: int, end: int) -> bytes:
+        return self.__data[start:end]
+
+    def decode(self, start: int, end: int) -> str:
+        return self.__data[start:end].decode()
+
+    def line_start(self, pos: int) -> int:
+        return self.__data.rfind(b"\n", 0, pos) + 1
+
+    def line_end(self, pos: int) -> int:
+        end = self.__data.find(b"\n", pos)
+        return len(self.__data) if end < 0 else end
+
+    def find_line(self, prefix: bytes, start: int = 0, end: int = None, whole_line: bool = False) -> int:
+        """
+        Returns the offset of the first line in [start, end) that starts with prefix
+        (leading whitespaces are ignored) or -1 if there is no such line.
+        With whole_line the line must not contain anything else.
+        """
+        pos = start
+        while True:
+            pos = self.find(prefix, pos, end)
+            if pos < 0:
+                return -1
+
+            line_start = self.line_start(pos)
+            if not self.__data[line_start:pos].strip(WHITESPACES):
+                if not whole_line or not self.__data[pos + len(prefix):self.line_end(pos)].strip(WHITESPACES):
+                    return line_start
+            pos += len(prefix)
+
+    def iter_lines_ending_with(self, suffix: bytes, start: int = 0, end: int = None) -> Iterator[int]:
+        """
+        Yields the offsets of the lines in [start, end) that end with suffix (trailing whitespaces are ignored).
+        """
+        pos = start
+        while True:
+            pos = self.find(suffix, pos, end)
+            if pos < 0:
+                return
+
+            line_end = self.line_end(pos)
+            if not self.__data[pos + len(suffix):line_end].strip(WHITESPACES):
+                yield self.line_start(pos)
+                pos = line_end
+            else:
+                pos += len(suffix)
+
+    def iter_lines(self, start: int = 0, end: int = None) -> Iterator[Tuple[int, bytes]]:
+        """
+        Yields (offset, line) pairs of the lines in [start, end), lines are bytes without the line break.
+        """
+        data = self.__data
+        end = len(data) if end is None else end
+        pos = start
+        while pos < end:
+            line_end = data.find(b"\n", pos, end)
+            if line_end < 0:
+                line_end = end
+            yield pos, data[pos:line_end]
+            pos = line_end + 1
+
+
+class StringTable(Sequence):
+    """
+    Strings of a memory-mapped file (e.g. the function names of a profile), decoded when accessed:
+    string i is blob[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, offsets: np.ndarray, blob: memoryview):
+        self.__offsets = offsets
+        self.__blob = blob
+
+    def __len__(self) -> int:
+        return len(self.__offsets) - 1
+
+    def __getitem__(self, ind: int) -> str:
+        if not 0 <= ind < len(self):
+            raise IndexError(ind)
+        return bytes(self.__blob[int(self.__offsets[ind]):int(self.__offsets[ind + 1])]).decode()
+
+    def __iter__(self) -> Iterator[str]:
+        for ind in range(len(self)):
+            yield self[ind]
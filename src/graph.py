@@ -2,27 +2,32 @@
 # * Copyright (c) 2022-2024 CAST.  All rights reserved. *
 # *******************************************************
 
-import signal
-from functools import partial
+from typing import List, Dict, NoReturn, Any, Tuple
 
-import pydot
-from typing import List, Dict, NoReturn, Any
-
-from .funcs_black_list import append_function_to_blacklist
-from .opcodes import loads, stores, branch_instructions, jump_instructions
+from .dot_writer import DotWriter
 from .instruction import Instruction
+from .registers import REGISTER_IDS
+from .render_supervisor import RenderResult, RenderSupervisor
+
+
+def get_operand_key(value: str) -> Any:
+    # Register names are compared by id, other operand values (targets, CSRs) by their text
+    return REGISTER_IDS.get(value, value)
 
 
 class Node:
 
     def __init__(self, label: str,
                  start_address: str,
-                 instruction_list: List[Instruction]):
+                 instruction_list: List[Instruction],
+                 build_dataflow: bool = True):
         # need for iteration
         self.__index = 0
         self.__label = label
         self.__instr_list = list(instruction_list)
-        self.create_dataflow_graph()
+        # Restored nodes (see src.ir_cache) come with the links already set
+        if build_dataflow:
+            self.create_dataflow_graph()
 
         self.__start_address = start_address.lstrip("0")
         if self.__start_address[-1] != ":":
@@ -41,51 +46,51 @@ class Node:
         self.__execution_count = 0
         self.__color = "steelblue"
         self.is_singleton = False
-        self.__dot_Node = None
+        self.__dot_attributes = None
 
     def create_dataflow_graph(self) -> NoReturn:
-        for selected_ins_ind in range(0, len(self.__instr_list)):
-
-            if self.__instr_list[selected_ins_ind].is_ret() or \
-                    self.__instr_list[selected_ins_ind].get_arguments() == []:
-                continue
-
-            self.search_dependencies(selected_ins_ind)
-
-    def search_dependencies(self, selected_ins_ind: int) -> NoReturn:
-        for current_ind in range(selected_ins_ind + 1, len(self.__instr_list)):
-            if not self.__instr_list[current_ind].dest:
+        """
+        Links each instruction to the later instructions of the block that read its destination
+        (dest.output / src.input) in a single forward pass.
+
+        An instruction stays a live definition of its destination until a reader of that register
+        also writes it; writers that do not read the register do not end its lifetime,
+        so several definitions of one register may be live at the same time. A reader links to
+        all of them and its input is the latest one. Stores read their dest operand.
+        """
+        # live definitions: register id -> {instruction index: instruction}, in block order
+        live = {}
+
+        for ind, instr in enumerate(self.__instr_list):
+            # Labels and instructions without arguments neither read nor define registers
+            if not instr.dest:
                 continue
 
-            if self.make_deps(selected_ins_ind, current_ind):
-                break
+            if instr.is_store():
+                self.__link_readers(live, instr, instr.get_dest_name(), "dest", False)
 
-    def make_deps(self, selected_ins_ind: int, next_ins_ind: int) -> bool:
-        selected_ins = self.__instr_list[selected_ins_ind]
-        next_ins = self.__instr_list[next_ins_ind]
+            if instr.src1:
+                self.__link_readers(live, instr, instr.get_src1_name(), "src1", True)
 
-        if next_ins.code in stores:
-            if selected_ins.dest.value == next_ins.get_dest_name():
-                selected_ins.dest.output.append(next_ins)
-                next_ins.dest.input = selected_ins
+            if instr.src2:
+                self.__link_readers(live, instr, instr.get_src2_name(), "src2", True)
 
-        if next_ins.src1:
-            if selected_ins.dest.value == next_ins.get_src1_name():
-                selected_ins.dest.output.append(next_ins)
-                next_ins.src1.input = selected_ins
+            live.setdefault(get_operand_key(instr.dest.value), {})[ind] = instr
 
-                if selected_ins.dest == next_ins.dest:
-                    return True
-
-        if next_ins.src2:
-            if selected_ins.dest.value == next_ins.get_src2_name():
-                selected_ins.dest.output.append(next_ins)
-                next_ins.src2.input = selected_ins
+    @staticmethod
+    def __link_readers(live: Dict, reader: Instruction, reg_name: str, operand: str, can_kill: bool) -> NoReturn:
+        definitions = live.get(get_operand_key(reg_name))
+        if not definitions:
+            return
 
-                if selected_ins.dest == next_ins.dest:
-                    return True
+        operand = getattr(reader, operand)
+        for ind, definition in list(definitions.items()):
+            definition.dest.output.append(reader)
+            operand.input = definition
 
-        return False
+            # The reader overwrites the register it reads, older values are not visible anymore
+            if can_kill and definition.dest == reader.dest:
+                del definitions[ind]
 
     def get_label(self) -> str:
         return self.__label
@@ -119,11 +124,8 @@ class Node:
 
     def has_singleton_inst(self) -> bool:
         if len(self.__instr_list) == 1:
-            opcode = self.get_inner_content().split()[1]
-            jumps = jump_instructions + ['ret\\l', 'ret\l', 'ret\l\t']
-            unnecessary_opcodes = loads + stores + jumps + branch_instructions
-
-            if opcode not in unnecessary_opcodes:
+            instr = self.__instr_list[0]
+            if not (instr.is_load() or instr.is_store() or instr.is_jump() or instr.is_branch()):
                 return True
         return False
 
@@ -133,11 +135,11 @@ class Node:
         else:
             content = f"{self.__label} \l\t{self.__content}\l"
 
-        self.__dot_Node = pydot.Node(self.__label, label=content, margin="0.3",
-                                     style="filled", shape="rect", color=self.__color)
+        self.__dot_attributes = {"label": content, "margin": "0.3", "style": "filled",
+                                 "shape": "rect", "color": self.__color}
 
-    def get_dot_node(self) -> pydot.Node:
-        return self.__dot_Node
+    def get_dot_attributes(self) -> Dict[str, str]:
+        return self.__dot_attributes
 
     def __eq__(self, other: __init__) -> bool:
         return self.__label == other.get_label()
@@ -180,6 +182,11 @@ class FlowGraph:
         self.__asm_code = asm_code
         self.nodes = []
         self.edges = {}
+        # Maintained by add_node/add_edge together with nodes and edges:
+        # label -> node, start address -> node (first node of the address) and node -> source nodes.
+        self.labels = {}
+        self.addresses = {}
+        self.predecessors = {}
 
         self.__set_nodes()
         self.__set_edges()
@@ -188,20 +195,36 @@ class FlowGraph:
         self.__color_type = "ylorrd9"
         self.__color_id = 9
 
+    @classmethod
+    def restore(cls, nodes: List[Node], edges: List[Tuple[int, int]]) -> "FlowGraph":
+        """
+        Creates the graph from ready nodes and (source index, destination index) edges.
+        """
+        graph = cls({})
+        for node in nodes:
+            graph.add_node(node)
+        for src, dest in edges:
+            graph.add_edge(Edge(nodes[src], nodes[dest]))
+        return graph
+
     def add_node(self, node: Node) -> NoReturn:
-        if node in self.nodes:
+        # Nodes are equal when their labels are
+        if node.get_label() in self.labels:
             print("This node is already in graph!")
         else:
             self.nodes.append(node)
             self.edges[node] = []
-            self.edges[node] = []
+            self.predecessors[node] = []
+            self.labels[node.get_label()] = node
+            self.addresses.setdefault(node.get_address(), node)
 
     def add_edge(self, edge: Edge) -> NoReturn:
         src = edge.get_source()
         dest = edge.get_destination()
-        if not (src in self.nodes and dest in self.nodes):
+        if not (src.get_label() in self.labels and dest.get_label() in self.labels):
             print("Can not create edge, no such nodes!")
         self.edges[src].append(dest)
+        self.predecessors[dest].append(src)
 
     def __set_nodes(self) -> NoReturn:
         instruction_list = []
@@ -250,10 +273,16 @@ class FlowGraph:
                 node.set_usage_info(0)
 
     def find_node_with_label(self, label: str) -> Any:
-        for node in self.nodes:
-            if node.get_label() == label:
-                return node
-        return None
+        return self.labels.get(label)
+
+    def find_node_with_address(self, address: str) -> Any:
+        return self.addresses.get(address)
+
+    def get_successors(self, node: Node) -> List[Node]:
+        return self.edges.get(node, [])
+
+    def get_predecessors(self, node: Node) -> List[Node]:
+        return self.predecessors.get(node, [])
 
     def __max_percent(self) -> int:
         max_p = 0
@@ -277,49 +306,36 @@ class FlowGraph:
                         node.set_color(f"/{self.__color_type}/{i + 1}")
                         break
 
-    def __set_dot_nodes(self, graph: pydot.Dot) -> NoReturn:
+    def __write_dot(self, writer: DotWriter) -> NoReturn:
         for node in self.nodes:
-            graph.add_node(node.get_dot_node())
+            writer.add_node(node.get_label(), node.get_dot_attributes())
 
-    def __set_dot_edges(self, graph: pydot.Dot) -> NoReturn:
         for src in self.nodes:
             for dest in self.edges[src]:
-                graph.add_edge(pydot.Edge(src=src.get_label(), dst=dest.get_label()))
+                writer.add_edge(src.get_label(), dest.get_label())
 
     def find_singleton_bbs(self) -> NoReturn:
-        for src in self.nodes:
-            for dest in self.edges[src]:
-                if dest.has_singleton_inst() and self.edges.get(dest):
-                    for dd in self.edges[dest]:
-                        if dd in self.edges[src]:
-                            dest.is_singleton = True
-                            self.__color = "limegreen"
-
-    def draw_graph(self, out_dot_file: str) -> NoReturn:
-        # In some cases DOT lib hang over,
-        # Processing each function should not be longer than 10 minutes
-        signal.signal(signal.SIGALRM, partial(self.__handler, out_dot_file))
-        signal.alarm(600)
+        # A singleton BB can be skipped: its predecessor also jumps directly to its successor
+        for dest in self.nodes:
+            if not dest.has_singleton_inst() or not self.edges.get(dest):
+                continue
+
+            for src in self.predecessors[dest]:
+                src_successors = set(self.edges[src])
+                if any(dd in src_successors for dd in self.edges[dest]):
+                    dest.is_singleton = True
+                    self.__color = "limegreen"
+                    break
 
+    def draw_graph(self, out_dot_file: str, supervisor: RenderSupervisor = None) -> RenderResult:
+        # Graphviz may hang over on some functions, the layout is limited by the budgets of the supervisor
         if self.usage_info:
             self.__set_color()
 
         for node in self.nodes:
             node.create_dot_node()
 
-        graph = pydot.Dot("_graph", graph_type="digraph")
-
-        self.__set_dot_nodes(graph)
-        self.__set_dot_edges(graph)
-        graph.write_dot(out_dot_file)
-
-        signal.alarm(0)
-        signal.signal(signal.SIGALRM, signal.SIG_DFL)
-
-    @staticmethod
-    def __handler(func_name, signum: int, frame: Any) -> None:
-        append_function_to_blacklist(func_name)
-        raise TimeoutError(f"Function {func_name} time out!!!")
+        return (supervisor or RenderSupervisor()).render(out_dot_file, self.__write_dot)
 
     def __str__(self):
         result = ''
@@ -0,0 +1,99 @@
+# *******************************************************
+# * Copyright (c) 2022-2024 CAST.  All rights reserved. *
+# *******************************************************
+
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from src import opcodes
+from src.asm_parser import parse_function_columns
+from src.columnar import GROUP_IDS, LABEL_OPCODE, InstructionColumns
+from src.profile_store import ProfileIndex
+
+# A translation block of QEMU runs from its start to the first control transfer (inclusive)
+BLOCK_END_FLAGS = opcodes.FLAG_BRANCH | opcodes.FLAG_TERNARY_BRANCH | opcodes.FLAG_JUMP | opcodes.FLAG_TERMINATOR
+
+
+class InstructionMix:
+    """
+    Dynamic instruction counts per function and per group of INSN_GROUP_DICT (columns in GROUP_NAMES order),
+    like the instruction groups of llvm-mca weighted by the profile.
+    Executed instructions of the profile BBs that are not in the disassembly are counted as unattributed.
+    """
+
+    def __init__(self, functions: List[str], counts: np.ndarray, unattributed: int):
+        self.functions = functions
+        self.counts = counts
+        self.unattributed = unattributed
+
+    def get_group_counts(self) -> Dict[str, int]:
+        totals = np.rint(self.counts.sum(axis=0)).astype(np.int64).tolist()
+        return dict(zip(opcodes.GROUP_NAMES, totals))
+
+    def get_function_counts(self) -> Dict[str, Dict[str, int]]:
+        return {function: dict(zip(opcodes.GROUP_NAMES, row))
+                for function, row in zip(self.functions, np.rint(self.counts).astype(np.int64).tolist())}
+
+    def get_total(self) -> int:
+        return int(np.rint(self.counts.sum()))
+
+
+def compute_instruction_mix(columns: InstructionColumns, function_ids: np.ndarray,
+                            functions: List[str], profile: ProfileIndex) -> InstructionMix:
+    """
+    The executed instructions of a profile BB are spread evenly over the instructions of its translation
+    block: the instructions from the BB address up to the first control transfer. With the incidence
+    matrix of the blocks and the instructions, the executions of the instructions are the product
+    of its transpose and the block weights (count / length). The matrix is not built, the product
+    is a difference array over the sorted instructions, followed by one bincount per function and group.
+    """
+    groups = len(opcodes.GROUP_NAMES)
+    counts = np.zeros((len(functions), groups))
+
+    is_instr = columns.opcode != LABEL_OPCODE
+    rows = np.flatnonzero(is_instr)
+    rows = rows[np.argsort(columns.address[rows], kind="stable")]
+    if not len(rows) or not len(profile.addresses):
+        return InstructionMix(functions, counts, int(profile.counts.sum()))
+
+    addresses = columns.address[rows].astype(np.uint64)
+    opcode = columns.opcode[rows]
+
+    # First block end at or after each instruction, the last instruction ends the last block
+    ends = np.where(columns.flags()[rows] & BLOCK_END_FLAGS != 0, np.arange(len(rows)), len(rows) - 1)
+    ends = np.minimum.accumulate(ends[::-1])[::-1]
+
+    positions = np.searchsorted(addresses, profile.addresses)
+    positions_clipped = np.minimum(positions, len(rows) - 1)
+    found = (positions < len(rows)) & (addresses[positions_clipped] == profile.addresses)
+
+    starts = positions_clipped[found]
+    block_ends = ends[starts]
+    block_counts = profile.counts[found].astype(np.float64)
+    weights = block_counts / (block_ends - starts + 1)
+
+    executions = np.zeros(len(rows) + 1)
+    np.add.at(executions, starts, weights)
+    np.add.at(executions, block_ends + 1, -weights)
+    executions = np.cumsum(executions[:-1])
+
+    cells = function_ids[rows].astype(np.int64) * groups + GROUP_IDS[opcode]
+    counts = np.bincount(cells, weights=executions, minlength=len(functions) * groups).reshape(-1, groups)
+
+    return InstructionMix(functions, counts, int(profile.counts[~found].sum()))
+
+
+def compute_functions_mix(functions: Iterable[Tuple[str, str]], profile: ProfileIndex) -> InstructionMix:
+    """
+    Computes the instruction mix of the (function name, function body) pairs (see asm_graph.iter_funcs).
+    """
+    names, parts = [], []
+    for function_name, content in functions:
+        names.append(function_name)
+        parts.append(parse_function_columns(content))
+
+    columns = InstructionColumns.concatenate(parts)
+    function_ids = np.repeat(np.arange(len(parts), dtype=np.int64), [len(part) for part in parts])
+
+    return compute_instruction_mix(columns, function_ids, names, profile)
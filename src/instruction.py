@@ -2,8 +2,11 @@
 # * Copyright (c) 2022-2024 CAST.  All rights reserved. *
 # *******************************************************
 
+import sys
+
 from src import opcodes
-from typing import List, NoReturn
+from src.registers import get_base_register
+from typing import List, NoReturn, Optional, Tuple
 from enum import Enum
 
 
@@ -14,11 +17,30 @@ class Operand:
         CONSTANT = 3
         CALL = 4
 
+    __slots__ = ("code", "value", "input", "__output")
+
     def __init__(self, code: Code, value: str):
         self.code = code
-        self.value = value
+        # Register names and constants repeat a lot, share the strings
+        self.value = sys.intern(value)
         self.input = None
-        self.output = []
+        self.__output = None
+
+    @property
+    def output(self) -> List["Instruction"]:
+        # Most operands are never read by other instructions, the list is created on demand
+        if self.__output is None:
+            self.__output = []
+        return self.__output
+
+    def __getstate__(self) -> Tuple:
+        # Dataflow links are not part of the state, they are stored by the graph (see src.ir_cache)
+        return self.code, self.value
+
+    def __setstate__(self, state: Tuple) -> NoReturn:
+        self.code, self.value = state
+        self.input = None
+        self.__output = None
 
     def as_int(self) -> int:
         assert self.code == self.Code.CONSTANT, f"Operand is not a constant [{self.value}]"
@@ -54,80 +76,123 @@ class Operand:
         return self.value == other.value
 
 
+OperandInfo = Optional[Tuple[Operand.Code, str]]
+
+
+def is_constant(arg: str) -> bool:
+    if arg.startswith("0x"):
+        return True
+    try:
+        int(arg, 10)
+        return True
+    except ValueError:
+        # It is register
+        return False
+
+
+def classify_operands(flags: int, arguments: List[str]) -> Tuple[OperandInfo, OperandInfo, OperandInfo]:
+    """
+    Returns (kind, value) of dest, src1 and src2 of an instruction with the given opcode flags.
+    Instruction and the columnar store (see src.columnar) both take the operand shapes from here.
+    """
+    dest = (Operand.Code.REG, arguments[0])
+    src2 = None
+
+    if flags & (opcodes.FLAG_JUMP | opcodes.FLAG_BRANCH):
+        src1 = (Operand.Code.ADDRESS, arguments[-1])
+        if flags & opcodes.FLAG_TERNARY_BRANCH:
+            src1, src2 = (Operand.Code.REG, arguments[-2]), src1
+    else:
+        src1 = (Operand.Code.REG, arguments[-2])
+        arg = arguments[-1]
+        src2 = (Operand.Code.CONSTANT if is_constant(arg) else Operand.Code.REG, arg)
+
+    if flags & opcodes.FLAG_BINARY:
+        dest, src1, src2 = src1, src2, None
+
+    return dest, src1, src2
+
+
 class Instruction:
+    # The objdump line is the only text kept, the rest is stored in compact form:
+    # the address as int, the opcode as an interned id (see opcodes.OPCODE_IDS)
+    # and its properties as the bitmask from opcodes.OPCODE_FLAGS.
+    __slots__ = ("__line", "__address", "__opcode", "__flags", "__label", "__jump_target",
+                 "dest", "src1", "src2")
+
     def __init__(self, line: str):
-        self.__content = line
-        self.__content = self.__content.replace(", ", ",")
-        tmp_list = self.__content.split()
-        self.__address = tmp_list[0]
-        self.__arguments = []
+        self.__line = line
+        tmp_list = line.replace(", ", ",").split()
+        self.__address = int(tmp_list[0].rstrip(":"), 16)
+        self.__opcode = -1
+        self.__flags = 0
         self.__jump_target = None
         self.dest = None
         self.src1 = None
         self.src2 = None
-        self.code = None
 
-        if self.__content[-1] == ":":
+        if line[-1] == ":":
             self.__label = tmp_list[1]
-            self.__is_branch = False
-            self.__is_jump = False
-            self.__is_ret = False
         else:
             self.__label = None
-            self.code = tmp_list[1]
-            if self.code not in opcodes.INSN_GROUP_DICT:
-                msg = f"Wrong opcode: {self.code} ({line})"
+            code = tmp_list[1]
+            if code not in opcodes.OPCODE_IDS:
+                msg = f"Wrong opcode: {code} ({line})"
                 print(msg)
                 raise ValueError(msg)
 
-            self.__is_branch = self.code in opcodes.branch_instructions
-            self.__is_jump = self.code in opcodes.jump_instructions
-            self.__is_ret = self.code in opcodes.terminate
+            self.__opcode = opcodes.OPCODE_IDS[code]
+            self.__flags = flags = opcodes.OPCODE_FLAGS[self.__opcode]
 
-            if not self.__is_ret:
+            if not flags & opcodes.FLAG_TERMINATOR:
                 assert len(tmp_list) > 2, f"Interesting case {line}"
 
-                self.__arguments = tmp_list[2].split(',')
-                self.dest = Operand(Operand.Code.REG, self.__arguments[0])
-
-                if self.__is_jump or self.__is_branch:
-                    self.__jump_target = tmp_list[2].split(",")[-1]
-                    self.src1 = Operand(Operand.Code.ADDRESS, self.__jump_target)
+                arguments = tmp_list[2].split(',')
+                dest, src1, src2 = classify_operands(flags, arguments)
+                self.dest = Operand(*dest)
+                self.src1 = Operand(*src1) if src1 else None
+                self.src2 = Operand(*src2) if src2 else None
 
+                if flags & (opcodes.FLAG_JUMP | opcodes.FLAG_BRANCH):
+                    self.__jump_target = arguments[-1]
                     if self.__jump_target[-1] != ":":
                         self.__jump_target = self.__jump_target + ":"
 
-                    if self.code in opcodes.ternary_branch_instructions:
-                        tmp_operand = self.src1
-                        self.src1 = Operand(Operand.Code.REG, tmp_list[2].split(",")[-2])
-                        self.src2 = tmp_operand
-                else:
-                    self.src1 = Operand(Operand.Code.REG, tmp_list[2].split(",")[-2])
-                    arg = tmp_list[2].split(",")[-1]
-
-                    if arg.startswith("0x"):
-                        self.src2 = Operand(Operand.Code.CONSTANT, arg)
-                    else:
-                        try:
-                            int(arg, 10)
-                            self.src2 = Operand(Operand.Code.CONSTANT, arg)
-                        except ValueError:
-                            # It is register
-                            self.src2 = Operand(Operand.Code.REG, arg)
-
-                if self.code in opcodes.binary_instructions:
-                    self.dest = self.src1
-                    self.src1 = self.src2
-                    self.src2 = None
+    def __getstate__(self) -> Tuple:
+        return (self.__line, self.__address, self.__opcode, self.__flags, self.__label, self.__jump_target,
+                self.dest, self.src1, self.src2)
+
+    def __setstate__(self, state: Tuple) -> NoReturn:
+        (self.__line, self.__address, self.__opcode, self.__flags, self.__label, self.__jump_target,
+         self.dest, self.src1, self.src2) = state
+
+    @property
+    def code(self) -> Optional[str]:
+        return opcodes.OPCODE_NAMES[self.__opcode] if self.__opcode >= 0 else None
+
+    def get_opcode_id(self) -> int:
+        return self.__opcode
+
+    def get_flags(self) -> int:
+        return self.__flags
+
+    def get_group_id(self) -> int:
+        return opcodes.get_group_id(self.__flags) if self.__opcode >= 0 else -1
 
     def is_ret(self) -> bool:
-        return self.__is_ret
+        return bool(self.__flags & opcodes.FLAG_TERMINATOR)
 
     def is_jump(self) -> bool:
-        return self.__is_jump
+        return bool(self.__flags & opcodes.FLAG_JUMP)
 
     def is_branch(self) -> bool:
-        return self.__is_branch
+        return bool(self.__flags & opcodes.FLAG_BRANCH)
+
+    def is_load(self) -> bool:
+        return bool(self.__flags & opcodes.FLAG_LOAD)
+
+    def is_store(self) -> bool:
+        return bool(self.__flags & opcodes.FLAG_STORE)
 
     def is_store_to_stack(self, byte: int = 8) -> bool:
         if self.code is None:
@@ -145,13 +210,15 @@ class Instruction:
             raise ValueError(f"Unsupported store instruction {self.code}")
 
     def get_arguments(self) -> List[str]:
-        return self.__arguments
+        if self.__opcode < 0 or self.__flags & opcodes.FLAG_TERMINATOR:
+            return []
+        return self.__line.replace(", ", ",").split()[2].split(',')
 
     def get_address(self) -> str:
-        return self.__address
+        return self.__line.split(maxsplit=1)[0]
 
     def get_address_int(self) -> int:
-        return int(self.__address.strip(':'), 16)
+        return self.__address
 
     def get_jump_target(self) -> str:
         return self.__jump_target
@@ -160,16 +227,13 @@ class Instruction:
         return self.__label
 
     def get_dest_name(self) -> str:
-        reg = self.dest.value
-        return reg if "(" not in reg else reg[reg.index('(') + 1: reg.index(')')]
+        return get_base_register(self.dest.value)
 
     def get_src1_name(self) -> str:
-        reg = self.src1.value
-        return reg if "(" not in reg else reg[reg.index('(') + 1: reg.index(')')]
+        return get_base_register(self.src1.value)
 
     def get_src2_name(self) -> str:
-        reg = self.src2.value
-        return reg if "(" not in reg else reg[reg.index('(') + 1: reg.index(')')]
+        return get_base_register(self.src2.value)
 
     def set_jump_target(self, target: str) -> NoReturn:
         self.__jump_target = target
@@ -178,4 +242,5 @@ class Instruction:
         self.__label = label
 
     def __str__(self) -> NoReturn:
-        return self.__content
+        # The text is rebuilt from the objdump line only when it is printed
+        return self.__line.replace(", ", ",")
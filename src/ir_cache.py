@@ -0,0 +1,296 @@
+# *******************************************************
+# * Copyright (c) 2022-2024 CAST.  All rights reserved. *
+# *******************************************************
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import zlib
+from typing import Callable, List, NoReturn, Optional, Tuple
+
+from src import opcodes
+from src.asm_index import split_function_lines
+from src.graph import FlowGraph, Node
+from src.instruction import Instruction, Operand
+
+IR_CACHE_VERSION = 2
+IR_FILE_SUFFIX = ".ir"
+DEFAULT_IR_CACHE_SIZE_MB = 512
+
+# Leading address of a listing line and the address of a "<symbol+offset>" target
+LINE_ADDRESS_RE = re.compile(r"^[0-9a-fA-F]+")
+TARGET_ADDRESS_RE = re.compile(r"\b[0-9a-fA-F]+(?=\s+<)")
+# Stored jump target of the instructions that jump to the address of their line (see get_line_target)
+LINE_TARGET = ""
+OPERAND_CODES = {code.value: code for code in Operand.Code}
+
+
+def get_sources_digest(paths: List[str]) -> str:
+    """
+    Returns the digest of the contents of the source files.
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, "rb") as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+# Entries depend on the opcode tables and on the code that builds and restores the graphs:
+# ids and flags are stored, not recomputed
+IR_SOURCES = [os.path.join(os.path.dirname(__file__), name)
+              for name in ("asm_parser.py", "graph.py", "instruction.py", "opcodes.py", "registers.py", "ir_cache.py")]
+IR_SCHEMA = hashlib.sha1(repr((IR_CACHE_VERSION, opcodes.OPCODE_NAMES, opcodes.OPCODE_FLAGS,
+                               get_sources_digest(IR_SOURCES))).encode()).hexdigest()
+
+
+def get_line_address(line: str) -> Optional[int]:
+    match = LINE_ADDRESS_RE.match(line)
+    return int(match.group(), 16) if match else None
+
+
+def get_base_address(lines: List[str]) -> int:
+    """
+    Returns the address of the first line (the header) of the function, entries store addresses relative to it.
+    """
+    address = get_line_address(lines[0]) if lines else None
+    return address or 0
+
+
+def normalize_addresses(lines: List[str]) -> List[str]:
+    """
+    Replaces the leading addresses of the lines with the offsets from the function start and drops the addresses
+    of the "<symbol+offset>" targets, so a function that only moved has the same key.
+    """
+    base = get_base_address(lines)
+    normalized = []
+    for line in lines:
+        address = get_line_address(line)
+        if address is not None:
+            line = f"{address - base:x}" + line[LINE_ADDRESS_RE.match(line).end():]
+        normalized.append(TARGET_ADDRESS_RE.sub("", line))
+    return normalized
+
+
+def get_function_key(content: str) -> str:
+    digest = hashlib.sha1(IR_SCHEMA.encode())
+    digest.update("\n".join(normalize_addresses(split_function_lines(content))).encode())
+    return digest.hexdigest()
+
+
+def get_line_target(line: str) -> str:
+    # The same argument Instruction takes the jump target and the address operand from
+    return line.replace(", ", ",").split()[2].split(",")[-1]
+
+
+def dump_graph(graph: FlowGraph, lines: List[str]) -> bytes:
+    """
+    Serializes the freshly built graph of the function lines: instructions, nodes as (label, size),
+    edges and dataflow links as indices. Instructions keep the index of their line and their address
+    relative to the function start instead of the text, the jump targets and the address operands that come
+    from the line are taken from it again by load_graph, so the entry fits any copy of the function.
+    """
+    instructions = [instr for node in graph.nodes for instr in node]
+    index = {id(instr): ind for ind, instr in enumerate(instructions)}
+    node_index = {id(node): ind for ind, node in enumerate(graph.nodes)}
+    line_index = {line: ind for ind, line in enumerate(lines)}
+    base = get_base_address(lines)
+
+    def dump_operand(operand: Optional[Operand]) -> Optional[list]:
+        if operand is None:
+            return None
+        return [operand.code.value, None if operand.code == Operand.Code.ADDRESS else operand.value]
+
+    def input_index(operand) -> int:
+        return -1 if operand is None or operand.input is None else index[id(operand.input)]
+
+    states = []
+    for instr in instructions:
+        line, address, opcode, flags, label, jump_target, dest, src1, src2 = instr.__getstate__()
+        if line not in line_index:
+            raise ValueError(f"Line of the instruction {instr} is not in the function")
+
+        if jump_target is not None:
+            target = get_line_target(line)
+            if jump_target in (target, target + ":"):
+                jump_target = LINE_TARGET
+        states.append([line_index[line], address - base, opcode, flags, label, jump_target,
+                       dump_operand(dest), dump_operand(src1), dump_operand(src2)])
+
+    links = []
+    for ind, instr in enumerate(instructions):
+        if instr.dest is None:
+            continue
+
+        outputs = [index[id(out)] for out in instr.dest.output]
+        inputs = (input_index(instr.dest), input_index(instr.src1), input_index(instr.src2))
+        if outputs or inputs != (-1, -1, -1):
+            links.append((ind, outputs, inputs))
+
+    nodes = [(node.get_label(), len(node)) for node in graph.nodes]
+    edges = [(node_index[id(src)], node_index[id(dest)]) for src in graph.nodes for dest in graph.edges[src]]
+
+    return zlib.compress(json.dumps([states, nodes, edges, links], separators=(",", ":")).encode())
+
+
+def load_graph(data: bytes, lines: List[str]) -> FlowGraph:
+    """
+    Restores the graph saved by dump_graph for the lines of a function with the same key.
+    """
+    states, nodes, edges, links = json.loads(zlib.decompress(data))
+    base = get_base_address(lines)
+
+    def load_operand(state: Optional[list], line: str) -> Optional[Operand]:
+        if state is None:
+            return None
+
+        code, value = state
+        operand = Operand.__new__(Operand)
+        operand.__setstate__((OPERAND_CODES[code], get_line_target(line) if value is None else value))
+        return operand
+
+    instructions = []
+    for line_ind, address, opcode, flags, label, jump_target, dest, src1, src2 in states:
+        line = lines[line_ind]
+        if jump_target == LINE_TARGET:
+            jump_target = get_line_target(line)
+            if jump_target[-1] != ":":
+                jump_target += ":"
+
+        instr = Instruction.__new__(Instruction)
+        instr.__setstate__((line, base + address, opcode, flags, label, jump_target,
+                            load_operand(dest, line), load_operand(src1, line), load_operand(src2, line)))
+        instructions.append(instr)
+
+    for ind, outputs, inputs in links:
+        instr = instructions[ind]
+        if outputs:
+            instr.dest.output.extend(instructions[out] for out in outputs)
+
+        for operand, input_ind in zip((instr.dest, instr.src1, instr.src2), inputs):
+            if input_ind >= 0:
+                operand.input = instructions[input_ind]
+
+    graph_nodes = []
+    start = 0
+    for label, size in nodes:
+        block = instructions[start:start + size]
+        graph_nodes.append(Node(label, block[0].get_address(), block, build_dataflow=False))
+        start += size
+
+    return FlowGraph.restore(graph_nodes, [tuple(edge) for edge in edges])
+
+
+class IRCache:
+    """
+    On-disk cache of built FlowGraphs, keyed by the hash of the normalized function body
+    (with the addresses relative to the function start), so unchanged functions are not parsed
+    again by later runs, even when they moved. Entries are plain data (zlib-compressed JSON),
+    loading one never runs code.
+
+    Entries are touched when used and the least recently used ones are removed by evict
+    when the cache outgrows max_size. Several processes may share the directory:
+    entries are written to a temporary file and renamed.
+    """
+
+    def __init__(self, cache_dir: str, max_size_mb: int = DEFAULT_IR_CACHE_SIZE_MB):
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + IR_FILE_SUFFIX)
+
+    def get(self, content: str) -> Optional[FlowGraph]:
+        path = self.get_entry_path(get_function_key(content))
+        try:
+            with open(path, "rb") as entry:
+                graph = load_graph(entry.read(), split_function_lines(content))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Warning: Removing broken IR cache entry {path}: {e}")
+            self.__remove(path)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return graph
+
+    def put(self, content: str, graph: FlowGraph) -> NoReturn:
+        path = self.get_entry_path(get_function_key(content))
+        tmp_path = None
+        try:
+            data = dump_graph(graph, split_function_lines(content))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as entry:
+                entry.write(data)
+            os.replace(tmp_path, path)
+            tmp_path = None
+        except (OSError, ValueError) as e:
+            print(f"Warning: Cannot write IR cache entry {path}: {e}")
+        finally:
+            if tmp_path is not None:
+                self.__remove(tmp_path)
+
+    def get_or_build(self, content: str, build: Callable[[str], FlowGraph]) -> FlowGraph:
+        graph = self.get(content)
+        if graph is not None:
+            self.hits += 1
+            return graph
+
+        self.misses += 1
+        graph = build(content)
+        self.put(content, graph)
+        return graph
+
+    def take_counters(self) -> Tuple[int, int]:
+        counters = (self.hits, self.misses)
+        self.hits = self.misses = 0
+        return counters
+
+    def add_counters(self, counters: Tuple[int, int]) -> NoReturn:
+        self.hits += counters[0]
+        self.misses += counters[1]
+
+    def evict(self) -> NoReturn:
+        entries: List[Tuple[float, int, str]] = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if self.__remove(path):
+                total_size -= size
+                self.evicted += 1
+
+    def report(self) -> NoReturn:
+        total = self.hits + self.misses
+        hit_rate = 100 * self.hits / total if total else 0
+        print(f"IR cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+              f"{self.evicted} entries evicted.")
+
+    @staticmethod
+    def __remove(path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
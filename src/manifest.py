@@ -0,0 +1,134 @@
+# *******************************************************
+# * Copyright (c) 2022-2024 CAST.  All rights reserved. *
+# *******************************************************
+
+import json
+import os
+from typing import Dict, List, NoReturn, Optional, Tuple
+
+from src.render_pool import RENDER_FORMATS, get_render_path
+from src.xlsx_writer import RowsCollector
+
+MANIFEST_FILE_NAME = "asmgraph_manifest.json"
+MANIFEST_VERSION = 2
+DOT_SUFFIX = ".dot"
+
+# (inputs digest, singleton rows, checker rows, dot file name or None)
+ManifestEntry = Tuple[str, Optional[RowsCollector], Optional[RowsCollector], Optional[str]]
+
+
+def is_plain_dot_name(name: str) -> bool:
+    # Dot files are only looked up and removed inside the output directory
+    return name == os.path.basename(name) and name.endswith(DOT_SUFFIX) and name != DOT_SUFFIX
+
+
+def dump_entry(asm_name: str, function_name: str, entry: ManifestEntry) -> List:
+    digest, singletons, checkers, dot_file = entry
+    return [asm_name, function_name, digest, singletons.to_data() if singletons else None,
+            checkers.to_data() if checkers else None, dot_file]
+
+
+def load_entry(data: List) -> Tuple[Tuple[str, str], ManifestEntry]:
+    """
+    Returns the key and the entry of the saved data, raises ValueError for the entries that do not fit the manifest.
+    """
+    asm_name, function_name, digest, singletons, checkers, dot_file = data
+    if not isinstance(digest, str) or dot_file is not None and not is_plain_dot_name(dot_file):
+        raise ValueError(f"Wrong entry of {function_name}")
+
+    return (asm_name, function_name), (digest, RowsCollector.from_data(singletons) if singletons else None,
+                                       RowsCollector.from_data(checkers) if checkers else None, dot_file)
+
+
+class RunManifest:
+    """
+    Manifest of the output directory: for every processed function the digest of its inputs
+    (body, profile of its address range) and its results, the rows of the singletons and the checkers
+    and the dot file. Entries of a previous run are reused while the function inputs and the settings
+    of the run (options, plugins configuration, opcode tables) are the same.
+    """
+
+    def __init__(self, out_dir: str, settings_digest: str, load: bool = True):
+        self.out_dir = out_dir
+        self.path = os.path.join(out_dir, MANIFEST_FILE_NAME)
+        self.settings_digest = settings_digest
+        self.previous: Dict[Tuple[str, str], ManifestEntry] = {}
+        self.entries: Dict[Tuple[str, str], ManifestEntry] = {}
+        self.reused = 0
+        self.processed = 0
+
+        if not load:
+            return
+
+        # The manifest is plain data: loading it never runs code and its dot files stay in out_dir
+        try:
+            with open(self.path, "r") as manifest_file:
+                data = json.load(manifest_file)
+            if data["version"] == MANIFEST_VERSION and data["settings"] == settings_digest:
+                self.previous = dict(load_entry(entry) for entry in data["entries"])
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Warning: Ignoring broken manifest {self.path}: {e}")
+
+    def lookup(self, asm_name: str, function_name: str, digest: Optional[str]) -> Optional[ManifestEntry]:
+        entry = self.previous.get((asm_name, function_name))
+        if digest is None or entry is None or entry[0] != digest:
+            return None
+
+        dot_file = entry[3]
+        if dot_file and not os.path.isfile(os.path.join(self.out_dir, dot_file)):
+            return None
+
+        return entry
+
+    def record(self, asm_name: str, function_name: str, entry: Optional[ManifestEntry], reused: bool) -> NoReturn:
+        """
+        Records the results of the function, functions without an entry are processed again by the next run.
+        """
+        if entry is not None:
+            self.entries[(asm_name, function_name)] = entry
+        if reused:
+            self.reused += 1
+        else:
+            self.processed += 1
+
+    def remove_stale_outputs(self) -> NoReturn:
+        """
+        Removes the dot files (and their renders) of the functions of the previous run that are gone.
+        """
+        current_dot_files = {entry[3] for entry in self.entries.values()}
+        for key, entry in self.previous.items():
+            if key not in self.entries and entry[3] and entry[3] not in current_dot_files \
+                    and is_plain_dot_name(entry[3]):
+                dot_file = os.path.join(self.out_dir, entry[3])
+                for path in [dot_file] + [get_render_path(dot_file, output_format) for output_format in RENDER_FORMATS]:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def keep_previous(self) -> NoReturn:
+        """
+        Keeps the entries of the functions that were not processed by this run (e.g. with --func).
+        """
+        for key, entry in self.previous.items():
+            self.entries.setdefault(key, entry)
+
+    def save(self) -> NoReturn:
+        tmp_path = self.path + ".tmp"
+        try:
+            data = {
+                "version": MANIFEST_VERSION,
+                "settings": self.settings_digest,
+                "entries": [dump_entry(asm_name, function_name, entry)
+                            for (asm_name, function_name), entry in self.entries.items()],
+            }
+            with open(tmp_path, "w") as manifest_file:
+                json.dump(data, manifest_file)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Warning: Cannot save manifest {self.path}: {e}")
+
+    def report(self) -> NoReturn:
+        print(f"Manifest: {self.reused} functions reused, {self.processed} functions processed.")
@@ -0,0 +1,145 @@
+# *******************************************************
+# * Copyright (c) 2022-2024 CAST.  All rights reserved. *
+# *******************************************************
+
+import os
+from typing import Dict, List, NoReturn, Tuple
+
+import numpy as np
+
+from src.asm_index import NO_RANGE, FunctionRanges
+from src.file_reader import strip_compression_suffix
+from src.profile_store import ProfileIndex
+
+NO_MODULE = -1
+# Load bases are page aligned, inferred bases that are not are ignored
+PAGE_SIZE = 0x1000
+# Pseudo paths of /proc/<pid>/maps that are not files ([heap], [stack], [vdso], ...)
+ANONYMOUS_MAPPING_PREFIX = "["
+
+
+def get_module_name(path: str) -> str:
+    """
+    Returns the module name of a binary, a library or their disassembly: libc.so.6.asm.gz -> libc.so.6.
+    """
+    name = os.path.basename(strip_compression_suffix(path))
+    return name[:-len(".asm")] if name.endswith(".asm") else name
+
+
+class ModuleMap:
+    """
+    Runtime address ranges of the modules (the binary and its shared libraries) of a profiled process
+    and their load bases. The module of each BB is found with one searchsorted call
+    and its address in the module is the runtime address minus the load base.
+    """
+
+    def __init__(self, modules: List[Tuple[int, int, int, str]]):
+        # (start, end, base, name), the ranges must not overlap
+        modules = sorted(modules)
+        self.starts = np.array([start for start, _, _, _ in modules], dtype=np.uint64)
+        self.ends = np.array([end for _, end, _, _ in modules], dtype=np.uint64)
+        self.bases = np.array([base for _, _, base, _ in modules], dtype=np.uint64)
+        self.names = [name for _, _, _, name in modules]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names
+
+    @classmethod
+    def load(cls, path: str) -> "ModuleMap":
+        """
+        Reads a module map in the /proc/<pid>/maps format:
+            7fb379000000-7fb379022000 r-xp 00000000 08:01 1234 /usr/lib/ld-linux-riscv64-lp64d.so.1
+        or as "name start end [base]" lines of hex numbers (base is start by default).
+        Lines starting with # are ignored.
+        """
+        ranges: Dict[str, List[int]] = {}
+        with open(path, "r") as map_file:
+            for line_num, line in enumerate(map_file, 1):
+                fields = line.split()
+                if not fields or fields[0].startswith("#"):
+                    continue
+
+                try:
+                    if "-" in fields[0]:
+                        if len(fields) < 6 or fields[5].startswith(ANONYMOUS_MAPPING_PREFIX):
+                            continue
+                        start, end = (int(value, 16) for value in fields[0].split("-"))
+                        name = get_module_name(fields[5])
+                        base = start - int(fields[2], 16)
+                    else:
+                        name = fields[0]
+                        start, end = int(fields[1], 16), int(fields[2], 16)
+                        base = int(fields[3], 16) if len(fields) > 3 else start
+                except (ValueError, IndexError):
+                    raise ValueError(f"Wrong module map line {path}:{line_num}: {line.strip()}")
+
+                if name in ranges:
+                    known = ranges[name]
+                    ranges[name] = [min(known[0], start), max(known[1], end), min(known[2], base)]
+                else:
+                    ranges[name] = [start, end, base]
+
+        return cls([(start, end, base, name) for name, (start, end, base) in ranges.items()])
+
+    @classmethod
+    def infer(cls, profile: ProfileIndex, modules_ranges: Dict[str, FunctionRanges]) -> "ModuleMap":
+        """
+        Infers the load bases of the modules from the symbol names of the profile (not rebased):
+        a BB named as a function of the module votes for its runtime address minus the function start,
+        the most voted page aligned base wins. Modules without votes are not mapped.
+        """
+        names = {name: ind for ind, name in enumerate(profile.functions)}
+        modules = []
+        for module_name, ranges in modules_ranges.items():
+            range_ids = np.full(len(names), NO_RANGE, dtype=np.int64)
+            for range_id, function_name in enumerate(ranges.names):
+                if function_name in names:
+                    range_ids[names[function_name]] = range_id
+
+            block_ranges = range_ids[profile.function_ids] if len(names) else np.zeros(0, dtype=np.int64)
+            named = block_ranges != NO_RANGE
+            addresses = profile.addresses[named]
+            starts = ranges.starts[block_ranges[named]]
+            candidates = addresses[addresses >= starts] - starts[addresses >= starts]
+            candidates = candidates[candidates % np.uint64(PAGE_SIZE) == 0]
+            if not len(candidates):
+                print(f"Warning: Cannot infer the load base of {module_name}, its BBs are not mapped.")
+                continue
+
+            values, votes = np.unique(candidates, return_counts=True)
+            base = int(values[np.argmax(votes)])
+            modules.append((base + int(ranges.starts.min()), base + int(ranges.ends.max()), base, module_name))
+
+        return cls(modules)
+
+    def keep_absolute_modules(self, modules_ranges: Dict[str, FunctionRanges]) -> NoReturn:
+        """
+        Non-PIE executables (ET_EXEC) are linked at their runtime addresses: a module whose disassembly
+        functions already lie inside its mapping has absolute addresses, so its load base is 0.
+        """
+        for ind, name in enumerate(self.names):
+            ranges = modules_ranges.get(name)
+            if ranges is None or not len(ranges):
+                continue
+
+            if self.starts[ind] <= ranges.starts.min() and ranges.ends.max() <= self.ends[ind]:
+                self.bases[ind] = 0
+
+    def lookup(self, addresses: np.ndarray) -> np.ndarray:
+        """
+        Returns the index of the module of each runtime address or NO_MODULE.
+        """
+        addresses = np.asarray(addresses, dtype=np.uint64)
+        positions = np.searchsorted(self.starts, addresses, side="right").astype(np.int64) - 1
+        if not len(self.names):
+            return positions
+
+        inside = (positions >= 0) & (addresses < self.ends[np.maximum(positions, 0)])
+        return np.where(inside, positions, NO_MODULE)
+
+    def report(self) -> NoReturn:
+        for start, end, base, name in zip(self.starts.tolist(), self.ends.tolist(), self.bases.tolist(), self.names):
+            print(f"Module {name}: {start:#x}-{end:#x}, load base {base:#x}")
@@ -402,3 +402,54 @@ INSN_GROUP_DICT = {
     'label': 'address',
     'cbo.zero': 'CMO'
 }
+
+# Opcode descriptor table generated from INSN_GROUP_DICT and the category lists above.
+# Each mnemonic gets an integer id and OPCODE_FLAGS[id] holds a bitmask of its properties
+# with the id of its group in the upper bits, so classifying an instruction is an index and a bit test.
+FLAG_BRANCH = 1 << 0
+FLAG_TERNARY_BRANCH = 1 << 1
+FLAG_JUMP = 1 << 2
+FLAG_TERMINATOR = 1 << 3
+FLAG_LOAD = 1 << 4
+FLAG_STORE = 1 << 5
+FLAG_BINARY = 1 << 6
+GROUP_SHIFT = 8
+
+OPCODE_NAMES = list(INSN_GROUP_DICT)
+OPCODE_IDS = {name: opcode_id for opcode_id, name in enumerate(OPCODE_NAMES)}
+
+GROUP_NAMES = list(dict.fromkeys(INSN_GROUP_DICT.values()))
+GROUP_IDS = {name: group_id for group_id, name in enumerate(GROUP_NAMES)}
+
+
+def __build_opcode_flags() -> list:
+    categories = [
+        (branch_instructions, FLAG_BRANCH),
+        (ternary_branch_instructions, FLAG_TERNARY_BRANCH),
+        (jump_instructions, FLAG_JUMP),
+        (terminate, FLAG_TERMINATOR),
+        (loads, FLAG_LOAD),
+        (stores, FLAG_STORE),
+        (binary_instructions, FLAG_BINARY),
+    ]
+
+    flags = [GROUP_IDS[INSN_GROUP_DICT[name]] << GROUP_SHIFT for name in OPCODE_NAMES]
+    for names, flag in categories:
+        for name in names:
+            # Category lists may mention pseudo names that are not real opcodes (e.g. "ra")
+            if name in OPCODE_IDS:
+                flags[OPCODE_IDS[name]] |= flag
+
+    return flags
+
+
+OPCODE_FLAGS = __build_opcode_flags()
+
+
+def get_opcode_flags(name: str) -> int:
+    opcode_id = OPCODE_IDS.get(name)
+    return 0 if opcode_id is None else OPCODE_FLAGS[opcode_id]
+
+
+def get_group_id(flags: int) -> int:
+    return flags >> GROUP_SHIFT
@@ -0,0 +1,336 @@
+# *******************************************************
+# * Copyright (c) 2022-2024 CAST.  All rights reserved. *
+# *******************************************************
+
+import hashlib
+import mmap
+import os
+import struct
+from collections import defaultdict
+from typing import Dict, List, NoReturn, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.asm_index import NO_RANGE, FunctionRanges
+from src.file_reader import StringTable, align
+
+TOTAL_DYN_INST = 'total_dyn_inst_count'
+NO_FUNCTION = "-"
+
+# Binary profile layout, all numbers are little endian:
+#   header  (PROFILE_HEADER)
+#   uint64  addresses[rows]      rebased BB addresses, sorted
+#   uint64  counts[rows]         executed instructions of the BBs
+#   uint32  function_ids[rows]   indices in the string table (padded to 8 bytes)
+#   uint64  function_totals[functions]      executed instructions of the functions
+#   uint64  function_bb_counts[functions]   numbers of BBs of the functions
+#   int64   function_hottest[functions]     rows of the hottest BBs of the functions, -1 for none
+#   uint64  string_offsets[functions + 1]
+#   bytes   utf-8 function names, name i is blob[string_offsets[i]:string_offsets[i + 1]]
+#   uint64  symbol_totals[symbols]   executed instructions per symbol of the block lines (padded to 8 bytes)
+#   uint64  symbol_string_offsets[symbols + 1]
+#   bytes   utf-8 symbols
+# The columns are used in place through the memory map, opening a profile does not depend on its size.
+PROFILE_MAGIC = b"ASMGPROF"
+PROFILE_VERSION = 3
+PROFILE_HEADER = struct.Struct("<8sII13Q")
+# Follows the header since version 3: symbols, symbol_totals offset, symbol strings offset and size
+SYMBOLS_HEADER = struct.Struct("<4Q")
+# Profiles of version 2 have no symbol totals, see ProfileIndex.symbol_totals
+READABLE_PROFILE_VERSIONS = (2, PROFILE_VERSION)
+
+
+def parse_bb_address(address: str) -> int:
+    # "10412:" -> 0x10412, the address 0 is stored as ":" (see bbe_parser.get_bb_address)
+    return int(address.rstrip(":") or "0", 16)
+
+
+def compute_function_aggregates(counts: np.ndarray, function_ids: np.ndarray,
+                                functions: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the executed instructions, the number of BBs and the row of the hottest BB
+    (the first one of the equally hot BBs) of each function.
+    """
+    totals = np.zeros(functions, dtype=np.uint64)
+    np.add.at(totals, function_ids, counts)
+    bb_counts = np.bincount(function_ids, minlength=functions).astype(np.uint64)
+
+    hottest = np.full(functions, -1, dtype=np.int64)
+    if len(counts):
+        rows = np.arange(len(counts), dtype=np.int64)
+        # Sorted by function, then by count and the reversed row, the last row of a function is its hottest BB
+        order = np.lexsort((-rows, counts, function_ids))
+        last = np.append(function_ids[order][1:] != function_ids[order][:-1], True)
+        hottest[function_ids[order][last]] = order[last]
+
+    return totals, bb_counts, hottest
+
+
+class ProfileIndex:
+    """
+    Profile of BBs: rebased BB addresses sorted as uint64 with their execution counts
+    and the ids of their functions in the functions table.
+    The execution counts of many BBs are looked up with one searchsorted call.
+
+    The per function aggregates (see compute_function_aggregates) are computed once
+    when the profile is built and stored with it, their consumers do not go over the BBs.
+    """
+
+    def __init__(self, addresses: np.ndarray, counts: np.ndarray, function_ids: np.ndarray,
+                 functions: Sequence[str], total_dyn_inst_count: int,
+                 aggregates: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None):
+        self.addresses = addresses
+        self.counts = counts
+        self.function_ids = function_ids
+        self.functions = functions
+        self.total_dyn_inst_count = total_dyn_inst_count
+        if aggregates is None:
+            aggregates = compute_function_aggregates(counts, function_ids, len(functions))
+        self.function_totals, self.function_bb_counts, self.function_hottest = aggregates
+        # Size and mtime of the profiled file (see bbe_parser.get_file_profile), 0 when not known
+        self.source_size = 0
+        self.source_mtime_ns = 0
+        # (symbols, executed instructions) of the block lines as they are in the profiled files,
+        # before the BBs are merged by address, see bbe_parser.count_by_symbol. None when not known.
+        self.symbol_totals: Optional[Tuple[Sequence[str], np.ndarray]] = None
+
+    @classmethod
+    def from_content(cls, content: Dict) -> "ProfileIndex":
+        """
+        Builds the index from the {"10412:": {"execution_count": ..., "function": ...}} dictionary
+        of the parsed blocks (the content of the former bbe_info.json).
+        """
+        functions = {}
+        rows = []
+        for address, info in content.items():
+            if address == TOTAL_DYN_INST:
+                continue
+
+            function_id = functions.setdefault(info.get("function", NO_FUNCTION), len(functions))
+            rows.append((parse_bb_address(address), info.get("execution_count", 0), function_id))
+
+        rows.sort()
+        addresses = np.array([row[0] for row in rows], dtype=np.uint64)
+        counts = np.array([row[1] for row in rows], dtype=np.uint64)
+        function_ids = np.array([row[2] for row in rows], dtype=np.uint32)
+
+        return cls(addresses, counts, function_ids, list(functions), content.get(TOTAL_DYN_INST, 0))
+
+    def lookup(self, addresses: List[str]) -> Dict[str, int]:
+        queries = []
+        for address in addresses:
+            try:
+                queries.append(parse_bb_address(address))
+            except (ValueError, AttributeError):
+                queries.append(None)
+
+        known = [query is not None for query in queries]
+        values = np.array([query for query in queries if query is not None], dtype=np.uint64)
+        if not len(values) or not len(self.addresses):
+            return {}
+
+        positions = np.searchsorted(self.addresses, values)
+        positions_clipped = np.minimum(positions, len(self.addresses) - 1)
+        found = (positions < len(self.addresses)) & (self.addresses[positions_clipped] == values)
+        counts = self.counts[positions_clipped].tolist()
+
+        usage_info = {}
+        query_ind = 0
+        for address, is_known in zip(addresses, known):
+            if is_known:
+                if found[query_ind]:
+                    usage_info[address] = counts[query_ind]
+                query_ind += 1
+
+        return usage_info
+
+    def attribute_functions(self, ranges: FunctionRanges) -> "ProfileIndex":
+        """
+        Returns the profile where the BBs inside the address ranges of the disassembly functions
+        belong to those functions, the other BBs keep the function given by QEMU.
+        The functions table keeps the order of this one, new functions are added at its end.
+        """
+        range_ids = ranges.attribute(self.addresses)
+        names = {name: ind for ind, name in enumerate(self.functions)}
+        range_function_ids = np.array([names.setdefault(name, len(names)) for name in ranges.names] or [0],
+                                      dtype=np.uint32)
+        function_ids = np.where(range_ids != NO_RANGE, range_function_ids[np.maximum(range_ids, 0)],
+                                self.function_ids).astype(np.uint32)
+
+        # Functions without BBs left are dropped
+        used_ids = np.unique(function_ids)
+        new_ids = np.zeros(len(names), dtype=np.uint32)
+        new_ids[used_ids] = np.arange(len(used_ids), dtype=np.uint32)
+        names_list = list(names)
+
+        profile = ProfileIndex(self.addresses, self.counts, new_ids[function_ids],
+                               [names_list[ind] for ind in used_ids.tolist()], self.total_dyn_inst_count)
+        profile.source_size = self.source_size
+        profile.source_mtime_ns = self.source_mtime_ns
+        profile.symbol_totals = self.symbol_totals
+        return profile
+
+    def get_range_digest(self, start: int, end: int) -> str:
+        """
+        Returns the digest of the BBs (addresses and counts) in the address range [start, end).
+        """
+        first, last = np.searchsorted(self.addresses, np.array([start, end], dtype=np.uint64)).tolist()
+        digest = hashlib.sha1(self.addresses[first:last].astype("<u8").tobytes())
+        digest.update(self.counts[first:last].astype("<u8").tobytes())
+        return digest.hexdigest()
+
+    def get_counts_by_function(self) -> Dict[str, int]:
+        """
+        Returns the executed instructions per function (including NO_FUNCTION)
+        in the order of the functions table.
+        """
+        return dict(zip(self.functions, self.function_totals.tolist()))
+
+    def get_counts_by_symbol(self) -> Optional[Dict[str, int]]:
+        """
+        Returns the executed instructions per symbol of the block lines (without NO_FUNCTION),
+        None for the profiles stored without them.
+        """
+        if self.symbol_totals is None:
+            return None
+
+        symbols, totals = self.symbol_totals
+        return dict(zip(symbols, totals.tolist()))
+
+    def get_function_stats(self) -> Dict[str, Tuple[int, int, Optional[int]]]:
+        """
+        Returns (executed instructions, number of BBs, address of the hottest BB) of each function
+        (including NO_FUNCTION) in the order of the functions table.
+        """
+        hottest_rows = self.function_hottest.tolist()
+        hottest_addresses = self.addresses[np.maximum(self.function_hottest, 0)].tolist() if len(self.addresses) \
+            else [0] * len(hottest_rows)
+
+        return {function: (total, bb_count, address if row >= 0 else None)
+                for function, total, bb_count, row, address in
+                zip(self.functions, self.function_totals.tolist(), self.function_bb_counts.tolist(),
+                    hottest_rows, hottest_addresses)}
+
+    def get_total_exec_by_func(self) -> Dict[str, int]:
+        total_exec_by_func = defaultdict(int)
+        total_exec_by_func[TOTAL_DYN_INST] = self.total_dyn_inst_count
+        for function, count in self.get_counts_by_function().items():
+            if function != NO_FUNCTION:
+                total_exec_by_func[function] += count
+
+        return total_exec_by_func
+
+
+class MappedProfile(ProfileIndex):
+    """
+    ProfileIndex whose columns are views of the memory-mapped profile file.
+    It is pickled as its path, so worker processes map the file themselves.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as profile_file:
+            try:
+                self.__data = mmap.mmap(profile_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError(f"Empty profile file {path}")
+
+        if len(self.__data) < PROFILE_HEADER.size:
+            raise ValueError(f"Truncated profile file {path}")
+
+        (magic, version, _, rows, functions, total_dyn_inst_count, source_size, source_mtime_ns,
+         addresses_offset, counts_offset, function_ids_offset, totals_offset, bb_counts_offset, hottest_offset,
+         strings_offset, strings_size) = PROFILE_HEADER.unpack_from(self.__data)
+
+        if magic != PROFILE_MAGIC or version not in READABLE_PROFILE_VERSIONS:
+            raise ValueError(f"Unsupported profile file {path}")
+
+        symbols = None
+        if version >= 3:
+            if len(self.__data) < PROFILE_HEADER.size + SYMBOLS_HEADER.size:
+                raise ValueError(f"Truncated profile file {path}")
+            symbols, symbol_totals_offset, symbol_strings_offset, symbol_strings_size = \
+                SYMBOLS_HEADER.unpack_from(self.__data, PROFILE_HEADER.size)
+            if symbol_strings_offset + 8 * (symbols + 1) + symbol_strings_size > len(self.__data):
+                raise ValueError(f"Truncated profile file {path}")
+
+        if strings_offset + 8 * (functions + 1) + strings_size > len(self.__data):
+            raise ValueError(f"Truncated profile file {path}")
+
+        addresses = np.frombuffer(self.__data, dtype="<u8", count=rows, offset=addresses_offset)
+        counts = np.frombuffer(self.__data, dtype="<u8", count=rows, offset=counts_offset)
+        function_ids = np.frombuffer(self.__data, dtype="<u4", count=rows, offset=function_ids_offset)
+        aggregates = (np.frombuffer(self.__data, dtype="<u8", count=functions, offset=totals_offset),
+                      np.frombuffer(self.__data, dtype="<u8", count=functions, offset=bb_counts_offset),
+                      np.frombuffer(self.__data, dtype="<i8", count=functions, offset=hottest_offset))
+        string_offsets = np.frombuffer(self.__data, dtype="<u8", count=functions + 1, offset=strings_offset)
+        blob_offset = strings_offset + 8 * (functions + 1)
+        blob = memoryview(self.__data)[blob_offset:blob_offset + strings_size]
+
+        super().__init__(addresses, counts, function_ids, StringTable(string_offsets, blob), total_dyn_inst_count,
+                         aggregates)
+        self.source_size = source_size
+        self.source_mtime_ns = source_mtime_ns
+
+        if symbols is not None:
+            symbol_string_offsets = np.frombuffer(self.__data, dtype="<u8", count=symbols + 1,
+                                                  offset=symbol_strings_offset)
+            symbol_blob_offset = symbol_strings_offset + 8 * (symbols + 1)
+            symbol_blob = memoryview(self.__data)[symbol_blob_offset:symbol_blob_offset + symbol_strings_size]
+            self.symbol_totals = (StringTable(symbol_string_offsets, symbol_blob),
+                                  np.frombuffer(self.__data, dtype="<u8", count=symbols, offset=symbol_totals_offset))
+
+    def __reduce__(self):
+        return MappedProfile, (self.path,)
+
+
+def write_profile(path: str, profile: ProfileIndex) -> NoReturn:
+    rows = len(profile.addresses)
+    names = [name.encode() for name in profile.functions]
+    string_offsets = np.cumsum([0] + [len(name) for name in names], dtype=np.uint64)
+
+    addresses_offset = align(PROFILE_HEADER.size + SYMBOLS_HEADER.size)
+    counts_offset = addresses_offset + 8 * rows
+    function_ids_offset = counts_offset + 8 * rows
+    totals_offset = align(function_ids_offset + 4 * rows)
+    bb_counts_offset = totals_offset + 8 * len(names)
+    hottest_offset = bb_counts_offset + 8 * len(names)
+    strings_offset = hottest_offset + 8 * len(names)
+    strings_size = int(string_offsets[-1])
+
+    symbols, symbol_totals = profile.symbol_totals or ([], np.zeros(0, dtype=np.uint64))
+    symbol_names = [symbol.encode() for symbol in symbols]
+    symbol_string_offsets = np.cumsum([0] + [len(symbol) for symbol in symbol_names], dtype=np.uint64)
+    symbol_totals_offset = align(strings_offset + 8 * (len(names) + 1) + strings_size)
+    symbol_strings_offset = symbol_totals_offset + 8 * len(symbol_names)
+
+    header = PROFILE_HEADER.pack(PROFILE_MAGIC, PROFILE_VERSION, 0, rows, len(names),
+                                 profile.total_dyn_inst_count, profile.source_size, profile.source_mtime_ns,
+                                 addresses_offset, counts_offset, function_ids_offset,
+                                 totals_offset, bb_counts_offset, hottest_offset,
+                                 strings_offset, strings_size)
+    header += SYMBOLS_HEADER.pack(len(symbol_names), symbol_totals_offset, symbol_strings_offset,
+                                  int(symbol_string_offsets[-1]))
+
+    # Written next to the target and renamed, readers never see a partial profile
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as profile_file:
+        profile_file.write(header.ljust(addresses_offset, b"\0"))
+        profile_file.write(np.ascontiguousarray(profile.addresses, dtype="<u8").tobytes())
+        profile_file.write(np.ascontiguousarray(profile.counts, dtype="<u8").tobytes())
+        profile_file.write(np.ascontiguousarray(profile.function_ids, dtype="<u4").tobytes())
+        profile_file.write(b"\0" * (totals_offset - function_ids_offset - 4 * rows))
+        profile_file.write(np.ascontiguousarray(profile.function_totals, dtype="<u8").tobytes())
+        profile_file.write(np.ascontiguousarray(profile.function_bb_counts, dtype="<u8").tobytes())
+        profile_file.write(np.ascontiguousarray(profile.function_hottest, dtype="<i8").tobytes())
+        profile_file.write(string_offsets.astype("<u8").tobytes())
+        profile_file.write(b"".join(names))
+        profile_file.write(b"\0" * (symbol_totals_offset - strings_offset - 8 * (len(names) + 1) - strings_size))
+        profile_file.write(np.ascontiguousarray(symbol_totals, dtype="<u8").tobytes())
+        profile_file.write(symbol_string_offsets.astype("<u8").tobytes())
+        profile_file.write(b"".join(symbol_names))
+    os.replace(tmp_path, path)
+
+
+def open_profile(path: str) -> MappedProfile:
+    return MappedProfile(path)
@@ -0,0 +1,46 @@
+# *******************************************************
+# * Copyright (c) 2022-2024 CAST.  All rights reserved. *
+# *******************************************************
+
+from typing import Dict, List
+
+# Register names are mapped to small integer ids, so operands can be compared and stored as numbers.
+# ABI names and their xN/fN aliases intentionally get different ids: the analyses compare
+# operands by name and "s0" must stay different from "fp" as it is in the text.
+NO_REGISTER = -1
+
+REGISTER_NAMES: List[str] = \
+    ["zero", "ra", "sp", "gp", "tp", "fp"] + \
+    [f"t{i}" for i in range(7)] + \
+    [f"s{i}" for i in range(12)] + \
+    [f"a{i}" for i in range(8)] + \
+    [f"ft{i}" for i in range(12)] + \
+    [f"fs{i}" for i in range(12)] + \
+    [f"fa{i}" for i in range(8)] + \
+    [f"x{i}" for i in range(32)] + \
+    [f"f{i}" for i in range(32)]
+
+REGISTER_IDS: Dict[str, int] = {name: reg_id for reg_id, name in enumerate(REGISTER_NAMES)}
+
+
+def get_register_id(name: str) -> int:
+    """
+    Returns the id of the register, names that are not known yet (CSRs, vector registers)
+    get the next free id. Ids of the names above are the same in every process.
+    """
+    reg_id = REGISTER_IDS.get(name)
+    if reg_id is None:
+        reg_id = len(REGISTER_NAMES)
+        REGISTER_NAMES.append(name)
+        REGISTER_IDS[name] = reg_id
+
+    return reg_id
+
+
+def get_base_register(operand: str) -> str:
+    """
+    Returns the register of the memory operand (8(a0) -> a0), other operands are returned as is.
+    """
+    if "(" not in operand:
+        return operand
+    return operand[operand.index('(') + 1: operand.index(')')]
@@ -0,0 +1,107 @@
+# *******************************************************
+# * Copyright (c) 2022-2024 CAST.  All rights reserved. *
+# *******************************************************
+
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, NoReturn, Optional, Tuple
+
+from src.render_supervisor import RenderStatus, RenderSupervisor
+
+RENDER_FORMATS = ["svg", "xdot", "png"]
+RENDER_REPORT_FILE_NAME = "render_times.txt"
+# Graphs laid out by the analysis (see FlowGraph.draw_graph) keep the positions of their nodes,
+# neato -n2 draws them at these positions instead of laying them out again
+POSITIONED_PROGRAM = ("neato", ["-n2"])
+LAYOUT_PROGRAM = ("dot", [])
+POSITION_ATTRIBUTE = re.compile(rb'[\s,\[]pos="')
+POSITION_CHECK_SIZE = 64 * 1024
+
+# (output file, status, seconds, message), the status is None for the outputs that are up to date
+RenderReport = Tuple[str, Optional[RenderStatus], float, str]
+
+
+def get_render_path(dot_path: str, output_format: str) -> str:
+    return os.path.splitext(dot_path)[0] + "." + output_format
+
+
+def is_up_to_date(dot_path: str, out_path: str) -> bool:
+    try:
+        return os.path.getmtime(out_path) >= os.path.getmtime(dot_path)
+    except OSError:
+        return False
+
+
+def has_positions(dot_path: str) -> bool:
+    with open(dot_path, "rb") as dot_file:
+        return POSITION_ATTRIBUTE.search(dot_file.read(POSITION_CHECK_SIZE)) is not None
+
+
+def get_render_command(dot_path: str, output_format: str) -> Tuple[str, List[str]]:
+    program, args = POSITIONED_PROGRAM if has_positions(dot_path) else LAYOUT_PROGRAM
+    return program, args + [f"-T{output_format}"]
+
+
+def render_dot_file(dot_path: str, output_format: str, supervisor: RenderSupervisor) -> RenderReport:
+    out_path = get_render_path(dot_path, output_format)
+    if is_up_to_date(dot_path, out_path):
+        return out_path, None, 0.0, ""
+
+    program, args = get_render_command(dot_path, output_format)
+    # Outputs are renamed when complete, so interrupted renders are not taken as up to date
+    tmp_path = out_path + ".tmp"
+    start = time.monotonic()
+    status, message = supervisor.run_graphviz(program, args, dot_path, tmp_path)
+    seconds = time.monotonic() - start
+
+    if status == RenderStatus.OK:
+        os.replace(tmp_path, out_path)
+    elif os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    return out_path, status, seconds, message
+
+
+def render_dot_files(dot_files: Iterable[str], output_format: str, supervisor: RenderSupervisor,
+                     jobs: int = 0) -> Iterator[RenderReport]:
+    """
+    Renders the dot files with a pool of graphviz processes, one per CPU core by default.
+    The threads of the pool only wait for their processes. The number of files in flight
+    is bounded, the reports are yielded in the order of the files.
+    """
+    jobs = jobs or os.cpu_count()
+    max_pending = jobs * 4
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for dot_path in dot_files:
+            pending.append(executor.submit(render_dot_file, dot_path, output_format, supervisor))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def save_render_report(path: str, reports: List[RenderReport]) -> NoReturn:
+    with open(path, "w") as report_file:
+        for out_path, status, seconds, message in reports:
+            status = status.value if status else "up to date"
+            report_file.write(f"{os.path.basename(out_path)}\t{status}\t{seconds:.3f}\t{message}\n")
+
+
+def print_render_summary(reports: List[RenderReport], slowest: int = 10) -> NoReturn:
+    rendered = [report for report in reports if report[1] == RenderStatus.OK]
+    failed = [report for report in reports if report[1] not in (None, RenderStatus.OK)]
+    total = sum(seconds for _, _, seconds, _ in reports)
+
+    print(f"Render: {len(rendered)} files rendered in {total:.1f}s of graphviz time, "
+          f"{len(reports) - len(rendered) - len(failed)} up to date, {len(failed)} failed.")
+    for out_path, status, seconds, message in failed:
+        print(f"Warning: Cannot render {os.path.basename(out_path)}: {status.value} in {seconds:.1f}s. {message}")
+
+    for out_path, _, seconds, _ in sorted(rendered, key=lambda report: -report[2])[:slowest]:
+        print(f"    {os.path.basename(out_path)}: {seconds:.2f}s")
@@ -0,0 +1,155 @@
+# *******************************************************
+# * Copyright (c) 2022-2024 CAST.  All rights reserved. *
+# *******************************************************
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from enum import Enum
+from typing import Callable, List, NoReturn, Optional, Tuple
+
+from src.dot_writer import DOT_PROGRAM, DotWriter
+
+DEFAULT_RENDER_TIMEOUT = 600
+# Layout strategies from the most to the least expensive: (name, graphviz arguments),
+# the last one stores the graph without the layout (viewers lay it out themselves)
+FULL_LAYOUT = "layout"
+NO_LAYOUT = "no_layout"
+RENDER_STRATEGIES = [
+    (FULL_LAYOUT, []),
+    ("fast_layout", ["-Gsplines=line", "-Gnslimit=2", "-Gnslimit1=2", "-Gmclimit=0.5", "-Gsearchsize=10"]),
+    (NO_LAYOUT, None),
+]
+# Messages of graphviz (and of the C library) when an allocation fails
+MEMORY_ERRORS = ("out of memory", "memory allocation", "cannot allocate", "bad_alloc")
+# Exit code of the shell when the program to run is not found
+COMMAND_NOT_FOUND = 127
+
+
+def check_programs(programs: List[str]) -> NoReturn:
+    """
+    Raises FileNotFoundError when one of the graphviz programs is not installed.
+    A missing program is a configuration error: every graph would fail the same way.
+    """
+    for program in programs:
+        if shutil.which(program) is None:
+            raise FileNotFoundError(f'Cannot find graphviz program "{program}", is graphviz installed?')
+
+
+class RenderStatus(str, Enum):
+    OK = "ok"
+    TIMED_OUT = "timed out"
+    OVER_MEMORY = "over memory"
+    FAILED = "failed"
+
+
+class RenderResult:
+    def __init__(self, attempts: List[Tuple[str, RenderStatus, float]], message: str = ""):
+        # (strategy, status, seconds) of each attempt in order
+        self.attempts = attempts
+        self.message = message
+
+    @property
+    def status(self) -> RenderStatus:
+        return self.attempts[-1][1] if self.attempts else RenderStatus.FAILED
+
+    @property
+    def strategy(self) -> Optional[str]:
+        return self.attempts[-1][0] if self.attempts else None
+
+    def is_ok(self) -> bool:
+        return self.status == RenderStatus.OK
+
+    def is_degraded(self) -> bool:
+        return self.is_ok() and self.strategy != FULL_LAYOUT
+
+    def __str__(self) -> str:
+        attempts = ", ".join(f"{strategy}: {status.value} in {seconds:.1f}s"
+                             for strategy, status, seconds in self.attempts)
+        return f"{attempts}. {self.message}" if self.message else attempts
+
+
+class RenderSupervisor:
+    """
+    Lays out DOT graphs with graphviz in a separate process with per graph time and memory budgets.
+    The process is killed when it runs out of its budget and the graph is laid out again with
+    the next cheaper strategy of RENDER_STRATEGIES, each attempt has the whole budget.
+    No signals are used, so graphs may be rendered from any thread.
+    """
+
+    def __init__(self, time_limit: int = DEFAULT_RENDER_TIMEOUT, memory_limit_mb: int = 0,
+                 strategies: List[Tuple[str, Optional[List[str]]]] = None, program: str = DOT_PROGRAM):
+        self.time_limit = time_limit or None
+        self.memory_limit_mb = memory_limit_mb
+        self.strategies = strategies or RENDER_STRATEGIES
+        self.program = program
+
+    def render(self, out_path: str, write_graph: Callable[[DotWriter], NoReturn]) -> RenderResult:
+        """
+        Writes the graph with write_graph(DotWriter) into a temporary file next to out_path
+        and lays it out into out_path.
+        """
+        fd, raw_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(out_path)), suffix=".gv")
+        os.close(fd)
+        attempts = []
+        messages = []
+        try:
+            with DotWriter(raw_path) as writer:
+                write_graph(writer)
+
+            for strategy, layout_args in self.strategies:
+                start = time.monotonic()
+                if layout_args is None:
+                    shutil.copyfile(raw_path, out_path)
+                    status, message = RenderStatus.OK, ""
+                else:
+                    status, message = self.run_layout(raw_path, out_path, layout_args)
+                attempts.append((strategy, status, time.monotonic() - start))
+                if message:
+                    messages.append(message)
+                if status == RenderStatus.OK:
+                    break
+        finally:
+            os.remove(raw_path)
+
+        return RenderResult(attempts, " ".join(messages))
+
+    def run_layout(self, raw_path: str, out_path: str, layout_args: List[str]) -> Tuple[RenderStatus, str]:
+        return self.run_graphviz(self.program, ["-Tdot"] + layout_args, raw_path, out_path)
+
+    def run_graphviz(self, program: str, args: List[str], in_path: str, out_path: str) -> Tuple[RenderStatus, str]:
+        """
+        Runs a graphviz program on in_path within the budgets and writes its output into out_path.
+        Raises FileNotFoundError when the program is not installed (see check_programs).
+        """
+        command = [program] + args + [in_path]
+        if self.memory_limit_mb:
+            # The limit is set by the shell that is replaced by graphviz, it does not touch this process
+            command = ["sh", "-c", 'ulimit -v "$0" && exec "$@"', str(self.memory_limit_mb * 1024)] + command
+
+        try:
+            with open(out_path, "wb") as out_file:
+                process = subprocess.run(command, stdout=out_file, stderr=subprocess.PIPE,
+                                         cwd=os.path.dirname(os.path.abspath(in_path)), timeout=self.time_limit)
+        except subprocess.TimeoutExpired:
+            return RenderStatus.TIMED_OUT, f"{program} takes more than {self.time_limit}s."
+        except FileNotFoundError:
+            check_programs([program])
+            raise
+        except OSError as e:
+            return RenderStatus.FAILED, str(e)
+
+        if process.returncode == 0:
+            return RenderStatus.OK, ""
+
+        if self.memory_limit_mb and process.returncode == COMMAND_NOT_FOUND:
+            check_programs([program])
+
+        errors = process.stderr.decode(errors="replace").strip()
+        out_of_memory = process.returncode < 0 or any(error in errors.lower() for error in MEMORY_ERRORS)
+        if self.memory_limit_mb and out_of_memory:
+            return RenderStatus.OVER_MEMORY, f"{program} needs more than {self.memory_limit_mb}MB."
+
+        return RenderStatus.FAILED, f'"{program}" returned code {process.returncode}: {errors}'
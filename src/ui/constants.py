@@ -25,6 +25,7 @@ PANE_SEPERATOR_POS: int = 300
 
 DUMMY_BASE_URL: str = "file://"
 SEARCH_PLACEHOLDER_TEXT: str = "Search..."
+SEARCH_TOOLTIP_TEXT: str = "Part of the name, ~name for a fuzzy search or /pattern for a regular expression"
 
 UI_DIR: str = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR: str = os.path.dirname(os.path.dirname(UI_DIR))
@@ -3,10 +3,11 @@
 # *******************************************************
 
 import os.path
+import re
 import uuid
 from cProfile import label
 from glob import glob
-from typing import List, Optional
+from typing import List, Optional, Set, Tuple
 import threading
 import xdot
 
@@ -18,6 +19,8 @@ from src.ui.plugins_manager import PluginsManager
 from src.ui.error_handler import ErrorWindow
 from src.ui.action_boxes import FileSelectorBox, CheckBox
 from src.ui.command_builder import CommandBuilder
+from src.ui.layout_cache import LayoutCache, PREFETCH_DISTANCE
+from src.ui.name_index import NameIndex, parse_query, scan_names
 from src.bbe_parser import BBEFileParser, TOTAL_DYN_INST
 from gi.repository import GObject, Gtk, GLib
 
@@ -33,7 +36,28 @@ def human_readable_number(number: int) -> str:
 
     return f"{number:.2e}"
 
+
+def get_function_name(dot_file: str) -> str:
+    return os.path.basename(dot_file)[:-4]
+
+
+def get_function_tooltip(stats: Optional[Tuple[int, int, Optional[int]]]) -> Optional[str]:
+    """
+    Returns the number of executed BBs and the address of the hottest one for the functions list.
+    """
+    if stats is None:
+        return None
+
+    _, bb_count, hottest = stats
+    if hottest is None:
+        return f"{bb_count} executed BBs"
+    return f"{bb_count} executed BBs, the hottest at {hottest:x}"
+
+
 class DotButtons(Gtk.Box):
+    # Columns of the functions model, the name rank orders the names as sorted() does
+    COLUMN_NAME, COLUMN_PATH, COLUMN_VISIBLE, COLUMN_NAME_RANK, COLUMN_EXEC, COLUMN_TOOLTIP = range(6)
+
     __gsignals__ = {
         Events.DEACTIVATE_COMPARISON: (GObject.SignalFlags.RUN_FIRST, None, ()),
         Events.VISUALIZE_DOT: (GObject.SignalFlags.RUN_FIRST, None, (str,)),
@@ -48,9 +72,19 @@ class DotButtons(Gtk.Box):
         self.project_type = project_type
         self.dot_files = []
         self.execution_info = None
+        self.function_stats = {}
         self.execution_info_collected = False
         self.sort_by_name_ascending = True
         self.sort_by_exec_ascending = True
+        self.search_text = ""
+        # ListStore of the functions, filtered by the search text and sorted for the view
+        self.functions_store: Optional[Gtk.ListStore] = None
+        self.functions_filter: Optional[Gtk.TreeModelFilter] = None
+        self.functions_sort: Optional[Gtk.TreeModelSort] = None
+        self.selected_dot_file = ""
+        # Index of the function names built in the background, positions of the functions matching the search
+        self.name_index: Optional[NameIndex] = None
+        self.visible_functions: Optional[Set[int]] = None
 
         sort_order = Gtk.Box(spacing=20)
         sort_images = Gtk.Image.new_from_icon_name("view-sort-ascending", Gtk.IconSize.BUTTON)
@@ -71,17 +105,30 @@ class DotButtons(Gtk.Box):
 
         search_entry = Gtk.Entry(placeholder_text=SEARCH_PLACEHOLDER_TEXT)
         search_entry.set_size_request(200, -1)
+        search_entry.set_tooltip_text(SEARCH_TOOLTIP_TEXT)
         search_entry.connect(Events.CHANGED, self.search_function)
-        self.dot_files_box = Gtk.VBox()
-        inner_box = Gtk.VBox()
-        inner_box.pack_start(search_entry, False, True, 0)
-        inner_box.pack_start(sort_order, False, True, 0)
-        inner_box.pack_start(self.dot_files_box, False, True, 0)
 
-        dots_scrolled_window = Gtk.ScrolledWindow(hscrollbar_policy=Gtk.PolicyType.AUTOMATIC,
-                                                   vscrollbar_policy=Gtk.PolicyType.AUTOMATIC)
-        dots_scrolled_window.add(inner_box)
-        dots_scrolled_window.set_size_request(200, -1)
+        # Rows have the same height, so the view lays out and renders only the visible ones
+        self.functions_view = Gtk.TreeView(headers_visible=False, enable_search=False, fixed_height_mode=True)
+        self.functions_view.get_style_context().add_class(CSSClasses.FUNCTIONS_VIEW)
+        renderer = Gtk.CellRendererText()
+        column = Gtk.TreeViewColumn("Function", renderer)
+        column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        column.set_expand(True)
+        column.set_cell_data_func(renderer, self.render_function_label)
+        self.functions_view.append_column(column)
+        self.functions_view.set_tooltip_column(self.COLUMN_TOOLTIP)
+        self.functions_view.get_selection().connect(Events.CHANGED, self.function_selected)
+
+        functions_scrolled_window = Gtk.ScrolledWindow(hscrollbar_policy=Gtk.PolicyType.AUTOMATIC,
+                                                       vscrollbar_policy=Gtk.PolicyType.AUTOMATIC)
+        functions_scrolled_window.add(self.functions_view)
+
+        dots_box = Gtk.VBox()
+        dots_box.pack_start(search_entry, False, True, 0)
+        dots_box.pack_start(sort_order, False, True, 0)
+        dots_box.pack_start(functions_scrolled_window, True, True, 0)
+        dots_box.set_size_request(200, -1)
 
         self.bin_files_box = Gtk.VBox()
         bins_scrolled_window = Gtk.ScrolledWindow(hscrollbar_policy=Gtk.PolicyType.AUTOMATIC,
@@ -98,16 +145,15 @@ class DotButtons(Gtk.Box):
             pane = Gtk.Paned(orientation=Gtk.Orientation.HORIZONTAL)
             if orientation == DotFileVisualizerOrientations.LEFT:
                 pane.pack1(bins_scrolled_window, resize=True, shrink=False)
-                pane.pack2(dots_scrolled_window, resize=True, shrink=False)
+                pane.pack2(dots_box, resize=True, shrink=False)
             else:
                 pane.pack2(bins_scrolled_window, resize=True, shrink=False)
-                pane.pack1(dots_scrolled_window, resize=True, shrink=False)
+                pane.pack1(dots_box, resize=True, shrink=False)
             self.pack_start(pane, True, True, 0)
         else:
-            self.pack_start(dots_scrolled_window, True, True, 0)
+            self.pack_start(dots_box, True, True, 0)
 
         self.selected_bench_path = ""
-        self.selected_function_button = None
         self.total_dyn_inst_count = 0
 
     def load_data(self, project_dir_pattern: str) -> None:
@@ -124,12 +170,15 @@ class DotButtons(Gtk.Box):
         if len(self.dot_files) == 0:
             ErrorWindow("No dot files found.")
 
-        self.populate_dot_files_box()
-        children = self.dot_files_box.get_children()
+        self.name_index = None
+        threading.Thread(target=self.build_name_index, args=(self.dot_files,), daemon=True).start()
 
-        if len(children) > 0:
-            first = children[0]
-            first.emit(Events.CLICKED)
+        self.selected_dot_file = ""
+        self.visible_functions = None
+        self.populate_dot_files_box()
+        self.update_visible_functions()
+        if self.dot_files:
+            self.select_dot_file(self.dot_files[0])
 
         self.name_button.emit(Events.CLICKED)
 
@@ -147,45 +196,72 @@ class DotButtons(Gtk.Box):
         self.bin_files_box.show_all()
 
     def populate_dot_files_box(self) -> None:
+        """
+        Builds the functions model, sorting and filtering change the models over it, not the rows.
+        """
         if len(self.dot_files) == 0:
+            self.functions_store = self.functions_filter = None
+            self.functions_view.set_model(None)
             return
 
-        # Clean up the dot files before sorting
-        for widget in self.dot_files_box.get_children():
-            self.dot_files_box.remove(widget)
-
-        for dot_file in self.dot_files:
-            # Extract func name from dot file path
-            label_text = os.path.basename(dot_file)[:-4]
-
-            if self.execution_info_collected:
-                label_text += f" ({human_readable_number(self.execution_info.get(label_text, 0))})"
-
-            button_label = Gtk.Label(label=label_text, halign=Gtk.Align.START)
-            button = Gtk.Button()
-            button.add(button_label)
+        names = [get_function_name(dot_file) for dot_file in self.dot_files]
+        name_ranks = [0] * len(self.dot_files)
+        for rank, ind in enumerate(sorted(range(len(self.dot_files)), key=self.dot_files.__getitem__)):
+            name_ranks[ind] = rank
+
+        store = Gtk.ListStore(str, str, bool, GObject.TYPE_INT64, GObject.TYPE_UINT64, str)
+        for ind, (dot_file, name, name_rank) in enumerate(zip(self.dot_files, names, name_ranks)):
+            execution_count = self.execution_info.get(name, 0) if self.execution_info_collected else 0
+            visible = self.visible_functions is None or ind in self.visible_functions
+            tooltip = get_function_tooltip(self.function_stats.get(name))
+            store.append([name, dot_file, visible, name_rank, execution_count, tooltip])
+
+        sort_column = self.functions_sort.get_sort_column_id() if self.functions_sort else (None, None)
+        self.functions_store = store
+        self.functions_filter = store.filter_new()
+        self.functions_filter.set_visible_column(self.COLUMN_VISIBLE)
+        self.functions_sort = Gtk.TreeModelSort(model=self.functions_filter)
+        if sort_column[0] is not None:
+            self.functions_sort.set_sort_column_id(*sort_column)
+
+        self.functions_view.set_model(self.functions_sort)
+        if self.selected_dot_file:
+            self.select_dot_file(self.selected_dot_file)
+
+    def render_function_label(self, column: Gtk.TreeViewColumn, cell: Gtk.CellRendererText,
+                              model: Gtk.TreeModel, tree_iter: Gtk.TreeIter, data=None) -> None:
+        # Called only for the rows being drawn
+        label_text = model.get_value(tree_iter, self.COLUMN_NAME)
+        if self.execution_info_collected:
+            label_text += f" ({human_readable_number(model.get_value(tree_iter, self.COLUMN_EXEC))})"
+        cell.set_property("text", label_text)
+
+    def select_dot_file(self, dot_file: str) -> None:
+        try:
+            store_iter = self.functions_store.iter_nth_child(None, self.dot_files.index(dot_file))
+        except ValueError:
+            return
 
-            if self.selected_function_button and label_text == self.selected_function_button.get_child().get_text():
-                button.get_style_context().add_class(CSSClasses.SELECTED_BUTTON)
-                self.selected_function_button = button
-            else:
-                button.get_style_context().add_class(CSSClasses.FUNCTION_NAME)
+        found, filter_iter = self.functions_filter.convert_child_iter_to_iter(store_iter)
+        if not found:
+            return
 
-            button.connect(Events.CLICKED, self.dot_button_clicked, dot_file)
-            self.dot_files_box.pack_start(button, False, True, 0)
+        found, sort_iter = self.functions_sort.convert_child_iter_to_iter(filter_iter)
+        if found:
+            self.functions_view.get_selection().select_iter(sort_iter)
+            self.functions_view.scroll_to_cell(self.functions_sort.get_path(sort_iter), None, False, 0, 0)
 
-        self.dot_files_box.show_all()
+    def function_selected(self, selection: Gtk.TreeSelection) -> None:
+        model, tree_iter = selection.get_selected()
+        if tree_iter is None:
+            return
 
-    def dot_button_clicked(self, button: Gtk.Button, dot_file: str) -> None:
-        if self.selected_function_button:
-            self.selected_function_button.get_style_context().remove_class(CSSClasses.SELECTED_BUTTON)
-            self.selected_function_button.get_style_context().add_class(CSSClasses.FUNCTION_NAME)
-            self.selected_function_button.queue_draw()
+        dot_file = model.get_value(tree_iter, self.COLUMN_PATH)
+        if dot_file == self.selected_dot_file:
+            return
 
-        button.get_style_context().add_class(CSSClasses.SELECTED_BUTTON)
-        self.selected_function_button = button
-        self.selected_function_button.queue_draw()
-        selected_function_name = os.path.basename(dot_file)[:-4]
+        self.selected_dot_file = dot_file
+        selected_function_name = model.get_value(tree_iter, self.COLUMN_NAME)
 
         self.emit(Events.SELECT_FUNC, selected_function_name, self.selected_bench_path)
         self.emit(Events.VISUALIZE_DOT, dot_file)
@@ -199,46 +275,102 @@ class DotButtons(Gtk.Box):
             self.emit(Events.DEACTIVATE_COMPARISON)
             return
 
+        self.function_stats = bbe_parser.extract_function_stats() or {}
         self.execution_info_collected = True
         self.emit(Events.TOTAL_DYN_INST, human_readable_number(self.execution_info.get(TOTAL_DYN_INST, 0)))
+        GLib.idle_add(self.populate_dot_files_box)
 
     def sort_by_name(self, button: Gtk.Button) -> None:
-        self.dot_files.sort(reverse=not self.sort_by_name_ascending)
+        self.sort_functions(self.COLUMN_NAME_RANK, self.sort_by_name_ascending)
         self.sort_by_name_ascending = not self.sort_by_name_ascending
 
         icon_name = "view-sort-ascending" if self.sort_by_name_ascending else "view-sort-descending"
         button.get_image().set_from_icon_name(icon_name, Gtk.IconSize.BUTTON)
 
-        self.populate_dot_files_box()
-
     def sort_by_exec(self, button: Gtk.Button) -> None:
         if not self.execution_info_collected:
             ErrorWindow("Execution information is still being collected.")
             return
 
-        self.dot_files.sort(key=lambda f: self.execution_info.get(os.path.basename(f)[:-4], 0),
-                            reverse=not self.sort_by_exec_ascending)
-
+        self.sort_functions(self.COLUMN_EXEC, self.sort_by_exec_ascending)
         self.sort_by_exec_ascending = not self.sort_by_exec_ascending
 
         icon_name = "view-sort-ascending" if  self.sort_by_exec_ascending else "view-sort-descending"
         button.get_image().set_from_icon_name(icon_name, Gtk.IconSize.BUTTON)
 
-        self.populate_dot_files_box()
+    def sort_functions(self, column: int, ascending: bool) -> None:
+        if self.functions_sort is None:
+            return
+
+        order = Gtk.SortType.ASCENDING if ascending else Gtk.SortType.DESCENDING
+        self.functions_sort.set_sort_column_id(column, order)
+        if self.selected_dot_file:
+            self.select_dot_file(self.selected_dot_file)
 
     def search_function(self, entry: Gtk.Entry) -> None:
-        search_text: str = entry.get_text().lower()
+        self.search_text = entry.get_text()
+        self.update_visible_functions()
+
+    def build_name_index(self, dot_files: List[str]) -> None:
+        name_index = NameIndex([get_function_name(dot_file) for dot_file in dot_files])
+        GLib.idle_add(self.name_index_built, dot_files, name_index)
+
+    def name_index_built(self, dot_files: List[str], name_index: NameIndex) -> bool:
+        # Another binary may have been loaded meanwhile
+        if dot_files is self.dot_files:
+            self.name_index = name_index
+            if self.search_text:
+                self.update_visible_functions()
+
+        return GLib.SOURCE_REMOVE
+
+    def find_functions(self, text: str) -> Optional[Set[int]]:
+        query, mode = parse_query(text)
+        if self.name_index is not None:
+            return self.name_index.search(query, mode)
+
+        # Until the index is built
+        return scan_names([get_function_name(dot_file) for dot_file in self.dot_files], query, mode)
+
+    def update_visible_functions(self) -> None:
+        """
+        Shows the functions matching the search text, only the rows that change visibility are updated.
+        """
+        try:
+            visible_functions = self.find_functions(self.search_text)
+        except re.error:
+            # Patterns being typed keep the previous matches
+            return
 
-        for dot_file_widget in self.dot_files_box.get_children():
-            dot_file_name: str = dot_file_widget.get_child().get_text().lower()
-            if search_text in dot_file_name:
-                dot_file_widget.show()
-            else:
-                dot_file_widget.hide()
+        if self.functions_store is not None:
+            all_functions = set(range(len(self.functions_store)))
+            previous = all_functions if self.visible_functions is None else self.visible_functions
+            current = all_functions if visible_functions is None else visible_functions
+            for ind in previous ^ current:
+                self.functions_store.set_value(self.functions_store.iter_nth_child(None, ind),
+                                               self.COLUMN_VISIBLE, ind in current)
+
+        self.visible_functions = visible_functions
 
     def get_num_of_funcs(self) -> int:
         return len(self.dot_files)
 
+    def get_neighbours(self, dot_file: str, distance: int) -> List[str]:
+        """
+        Returns the dot files next to the selected dot_file in the view, the closest first.
+        """
+        model, tree_iter = self.functions_view.get_selection().get_selected()
+        if tree_iter is None or model.get_value(tree_iter, self.COLUMN_PATH) != dot_file:
+            return []
+
+        ind = model.get_path(tree_iter).get_indices()[0]
+        rows = model.iter_n_children(None)
+        neighbours = []
+        for offset in range(1, distance + 1):
+            for neighbour_ind in (ind + offset, ind - offset):
+                if 0 <= neighbour_ind < rows:
+                    neighbours.append(model.get_value(model.iter_nth_child(None, neighbour_ind), self.COLUMN_PATH))
+        return neighbours
 
 
 class DotFileVisualizer(Gtk.Box):
@@ -256,6 +388,10 @@ class DotFileVisualizer(Gtk.Box):
         self.selected_func = ""
         self.project_dir = ""
         self.total_dyn_inst = ""
+        self.current_dot_file = ""
+
+        self.layout_cache = LayoutCache()
+        self.connect(Events.DESTROY, lambda _: self.layout_cache.close())
 
         self.paned = Gtk.Paned(orientation=Gtk.Orientation.HORIZONTAL, position=line_pos)
         self.pack_start(self.paned, True, True, 0)
@@ -314,15 +450,35 @@ class DotFileVisualizer(Gtk.Box):
         self.total_dyn_inst = number
 
     def visualize_graph(self, button: Gtk.Button, dot_file_path: str) -> None:
-        try:
-            with open(dot_file_path, 'rb') as file:
-                dot_code: bytes = file.read()
-                self.xdot_widget.set_dotcode(dot_code)
-
-        except FileNotFoundError:
+        # Graphs are laid out and parsed in the background (see LayoutCache), the UI thread only shows them
+        self.current_dot_file = dot_file_path
+        if not os.path.isfile(dot_file_path):
             ErrorWindow(f"Error: DOT file not found: {dot_file_path}")
-        except Exception as e:
-            ErrorWindow(f"Error: Unexpected Error: {e}")
+            return
+
+        graph = self.layout_cache.get_cached(dot_file_path)
+        if graph is not None:
+            self.show_graph(graph)
+        else:
+            self.layout_cache.request(dot_file_path, lambda graph, error:
+                                      GLib.idle_add(self.graph_loaded, dot_file_path, graph, error))
+
+        self.layout_cache.prefetch(self.dot_buttons.get_neighbours(dot_file_path, PREFETCH_DISTANCE))
+
+    def graph_loaded(self, dot_file_path: str, graph, error: Optional[str]) -> bool:
+        # The user may have selected another function meanwhile, nothing is loaded after close
+        if dot_file_path == self.current_dot_file:
+            if error:
+                ErrorWindow(f"Error: Unexpected Error: {error}")
+            elif graph is not None:
+                self.show_graph(graph)
+
+        return GLib.SOURCE_REMOVE
+
+    def show_graph(self, graph) -> None:
+        # As DotWidget.set_xdotcode does with the graph it parses
+        self.xdot_widget.graph = graph
+        self.xdot_widget.zoom_image(self.xdot_widget.zoom_ratio, center=True)
 
 
 class DotVisualizerWindow(MultiWindow):
@@ -36,6 +36,7 @@ class CSSClasses(str, Enum):
     ALIGN_LEFT = "align_left"
     FUNCTION_NAME = "function_name"
     SELECTED_BUTTON = "selected_btn"
+    FUNCTIONS_VIEW = "functions_view"
     PROJECT_NAME = "project_name"
     MENU_ITEM = "menu_item"
     VISUALIZER_DIVIDER = "visualizer-divider"
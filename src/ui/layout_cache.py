@@ -0,0 +1,186 @@
+# *******************************************************
+# * Copyright (c) 2022-2024 CAST.  All rights reserved. *
+# *******************************************************
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, NoReturn, Optional, Tuple
+
+from xdot.dot.parser import XDotParser
+from xdot.ui.elements import Graph
+
+from src.render_pool import get_render_command, get_render_path, is_up_to_date
+from src.render_supervisor import RenderStatus, RenderSupervisor
+
+LAYOUT_CACHE_DIR_NAME = ".layout_cache"
+XDOT_FORMAT = "xdot"
+DEFAULT_GRAPHS_CACHE_SIZE = 8
+PREFETCH_DISTANCE = 2
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def get_dot_key(dot_path: str) -> Tuple[str, int, int]:
+    stat = os.stat(dot_path)
+    return dot_path, stat.st_mtime_ns, stat.st_size
+
+
+class LayoutCache:
+    """
+    Laid out (xdot) graphs of the dot files for DotWidget.
+
+    The xdot code of a dot file is taken from the render of asm_graph.py --render xdot when it is up to date,
+    then from the layout cache next to the dot file (.layout_cache/<sha1 of the dot file>.xdot),
+    graphviz lays out the graph into the cache only when both miss. Parsed graphs are kept in an LRU.
+
+    Requested graphs are loaded by one background thread and prefetched graphs by another,
+    so a prefetch never delays the graph the user is waiting for.
+    """
+
+    def __init__(self, max_graphs: int = DEFAULT_GRAPHS_CACHE_SIZE, supervisor: RenderSupervisor = None):
+        self.max_graphs = max_graphs
+        self.supervisor = supervisor or RenderSupervisor()
+        self.__graphs: "OrderedDict[Tuple[str, int, int], Graph]" = OrderedDict()
+        # Futures of the graphs being loaded by dot file and of the prefetched ones
+        self.__loading: Dict[str, Future] = {}
+        self.__prefetches: Dict[str, Future] = {}
+        # Reentrant: cancelling a future runs its done callbacks in place
+        self.__lock = threading.RLock()
+        self.__loader = ThreadPoolExecutor(max_workers=1)
+        self.__prefetcher = ThreadPoolExecutor(max_workers=1)
+
+    def get_cached(self, dot_path: str) -> Optional[Graph]:
+        try:
+            key = get_dot_key(dot_path)
+        except OSError:
+            return None
+
+        with self.__lock:
+            graph = self.__graphs.get(key)
+            if graph is not None:
+                self.__graphs.move_to_end(key)
+            return graph
+
+    def request(self, dot_path: str, callback: Callable[[Optional[Graph], Optional[str]], NoReturn]) -> NoReturn:
+        """
+        Loads the graph in the background and calls callback(graph, error) from the loading thread,
+        both are None when the loading is cancelled by close.
+        """
+        future, _ = self.__submit(self.__loader, dot_path)
+        future.add_done_callback(lambda done: callback(*self.__get_result(done)))
+
+    def prefetch(self, dot_paths: Iterable[str]) -> NoReturn:
+        """
+        Loads the graphs in the background, the prefetches of other graphs that are not started are cancelled.
+        """
+        dot_paths = list(dot_paths)
+        with self.__lock:
+            for dot_path, future in list(self.__prefetches.items()):
+                if future.done() or dot_path not in dot_paths:
+                    future.cancel()
+                    del self.__prefetches[dot_path]
+
+            for dot_path in dot_paths:
+                if dot_path in self.__prefetches or self.get_cached(dot_path) is not None:
+                    continue
+
+                future, submitted = self.__submit(self.__prefetcher, dot_path)
+                if submitted:
+                    self.__prefetches[dot_path] = future
+
+    def load(self, dot_path: str) -> Graph:
+        key = get_dot_key(dot_path)
+        with self.__lock:
+            graph = self.__graphs.get(key)
+        if graph is not None:
+            return graph
+
+        graph = XDotParser(self.get_xdot_code(dot_path)).parse()
+        with self.__lock:
+            self.__graphs[key] = graph
+            self.__graphs.move_to_end(key)
+            while len(self.__graphs) > self.max_graphs:
+                self.__graphs.popitem(last=False)
+
+        return graph
+
+    def get_xdot_code(self, dot_path: str) -> bytes:
+        rendered_path = get_render_path(dot_path, XDOT_FORMAT)
+        if is_up_to_date(dot_path, rendered_path):
+            return read_file(rendered_path)
+
+        cache_dir = os.path.join(os.path.dirname(dot_path), LAYOUT_CACHE_DIR_NAME)
+        cached_path = os.path.join(cache_dir, hashlib.sha1(read_file(dot_path)).hexdigest() + "." + XDOT_FORMAT)
+        try:
+            return read_file(cached_path)
+        except FileNotFoundError:
+            pass
+
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+        except OSError:
+            # Read-only projects are laid out without the cache
+            cache_dir = cached_path = None
+
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            program, args = get_render_command(dot_path, XDOT_FORMAT)
+            status, message = self.supervisor.run_graphviz(program, args, dot_path, tmp_path)
+            if status != RenderStatus.OK:
+                raise RuntimeError(f"Cannot lay out {os.path.basename(dot_path)}: {status.value}. {message}")
+
+            xdot_code = read_file(tmp_path)
+            if cached_path:
+                os.replace(tmp_path, cached_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        return xdot_code
+
+    def close(self) -> NoReturn:
+        self.__loader.shutdown(wait=False, cancel_futures=True)
+        self.__prefetcher.shutdown(wait=False, cancel_futures=True)
+
+    def __submit(self, executor: ThreadPoolExecutor, dot_path: str) -> Tuple[Future, bool]:
+        """
+        Returns the future of the graph and whether it is submitted to the executor now.
+        A request takes over the prefetch of the graph when the prefetch is not started,
+        the futures of other requests are shared.
+        """
+        with self.__lock:
+            future = self.__loading.get(dot_path)
+            if future is not None:
+                is_prefetch = self.__prefetches.get(dot_path) is future
+                if executor is not self.__loader or not is_prefetch or not future.cancel():
+                    return future, False
+                del self.__prefetches[dot_path]
+
+            future = executor.submit(self.load, dot_path)
+            self.__loading[dot_path] = future
+
+        future.add_done_callback(lambda done: self.__forget(dot_path, done))
+        return future, True
+
+    def __forget(self, dot_path: str, future: Future) -> NoReturn:
+        with self.__lock:
+            if self.__loading.get(dot_path) is future:
+                del self.__loading[dot_path]
+
+    @staticmethod
+    def __get_result(future: Future) -> Tuple[Optional[Graph], Optional[str]]:
+        if future.cancelled():
+            return None, None
+
+        try:
+            return future.result(), None
+        except Exception as e:
+            return None, str(e)
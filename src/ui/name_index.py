@@ -0,0 +1,177 @@
+# *******************************************************
+# * Copyright (c) 2022-2024 CAST.  All rights reserved. *
+# *******************************************************
+
+import math
+import re
+from array import array
+from collections import Counter
+from enum import Enum
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+GRAM_SIZE = 3
+# Fuzzy matches share at least this part of the trigrams of the query, one typo breaks up to three of them
+FUZZY_MIN_SHARED = 0.5
+# Only the shortest posting lists are intersected, the remaining candidates are checked against the names
+MAX_INTERSECTED_POSTINGS = 3
+FUZZY_PREFIX = "~"
+REGEX_PREFIX = "/"
+REGEX_SPECIAL_CHARS = set(".^$*+?{}[]()|")
+REGEX_OPTIONAL_CHARS = set("*?{")
+REGEX_SKIPPED_PARTS = {"[": "]", "{": "}"}
+REGEX_CODE_ESCAPES = set("xuUN0123456789")
+
+
+class SearchMode(str, Enum):
+    SUBSTRING = "substring"
+    FUZZY = "fuzzy"
+    REGEX = "regex"
+
+
+def parse_query(text: str) -> Tuple[str, SearchMode]:
+    """
+    Returns the query and the search mode of the text of a search entry: "~name" is fuzzy, "/pattern" is a regex.
+    """
+    if text.startswith(FUZZY_PREFIX):
+        return text[len(FUZZY_PREFIX):].lower(), SearchMode.FUZZY
+    if text.startswith(REGEX_PREFIX):
+        return text[len(REGEX_PREFIX):], SearchMode.REGEX
+
+    return text.lower(), SearchMode.SUBSTRING
+
+
+def get_trigrams(text: str) -> Set[str]:
+    return {text[ind:ind + GRAM_SIZE] for ind in range(len(text) - GRAM_SIZE + 1)}
+
+
+def get_regex_literals(pattern: str) -> List[str]:
+    """
+    Returns the literal runs every match of pattern contains, none for the patterns with alternations or groups.
+    """
+    if "|" in pattern or "(" in pattern:
+        return []
+
+    literals = []
+    run = ""
+    ind = 0
+    while ind < len(pattern):
+        char = pattern[ind]
+        if char == "\\" and ind + 1 < len(pattern):
+            ind += 1
+            char = pattern[ind]
+            # Character codes (\x41) and back references take the chars after them
+            if char in REGEX_CODE_ESCAPES:
+                return []
+            # Character classes (\d, \w) and anchors (\b) are not literals
+            literal = not char.isalnum()
+        else:
+            literal = char not in REGEX_SPECIAL_CHARS
+
+        if literal:
+            run += char
+        else:
+            # The char before a quantifier may be missing from the match
+            if char in REGEX_OPTIONAL_CHARS:
+                run = run[:-1]
+            # Classes and repetition counts are skipped
+            if char in REGEX_SKIPPED_PARTS:
+                ind = pattern.find(REGEX_SKIPPED_PARTS[char], ind + 1)
+                if ind < 0:
+                    break
+            literals.append(run)
+            run = ""
+        ind += 1
+
+    literals.append(run)
+    return [literal.lower() for literal in literals if len(literal) >= GRAM_SIZE]
+
+
+def scan_names(names: Sequence[str], query: str, mode: SearchMode = SearchMode.SUBSTRING) -> Optional[Set[int]]:
+    """
+    Searches the names one by one, as NameIndex.search does. Fuzzy queries match as substrings.
+    """
+    if not query:
+        return None
+
+    if mode == SearchMode.REGEX:
+        regex = re.compile(query, re.IGNORECASE)
+        return {ind for ind, name in enumerate(names) if regex.search(name)}
+
+    return {ind for ind, name in enumerate(names) if query in name.lower()}
+
+
+class NameIndex:
+    """
+    Trigram index of names for case-insensitive searches. The posting list of a trigram holds the positions
+    of the names that contain it, a query intersects the posting lists of its trigrams and checks only
+    the names left. Queries shorter than a trigram scan all the names.
+    """
+
+    def __init__(self, names: Sequence[str]):
+        self.names = list(names)
+        self.lower_names = [name.lower() for name in self.names]
+        self.postings: Dict[str, array] = {}
+
+        for ind, name in enumerate(self.lower_names):
+            for trigram in get_trigrams(name):
+                posting = self.postings.get(trigram)
+                if posting is None:
+                    posting = self.postings[trigram] = array("I")
+                posting.append(ind)
+
+    def search(self, query: str, mode: SearchMode = SearchMode.SUBSTRING) -> Optional[Set[int]]:
+        """
+        Returns the positions of the matching names, None for an empty query (all the names match).
+        Raises re.error for an invalid regex.
+        """
+        if not query:
+            return None
+
+        if mode == SearchMode.REGEX:
+            return self.search_regex(query)
+        if mode == SearchMode.FUZZY:
+            return self.search_fuzzy(query)
+
+        return self.search_substring(query)
+
+    def search_substring(self, query: str) -> Set[int]:
+        candidates = self.get_candidates(get_trigrams(query))
+        return {ind for ind in candidates if query in self.lower_names[ind]}
+
+    def search_fuzzy(self, query: str) -> Set[int]:
+        trigrams = get_trigrams(query)
+        if not trigrams:
+            return self.search_substring(query)
+
+        counts = Counter()
+        for trigram in trigrams:
+            counts.update(self.postings.get(trigram, ()))
+
+        min_shared = math.ceil(len(trigrams) * FUZZY_MIN_SHARED)
+        return {ind for ind, count in counts.items() if count >= min_shared}
+
+    def search_regex(self, pattern: str) -> Set[int]:
+        regex = re.compile(pattern, re.IGNORECASE)
+        trigrams = set()
+        for literal in get_regex_literals(pattern):
+            trigrams |= get_trigrams(literal)
+
+        return {ind for ind in self.get_candidates(trigrams) if regex.search(self.names[ind])}
+
+    def get_candidates(self, trigrams: Set[str]) -> Sequence[int]:
+        if not trigrams:
+            return range(len(self.names))
+
+        postings = []
+        for trigram in trigrams:
+            posting = self.postings.get(trigram)
+            if posting is None:
+                return ()
+            postings.append(posting)
+
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:MAX_INTERSECTED_POSTINGS]:
+            candidates.intersection_update(posting)
+
+        return candidates
@@ -2,15 +2,15 @@
 # * Copyright (c) 2022-2024 CAST.  All rights reserved. *
 # *******************************************************
 
-import glob
 import os
 import threading
 from uuid import uuid4
 import subprocess
 from typing import Optional, List
 
-from asm_graph import load_funcs
+from asm_graph import load_funcs, iter_funcs
 from plugins.helper import apply_plugins_to_func, load_plugins, save_plugins, validate_plugin
+from src.file_reader import find_inputs
 from src.xlsx_writer import XLSXWriter
 from src.ui.action_boxes import TextBox, FileSelectorBox
 from src.ui.constants import CUSTOM_PLUGIN_FUNCTION_NAME, DOWNLOADS_DIR
@@ -43,7 +43,7 @@ class PluginsManager:
             self.run_on_file_option.set_tooltip_text("Select a file.")
 
     def get_asm_path(self) -> str:
-        asm_files: List[str] = glob.glob(os.path.join(self.work_dir, "*.asm"))
+        asm_files: List[str] = find_inputs(self.work_dir, ".asm")
         if len(asm_files) != 1:
             return ""
         return asm_files[0]
@@ -53,7 +53,7 @@ class PluginsManager:
         self.selected_func = cur_func_name
 
         if cur_asm_file_dir:
-            self.asm_file = glob.glob(os.path.join(cur_asm_file_dir, "*.asm"))[0]
+            self.asm_file = find_inputs(cur_asm_file_dir, ".asm")[0]
             self.run_on_file_option.set_sensitive(True)
 
     # FIXME: When selects check box pop-up closes
@@ -192,8 +192,7 @@ class PluginsManager:
             xlsx_file_path = os.path.join(DOWNLOADS_DIR, f"{uuid4().hex}plugin.xlsx")
             self.xlsx_writer = XLSXWriter(xlsx_file_path)
 
-            asm_funcs = load_funcs(self.asm_file, "all")
-            for func_name, func_content in asm_funcs.items():
+            for func_name, func_content in iter_funcs(self.asm_file, "all"):
                 apply_plugins_to_func(func_name, func_content, self.plugins_data, self.xlsx_writer)
 
             self.xlsx_writer.dump(-2)
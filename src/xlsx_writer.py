@@ -6,6 +6,8 @@ import openpyxl
 from openpyxl.styles import Font, Alignment, DEFAULT_FONT
 from typing import List, Dict, NoReturn
 from .graph import Node, FlowGraph
+from .inst_mix import InstructionMix
+from .opcodes import GROUP_NAMES
 
 
 DEFAULT_FONT.name = "Arial"
@@ -46,6 +48,23 @@ class XLSXWriter:
         for cell in ['A1', 'B1', 'C1', 'D1']:
             self.__worksheet[cell].font = bold_font
 
+    def write_inst_mix(self, inst_mix: InstructionMix) -> NoReturn:
+        self.__worksheet.title = "InstructionMix"
+        self.__worksheet.append(["Function Name", "Executed instructions"] + GROUP_NAMES)
+
+        self.__worksheet.column_dimensions["A"].width = 30
+        self.__worksheet.column_dimensions["B"].width = 20
+        for cell in self.__worksheet[1]:
+            cell.font = Font(bold=True)
+
+        rows = [[function, sum(groups.values())] + [groups[group] for group in GROUP_NAMES]
+                for function, groups in inst_mix.get_function_counts().items()]
+        for row in sorted(rows, key=lambda k: k[1], reverse=True):
+            if row[1]:
+                self.__worksheet.append(row)
+
+        self.__workbook.save(self.__xlsx_file)
+
     def create_checkers_sheet(self, title: str) -> NoReturn:
         if title in self.__workbook.get_sheet_names():
             return
@@ -80,33 +99,12 @@ class XLSXWriter:
                               node: Node,
                               fusions: List[Dict],
                               highlight_fuse=False) -> NoReturn:
+        self.append_checker_rows(title, make_checker_rows(func_name, node, fusions, highlight_fuse))
+
+    def append_checker_rows(self, title: str, rows: List[List]) -> NoReturn:
         self.create_checkers_sheet(title)
         self.__worksheet = self.__workbook.get_sheet_by_name(title)
-
-        for current_fuse in fusions:
-            for key, value in current_fuse.items():
-                content = node.get_inner_content().replace("\l\t", "\n")
-
-                if highlight_fuse and rich_text_is_available:
-
-                    key = str(key) + "\n"
-                    value = str(value) + "\n"
-                    key_index = content.index(key)
-                    value_index = content.index(value)
-
-                    rich_string = CellRichText(
-                        content[: key_index],
-                        TextBlock(red_font, key),
-                        content[key_index + len(key): value_index],
-                        TextBlock(red_font, value),
-                        content[value_index + len(value):]
-                    )
-
-                    content = rich_string
-
-                input_out = f"{key} \n{value}"
-                row = [func_name, content, input_out]
-                self.__worksheet.__rows.append(row)
+        self.__worksheet.__rows.extend(rows)
 
     def dump(self, row_id: int) -> NoReturn:
         for worksheet in self.__workbook.get_sheet_names():
@@ -124,12 +122,113 @@ class XLSXWriter:
 
     def append(self, graph: FlowGraph,
                func_name: str) -> NoReturn:
-        for node in graph.nodes:
-            if node.is_singleton:
-                content = node.get_inner_content().replace("\l\t", "\n")
-                bb_address_label = f"{node.get_address().strip(':')} " \
-                                   f"({node.get_label().strip(':')})"
-                exec_count = node.get_execution_count()
-                row = [func_name, bb_address_label, content, exec_count]
-
-                self.__worksheet.__rows.append(row)
+        self.append_rows(make_singleton_rows(graph, func_name))
+
+    def append_rows(self, rows: List[List]) -> NoReturn:
+        self.__worksheet.__rows.extend(rows)
+
+    def merge(self, collector: "RowsCollector") -> NoReturn:
+        for title, rows in collector.rows:
+            if title is None:
+                self.append_rows(rows)
+            else:
+                self.append_checker_rows(title, rows)
+
+
+class RowsCollector:
+    """
+    Collects the rows that would be appended to XLSXWriter as plain data,
+    so they can be sent back from worker processes and merged by the parent.
+    """
+
+    def __init__(self):
+        # List of (sheet title, rows), None title stands for the singletons sheet
+        self.rows = []
+
+    def append(self, graph: FlowGraph,
+               func_name: str) -> NoReturn:
+        rows = make_singleton_rows(graph, func_name)
+        if rows:
+            self.rows.append((None, rows))
+
+    def append_checker_result(self, title: str,
+                              func_name: str,
+                              node: Node,
+                              fusions: List[Dict],
+                              highlight_fuse=False) -> NoReturn:
+        self.rows.append((title, make_checker_rows(func_name, node, fusions, highlight_fuse)))
+
+    def to_data(self) -> List:
+        """
+        Returns the rows as JSON data, rich text cells become {"runs": [[text, highlighted], ...]}.
+        """
+        return [[title, [[dump_cell(cell) for cell in row] for row in rows]] for title, rows in self.rows]
+
+    @classmethod
+    def from_data(cls, data: List) -> "RowsCollector":
+        collector = cls()
+        collector.rows = [(title, [[load_cell(cell) for cell in row] for row in rows]) for title, rows in data]
+        return collector
+
+
+def dump_cell(cell):
+    if rich_text_is_available and isinstance(cell, CellRichText):
+        return {"runs": [[block.text, True] if isinstance(block, TextBlock) else [str(block), False]
+                         for block in cell]}
+    return cell
+
+
+def load_cell(cell):
+    if not isinstance(cell, dict):
+        return cell
+
+    runs = cell["runs"]
+    if not rich_text_is_available:
+        return "".join(text for text, _ in runs)
+    return CellRichText(*[TextBlock(red_font, text) if highlighted else text for text, highlighted in runs])
+
+
+def make_checker_rows(func_name: str,
+                      node: Node,
+                      fusions: List[Dict],
+                      highlight_fuse=False) -> List[List]:
+    rows = []
+    for current_fuse in fusions:
+        for key, value in current_fuse.items():
+            content = node.get_inner_content().replace("\l\t", "\n")
+
+            if highlight_fuse and rich_text_is_available:
+
+                key = str(key) + "\n"
+                value = str(value) + "\n"
+                key_index = content.index(key)
+                value_index = content.index(value)
+
+                rich_string = CellRichText(
+                    content[: key_index],
+                    TextBlock(red_font, key),
+                    content[key_index + len(key): value_index],
+                    TextBlock(red_font, value),
+                    content[value_index + len(value):]
+                )
+
+                content = rich_string
+
+            input_out = f"{key} \n{value}"
+            rows.append([func_name, content, input_out])
+
+    return rows
+
+
+def make_singleton_rows(graph: FlowGraph,
+                        func_name: str) -> List[List]:
+    rows = []
+    for node in graph.nodes:
+        if node.is_singleton:
+            content = node.get_inner_content().replace("\l\t", "\n")
+            bb_address_label = f"{node.get_address().strip(':')} " \
+                               f"({node.get_label().strip(':')})"
+            exec_count = node.get_execution_count()
+            rows.append([func_name, bb_address_label, content, exec_count])
+
+    return rows